@@ -0,0 +1,124 @@
+"""
+Production media delivery.
+
+With a front proxy (settings.MEDIA_DELIVERY = 'accel' for nginx, 'sendfile' for
+Apache/lighttpd) the view only checks the path and hands the body off with
+X-Accel-Redirect / X-Sendfile, so a worker is busy for microseconds. Without one
+the file is streamed by FileResponse, with single-range Range support,
+ETag/Last-Modified revalidation and long-lived caching for content-addressed names.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.views.decorators.http import require_safe
+
+from .storage import is_immutable_name
+
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+DEFAULT_CACHE = 'public, max-age=3600'
+RANGE_HEADER = re.compile(r'^bytes=(\d*)-(\d*)$')
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def _resolve(path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404("Media file not found")
+    if not os.path.isfile(full_path):
+        raise Http404("Media file not found")
+    return full_path
+
+
+def _byte_range(header, size):
+    """(start, end) inclusive for a single 'bytes=' range, None to send the whole file, or False if unsatisfiable"""
+    match = RANGE_HEADER.match(header.strip())
+    if not match or not any(match.groups()):
+        return None  # Malformed or multi-range: RFC 9110 allows ignoring it
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _read_range(full_path, start, end):
+    with open(full_path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _not_modified(request, etag, mtime):
+    """If-None-Match wins when present (RFC 9110 13.2.2); otherwise compare If-Modified-Since to the mtime"""
+    if 'If-None-Match' in request.headers:
+        return request.headers['If-None-Match'] == etag
+    since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    return since is not None and int(mtime) <= since
+
+
+@require_safe
+def serve_media(request, path):
+    full_path = _resolve(path)
+    stat = os.stat(full_path)
+    etag = quote_etag(f"{stat.st_mtime_ns:x}-{stat.st_size:x}")
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+
+    if _not_modified(request, etag, stat.st_mtime):
+        response = HttpResponseNotModified()
+    else:
+        delivery = getattr(settings, 'MEDIA_DELIVERY', 'django')
+        if delivery == 'accel':
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX.rstrip('/') + '/' + quote(path)
+        elif delivery == 'sendfile':
+            response = HttpResponse(content_type=content_type)
+            response['X-Sendfile'] = full_path
+        else:
+            response = _stream(request, full_path, stat.st_size, etag, content_type)
+        if encoding:
+            response['Content-Encoding'] = encoding
+        response['Last-Modified'] = http_date(stat.st_mtime)
+
+    response['ETag'] = etag
+    response['Cache-Control'] = IMMUTABLE_CACHE if is_immutable_name(path) else DEFAULT_CACHE
+    return response
+
+
+def _stream(request, full_path, size, etag, content_type):
+    byte_range = None
+    if 'Range' in request.headers and request.headers.get('If-Range', etag) == etag:
+        byte_range = _byte_range(request.headers['Range'], size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+    elif byte_range:
+        start, end = byte_range
+        response = StreamingHttpResponse(_read_range(full_path, start, end), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    else:
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    response['Accept-Ranges'] = 'bytes'
+    return response
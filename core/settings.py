@@ -96,10 +96,19 @@ if DATABASE_URL:
     }
 else:
     # Development (Local) - SQLite kullan
+    # IMMEDIATE: eşzamanlı istekler yazma kilidini beklesin, "database is locked" ile düşmesin.
+    # Test veritabanı da dosyada olsun (in-memory shared cache thread'ler arasında tablo kilidi verir)
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,
+            },
+            'TEST': {
+                'NAME': BASE_DIR / 'test_db.sqlite3',
+            },
         }
     }
 
@@ -128,6 +137,44 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Yüklenen dosyalar içeriklerinin hash'i ile blobs/ altında bir kez saklanır (core/storage.py),
+# böylece aynı fotoğraf tekrar yüklendiğinde diske yeniden yazılmaz ve uzun süre cache'lenebilir.
+# Django 5.x STATICFILES_STORAGE'ı okumaz; staticfiles burada fiilen kullanılan backend ile aynı tutuldu.
+STORAGES = {
+    'default': {'BACKEND': 'core.storage.ContentAddressedStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+# Production'da media dosyalarının teslimi (core/media.py):
+#   'django'   -> FileResponse + Range desteği
+#   'accel'    -> nginx X-Accel-Redirect (MEDIA_ACCEL_PREFIX internal location'a yönlenir)
+#   'sendfile' -> Apache/lighttpd X-Sendfile
+MEDIA_DELIVERY = os.getenv('MEDIA_DELIVERY', 'django')
+MEDIA_ACCEL_PREFIX = os.getenv('MEDIA_ACCEL_PREFIX', '/protected-media/')
+
+# Küçük resim / WebP türevlerini üreten process sayısı (0 = istek içinde, senkron)
+IMAGE_DERIVATIVE_WORKERS = int(os.getenv('IMAGE_DERIVATIVE_WORKERS', '2'))
+
+# Etiketsiz yeni ilanlara arka planda etiket çıkaran thread sayısı (0 = istek içinde, senkron)
+TAG_ENRICHMENT_WORKERS = int(os.getenv('TAG_ENRICHMENT_WORKERS', '1'))
+
+# Bellek içi indeksleri (etiket tamamlama, arama genişletme grafiği) arka planda yeniden yükleyen thread sayısı (0 = istek içinde, senkron)
+INDEX_REFRESH_WORKERS = int(os.getenv('INDEX_REFRESH_WORKERS', '1'))
+
+# === Wikidata (market.wikidata_client) ===
+# Testlerde yerel bir stub sunucuya yönlendirilebilir
+WIKIDATA_SEARCH_URL = os.getenv('WIKIDATA_SEARCH_URL', 'https://www.wikidata.org/w/api.php')
+WIKIDATA_SPARQL_URL = os.getenv('WIKIDATA_SPARQL_URL', 'https://query.wikidata.org/sparql')
+# Bağlantı havuzu / eşzamanlı istek sayısı ve bir öneri isteği için toplam süre (saniye)
+WIKIDATA_POOL_SIZE = int(os.getenv('WIKIDATA_POOL_SIZE', '8'))
+WIKIDATA_DEADLINE = float(os.getenv('WIKIDATA_DEADLINE', '4'))
+# Art arda bu kadar hata/zaman aşımından sonra Wikidata'ya gitmeyi keser, RESET saniye sonra tekrar dener
+WIKIDATA_BREAKER_THRESHOLD = int(os.getenv('WIKIDATA_BREAKER_THRESHOLD', '5'))
+WIKIDATA_BREAKER_RESET = float(os.getenv('WIKIDATA_BREAKER_RESET', '30'))
+# Yerel taksonomide (load_wikidata_taxonomy) bulunmayan terimler için canlı Wikidata'ya git;
+# False ise öneriler hiç dış istek yapmaz
+WIKIDATA_LIVE_FALLBACK = os.getenv('WIKIDATA_LIVE_FALLBACK', 'True').lower() in ('true', '1', 'yes')
+
 # === Default primary key field type ===
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -0,0 +1,88 @@
+"""
+Media storage whose file names are derived from the file content.
+
+ContentAddressedStorage stores each distinct upload once, under blobs/, with a
+market.MediaBlob row that counts how many image fields use it (see market.blobs
+for the counting and garbage collection):
+
+    avatars/me.png -> blobs/3f/3f2a9c01b7de...e1.png
+
+A blob name always refers to the same bytes, which lets core.media serve
+uploads with immutable cache headers; so do older uploads whose names carry a
+content hash (avatars/me.3f2a9c01b7de.png). Names under unhashed_prefixes
+(derivatives, whose names are already derived from a hashed original) are
+stored as given.
+"""
+import hashlib
+import os
+import re
+import tempfile
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils import timezone
+
+HASH_LENGTH = 12
+HASHED_NAME = re.compile(r'\.[0-9a-f]{%d}\.' % HASH_LENGTH)
+BLOB_DIR = 'blobs'
+IMMUTABLE_PREFIXES = (f'{BLOB_DIR}/', f'derivatives/{BLOB_DIR}/')
+
+
+def is_immutable_name(name):
+    """True if the storage name can only ever refer to one content"""
+    return name.startswith(IMMUTABLE_PREFIXES) or bool(HASHED_NAME.search(os.path.basename(name)))
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    unhashed_prefixes = ('derivatives/',)
+
+    def get_available_name(self, name, max_length=None):
+        if name.startswith(self.unhashed_prefixes):
+            return super().get_available_name(name, max_length)
+        # The final name comes from the content in _save
+        return name
+
+    def _save(self, name, content):
+        if name.startswith(self.unhashed_prefixes):
+            return super()._save(name, content)
+
+        # Hash while copying to a temporary file, so the upload is read only once
+        tmp_dir = self.path(f'{BLOB_DIR}/tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    size += len(chunk)
+                    out.write(chunk)
+            hexdigest = digest.hexdigest()
+            MediaBlob = apps.get_model('market', 'MediaBlob')
+            with transaction.atomic():
+                # Touching the row first locks it against market.blobs.collect_garbage, which then
+                # keeps it. If the collector removed it already, the row is created again and the
+                # file is written again instead of trusting one that may be about to go.
+                MediaBlob.objects.filter(digest=hexdigest).update(touched_at=timezone.now())
+                row, created = MediaBlob.objects.get_or_create(digest=hexdigest, defaults={
+                    'name': f"{BLOB_DIR}/{hexdigest[:2]}/{hexdigest}{os.path.splitext(name)[1].lower()}",
+                    'size': size,
+                })
+                blob = row.name
+                full_path = self.path(blob)
+                if not created and os.path.exists(full_path):
+                    os.remove(tmp_path)
+                else:
+                    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                    os.replace(tmp_path, full_path)
+                    # mkstemp creates 0600 files; blobs must stay readable by a front proxy
+                    os.chmod(full_path, self.file_permissions_mode if self.file_permissions_mode is not None else 0o644)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return blob
@@ -1,9 +1,9 @@
 from django.contrib import admin
 from django.urls import path, include, re_path
 from django.views.generic import TemplateView
-from django.views.static import serve
 from django.conf import settings
 from django.conf.urls.static import static
+from core.media import serve_media
 
 urlpatterns = [
     # Admin Paneli
@@ -23,11 +23,11 @@ urlpatterns = [
 ]
 
 # Media files serving
-# Development'ta static() kullan, production'da serve() kullan
+# Development'ta static() kullan, production'da serve_media() kullan
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 else:
-    # Production'da media dosyalarını serve et
+    # Production'da media dosyaları: proxy varsa X-Accel-Redirect/X-Sendfile, yoksa Range destekli FileResponse
     urlpatterns += [
-        re_path(r'^media/(?P<path>.*)$', serve, {'document_root': settings.MEDIA_ROOT}),
+        re_path(r'^media/(?P<path>.*)$', serve_media),
 ]
\ No newline at end of file
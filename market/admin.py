@@ -19,7 +19,7 @@ class ServiceRequestAdmin(admin.ModelAdmin):
 @admin.register(TimeTransaction)
 class TimeTransactionAdmin(admin.ModelAdmin):
     # DÜZELTME: Eski 'duration' ve 'status' alanlarını kaldırdık, 'amount' ekledik
-    list_display = ('offer', 'request', 'amount', 'created_at')
+    list_display = ('offer', 'request', 'sender', 'receiver', 'amount', 'created_at')
     list_filter = ('created_at',)
 
 @admin.register(InteractionRequest)
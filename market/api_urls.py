@@ -5,11 +5,11 @@ from .views import (
     notification_count, notification_list_api, mark_notifications_read_api,
     create_interaction_api, 
     my_profile_api, interaction_messages_api, interaction_action_api, my_interactions_api,
-    my_listings_api, profile_by_username_api, user_listings_api, user_history_api,
+    my_listings_api, profile_by_username_api, profile_cards_api, recommended_offers_api, user_listings_api, user_history_api,
     user_reviews_api, create_review_api, check_review_exists_api, edit_profile_api, add_review_api,
     block_user_api, blocked_users_api, delete_conversation_api, delete_message_api,
     forum_topics_api, forum_topic_detail_api, forum_comments_api, pending_requests_api,
-    admin_dashboard_stats_api, wikidata_tags_api
+    admin_dashboard_stats_api, tag_autocomplete_api, wikidata_tags_api, wikidata_status_api
 )
 
 router = DefaultRouter()
@@ -24,6 +24,7 @@ urlpatterns = [
     
     path('profile/', my_profile_api, name='api-profile'),
     path('profile/edit/', edit_profile_api, name='api-edit-profile'),
+    path('profiles/', profile_cards_api, name='api-profile-cards'),
     path('profile/<str:username>/', profile_by_username_api, name='api-profile-by-username'),
     path('profile/<str:username>/listings/', user_listings_api, name='api-user-listings'),
     path('profile/<str:username>/history/', user_history_api, name='api-user-history'),
@@ -32,6 +33,7 @@ urlpatterns = [
     path('review/create/', create_review_api, name='api-create-review'),
     path('review/check/<str:listing_type>/<int:listing_id>/', check_review_exists_api, name='api-check-review'),
     path('interactions/', my_interactions_api, name='api-my-interactions'),
+    path('recommendations/', recommended_offers_api, name='api-recommendations'),
     path('my-listings/', my_listings_api, name='api-my-listings'),
     path('pending-requests/', pending_requests_api, name='api-pending-requests'),
     path('interaction/<int:interaction_id>/messages/', interaction_messages_api, name='api-interaction-messages'),
@@ -48,5 +50,7 @@ urlpatterns = [
     path('forum-topics/<int:topic_id>/', forum_topic_detail_api, name='api-forum-topic-detail'),
     path('forum-topics/<int:topic_id>/comments/', forum_comments_api, name='api-forum-comments'),
     path('admin/dashboard-stats/', admin_dashboard_stats_api, name='api-admin-dashboard-stats'),
+    path('tags/autocomplete/', tag_autocomplete_api, name='api-tag-autocomplete'),
     path('wikidata/tags/', wikidata_tags_api, name='api-wikidata-tags'),
+    path('wikidata/status/', wikidata_status_api, name='api-wikidata-status'),
 ]
\ No newline at end of file
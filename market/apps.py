@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class MarketConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'market'
+
+    def ready(self):
+        # Signal receivers that live outside models.py
+        from . import blobs, enrichment, images, profile_cache, recommendations, tagging  # noqa: F401
+
+    def warm_up(self):
+        """Load the in-memory indexes in the background; called once per server process (core.wsgi, core.asgi)"""
+        from .search import graph
+        from .tag_index import index as tag_index
+        tag_index.refresh()
+        graph.refresh()
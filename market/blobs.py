@@ -0,0 +1,150 @@
+"""
+Reference counting and garbage collection for content-addressed media blobs.
+
+ContentAddressedStorage (core.storage) stores every distinct upload once and
+records it as a MediaBlob. The receivers below keep MediaBlob.ref_count equal to
+the number of image fields that point at the blob, and collect_garbage() deletes
+blobs nobody references any more (with their derivatives) in batches. Names that
+are not blobs (files uploaded before the storage existed) are simply ignored.
+"""
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_init, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .images import FORMATS, IMAGE_FIELDS, VARIANTS, derivative_name
+from .models import MediaBlob, Profile, ServiceOffer, ServiceRequest
+
+GC_GRACE = timedelta(hours=1)
+GC_BATCH_SIZE = 500
+
+
+def add_reference(name):
+    if name:
+        MediaBlob.objects.filter(name=name).update(ref_count=F('ref_count') + 1, touched_at=timezone.now())
+
+
+def release_reference(name):
+    if name:
+        MediaBlob.objects.filter(name=name, ref_count__gt=0).update(ref_count=F('ref_count') - 1, touched_at=timezone.now())
+
+
+# Stored name not loaded (image field deferred by .only()/.defer())
+_UNKNOWN = object()
+
+
+def _field(instance):
+    return IMAGE_FIELDS[type(instance)]
+
+
+def _image_name(instance):
+    field_file = getattr(instance, _field(instance))
+    return field_file.name if field_file else None
+
+
+def _load_stored_name(instance):
+    if instance._stored_image_name is _UNKNOWN:
+        row = type(instance).objects.filter(pk=instance.pk).values_list(_field(instance), flat=True).first()
+        instance._stored_image_name = row or None
+
+
+@receiver(post_init, sender=Profile)
+@receiver(post_init, sender=ServiceOffer)
+@receiver(post_init, sender=ServiceRequest)
+def remember_image_name(sender, instance, **kwargs):
+    if not instance.pk:
+        instance._stored_image_name = None
+    elif _field(instance) in instance.get_deferred_fields():
+        instance._stored_image_name = _UNKNOWN
+    else:
+        instance._stored_image_name = _image_name(instance)
+
+
+@receiver(pre_save, sender=Profile)
+@receiver(pre_save, sender=ServiceOffer)
+@receiver(pre_save, sender=ServiceRequest)
+def load_replaced_image_name(sender, instance, **kwargs):
+    # A deferred image that was assigned since loading: look up what it replaces
+    if _field(instance) not in instance.get_deferred_fields():
+        _load_stored_name(instance)
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_save, sender=ServiceOffer)
+@receiver(post_save, sender=ServiceRequest)
+def count_image_reference(sender, instance, **kwargs):
+    old = instance._stored_image_name
+    if old is _UNKNOWN:
+        return  # Still deferred, so the image was not touched
+    new = _image_name(instance)
+    if old != new:
+        add_reference(new)
+        release_reference(old)
+        instance._stored_image_name = new
+
+
+@receiver(pre_delete, sender=Profile)
+@receiver(pre_delete, sender=ServiceOffer)
+@receiver(pre_delete, sender=ServiceRequest)
+def drop_image_reference(sender, instance, **kwargs):
+    _load_stored_name(instance)
+    release_reference(instance._stored_image_name)
+
+
+def collect_garbage(grace=GC_GRACE, batch_size=GC_BATCH_SIZE, storage=None):
+    """Delete unreferenced blobs untouched for longer than grace; returns (blobs, bytes) freed.
+
+    The grace period protects uploads whose model has not been saved yet. Rows are
+    removed with a conditional DELETE first, so a blob that gained a reference or was
+    re-uploaded meanwhile keeps its file.
+    """
+    storage = storage or default_storage
+    cutoff = timezone.now() - grace
+    freed = freed_bytes = 0
+    last_id = 0
+    while True:
+        batch = list(
+            MediaBlob.objects.filter(ref_count=0, touched_at__lt=cutoff, id__gt=last_id)
+            .order_by('id').values_list('id', 'name', 'size')[:batch_size]
+        )
+        if not batch:
+            break
+        last_id = batch[-1][0]
+        ids = [blob_id for blob_id, _, _ in batch]
+        with transaction.atomic():
+            # Files are deleted before this commits. An upload of the same content touches or
+            # re-creates the row first, so it either keeps the row alive or waits for this
+            # transaction and then writes the file again (ContentAddressedStorage._save).
+            MediaBlob.objects.filter(id__in=ids, ref_count=0, touched_at__lt=cutoff).delete()
+            # By name, not id: a re-upload may already have created a new row for the same blob
+            live = set(MediaBlob.objects.filter(name__in=[name for _, name, _ in batch]).values_list('name', flat=True))
+            for blob_id, name, size in batch:
+                if name in live:
+                    continue
+                storage.delete(name)
+                for variant in VARIANTS:
+                    for fmt in FORMATS:
+                        storage.delete(derivative_name(name, variant, fmt))
+                freed += 1
+                freed_bytes += size
+    return freed, freed_bytes
+
+
+def recount_references(batch_size=GC_BATCH_SIZE):
+    """Rebuild every ref_count from the image fields (repair after bulk updates or restores)"""
+    counts = {}
+    for model, field in IMAGE_FIELDS.items():
+        names = model.objects.exclude(**{f'{field}__isnull': True}).exclude(**{field: ''}).values_list(field, flat=True)
+        for name in names.iterator(chunk_size=batch_size):
+            counts[name] = counts.get(name, 0) + 1
+    MediaBlob.objects.exclude(ref_count=0).update(ref_count=0)
+    blobs = []
+    for blob in MediaBlob.objects.filter(name__in=list(counts)).only('id', 'name').iterator(chunk_size=batch_size):
+        blob.ref_count = counts[blob.name]
+        blobs.append(blob)
+    MediaBlob.objects.bulk_update(blobs, ['ref_count'], batch_size=batch_size)
+    return len(blobs)
@@ -0,0 +1,202 @@
+"""
+Semantic tags for listings that were saved without any.
+
+Key terms are pulled from a listing's category and title (words and adjacent
+word pairs, stopwords dropped) and resolved to Wikidata concepts: first against
+the local taxonomy, then through the 'term' cache, whose misses are fetched with
+one SPARQL VALUES query per TERM_BATCH_SIZE terms rather than one call per term.
+Terms that name a concept become the listing's tags, written with one
+bulk_update per batch of listings; links, usage counts and offer features are
+then synced in bulk.
+
+New listings are queued after commit and enriched in the background
+(TAG_ENRICHMENT_WORKERS threads; 0 runs inline). Older listings are handled by
+the enrich_listing_tags command, which records a BackfillCheckpoint after every
+batch so an interrupted run resumes where it stopped.
+"""
+import json
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import BackfillCheckpoint, ServiceOffer, ServiceRequest, TaxonomyEntity
+from .recommendations import index_offers
+from .tagging import sync_listings_tags
+from .wikidata_cache import cached_lookup_many, normalize_term
+from .wikidata_client import WikidataError, get_client
+
+logger = logging.getLogger(__name__)
+
+MAX_TERMS = 8
+MAX_TAGS = 5
+TERM_BATCH_SIZE = 50
+LISTING_BATCH_SIZE = 200
+# Seconds allowed for one batch SPARQL query
+BATCH_DEADLINE = 20.0
+
+STOPWORDS = {
+    'and', 'for', 'the', 'with', 'from', 'your', 'you', 'our', 'can', 'help', 'need', 'needed',
+    'want', 'looking', 'someone', 'offer', 'offering', 'request', 'service', 'services', 'other',
+    'some', 'any', 'all', 'about', 'how', 'into', 'free', 'time', 'hour', 'hours',
+    've', 'ile', 'için', 'bir', 'bu', 'şu', 'çok', 'daha', 'gibi', 'yardım', 'lazım', 'arıyorum',
+}
+
+
+def extract_terms(title, category):
+    """Candidate terms of a listing, most specific first: word pairs, then words, then the category"""
+    words = [word for word in re.findall(r"[^\W\d_]{3,}", (title or '').lower()) if word not in STOPWORDS]
+    pairs = [f"{a} {b}" for a, b in zip(words, words[1:])]
+    terms = pairs + words
+    if category and category.strip():
+        terms.append(normalize_term(category))
+    return list(dict.fromkeys(terms))[:MAX_TERMS]
+
+
+def fetch_term_entities(terms, deadline=None):
+    """{term: entity id or None}, one SPARQL query for all terms (exact English label of a class)"""
+    values = ' '.join(f"{json.dumps(term)}@en" for term in terms)
+    sparql_query = f"""
+    SELECT ?term (SAMPLE(?item) AS ?entity) WHERE {{
+      VALUES ?term {{ {values} }}
+      ?item rdfs:label ?term ; wdt:P279 ?parent .
+    }}
+    GROUP BY ?term
+    """
+    client = get_client()
+    resolved = dict.fromkeys(terms)
+    for result in client.sparql(sparql_query, deadline=deadline or client.deadline(BATCH_DEADLINE)):
+        resolved[result["term"]["value"].lower()] = result["entity"]["value"].rsplit('/', 1)[-1]
+    return resolved
+
+
+def _fetch_in_batches(terms):
+    resolved = {}
+    for start in range(0, len(terms), TERM_BATCH_SIZE):
+        resolved.update(fetch_term_entities(terms[start:start + TERM_BATCH_SIZE]))
+    return resolved
+
+
+def resolve_terms(terms):
+    """The subset of terms that name a Wikidata concept; raises WikidataError if Wikidata could not answer"""
+    terms = list(dict.fromkeys(terms))
+    known = set(TaxonomyEntity.objects.filter(label_lower__in=terms).values_list('label_lower', flat=True))
+    rest = [term for term in terms if term not in known]
+    if rest:
+        failures = []
+
+        def fetch_many(keys):
+            try:
+                return _fetch_in_batches(keys)
+            except WikidataError as e:
+                failures.append(e)
+                raise
+
+        answers = cached_lookup_many(
+            'term', rest, fetch_many,
+            refresh=lambda term: fetch_term_entities([term])[term],
+            default=None, is_empty=lambda value: value is None,
+        )
+        if failures:
+            # Unresolved is not "no concept": let the caller retry these listings later
+            raise failures[0]
+        known.update(term for term, entity_id in answers.items() if entity_id)
+    return known
+
+
+def enrich_listings(listings):
+    """Fill the tags of untagged listings (all of one model); returns the number tagged"""
+    listings = [listing for listing in listings if not listing.tags]
+    terms = {listing.id: extract_terms(listing.title, listing.category) for listing in listings}
+    concepts = resolve_terms([term for listing_terms in terms.values() for term in listing_terms])
+
+    tagged = []
+    for listing in listings:
+        tags = [term for term in terms[listing.id] if term in concepts][:MAX_TAGS]
+        if tags:
+            listing.tags = tags
+            tagged.append(listing)
+    if tagged:
+        model = type(tagged[0])
+        with transaction.atomic():
+            # The owner may have set tags since the listings were read; lock the rows and leave those alone
+            still_untagged = model.objects.select_for_update().filter(id__in=[listing.id for listing in tagged], tags=[])
+            untouched = set(still_untagged.values_list('id', flat=True))
+            tagged = [listing for listing in tagged if listing.id in untouched]
+            model.objects.bulk_update(tagged, ['tags'])
+            # bulk_update sends no post_save, so sync what the save receivers would have
+            sync_listings_tags(tagged)
+            if model is ServiceOffer:
+                index_offers(tagged)
+    return len(tagged)
+
+
+def untagged(model):
+    return model.objects.filter(tags=[]).only('id', 'title', 'category', 'tags').order_by('id')
+
+
+def backfill(model, batch_size=LISTING_BATCH_SIZE, restart=False):
+    """Enrich every untagged listing of model past the checkpoint; yields (last id, tagged) per batch"""
+    checkpoint, _ = BackfillCheckpoint.objects.get_or_create(name=f'enrich_tags:{model._meta.model_name}')
+    if restart:
+        checkpoint.last_id = 0
+        checkpoint.save(update_fields=['last_id', 'updated_at'])
+    while True:
+        batch = list(untagged(model).filter(id__gt=checkpoint.last_id)[:batch_size])
+        if not batch:
+            return
+        tagged = enrich_listings(batch)
+        checkpoint.last_id = batch[-1].id
+        checkpoint.save(update_fields=['last_id', 'updated_at'])
+        yield checkpoint.last_id, tagged
+
+
+# --- Background path for new listings ---
+
+_pending = {ServiceOffer: set(), ServiceRequest: set()}
+_pending_lock = threading.Lock()
+_pool = None
+
+
+def _drain():
+    try:
+        for model in (ServiceOffer, ServiceRequest):
+            with _pending_lock:
+                ids, _pending[model] = _pending[model], set()
+            if ids:
+                enrich_listings(list(untagged(model).filter(id__in=ids)))
+    except Exception as e:
+        logger.error("Tag enrichment failed: %s", e)
+
+
+def _drain_in_thread():
+    try:
+        _drain()
+    finally:
+        close_old_connections()
+
+
+def schedule_enrichment(model, listing_id):
+    """Queue a new listing; queued listings are enriched together by the next background run"""
+    global _pool
+    with _pending_lock:
+        _pending[model].add(listing_id)
+    workers = getattr(settings, 'TAG_ENRICHMENT_WORKERS', 1)
+    if not workers:
+        _drain()
+        return
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tag-enrichment')
+    _pool.submit(_drain_in_thread)
+
+
+@receiver(post_save, sender=ServiceOffer)
+@receiver(post_save, sender=ServiceRequest)
+def listing_created(sender, instance, created, **kwargs):
+    if created and not instance.tags:
+        transaction.on_commit(lambda: schedule_enrichment(sender, instance.id))
@@ -0,0 +1,214 @@
+"""
+Resized WebP/JPEG derivatives of uploaded images.
+
+Every stored avatar or listing photo gets one file per (variant, format) under
+derivatives/; the original is left untouched:
+
+    listings/bike.jpg -> derivatives/listings/bike.card.webp, derivatives/listings/bike.card.jpg, ...
+
+Encoding happens after the upload's transaction commits, on a small process pool
+(settings.IMAGE_DERIVATIVE_WORKERS, 0 = inline), so requests never wait for it.
+Workers are spawned rather than forked, so they never inherit the web process's
+threads or database connections; a pool broken by a dying worker is replaced.
+Once written, every row using the image records its name in derivatives_of.
+Serializers expose the URLs with variant_urls(), which only compares that column
+with the image name; until they match it returns None and clients keep using
+the original image URL.
+"""
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from PIL import Image, ImageOps
+
+from .models import Profile, ServiceOffer, ServiceRequest
+
+logger = logging.getLogger(__name__)
+
+# variant -> maximum width in pixels (images are never upscaled)
+VARIANTS = {'thumb': 160, 'card': 480, 'full': 1280}
+# format -> (file extension, Pillow save options)
+FORMATS = {
+    'webp': ('webp', {'format': 'WEBP', 'quality': 80, 'method': 4}),
+    'jpeg': ('jpg', {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True}),
+}
+DERIVATIVES_DIR = 'derivatives'
+
+# model -> name of its image field
+IMAGE_FIELDS = {Profile: 'avatar', ServiceOffer: 'image', ServiceRequest: 'image'}
+# Column holding the image name whose derivatives exist, on each of those models
+READY_FIELD = 'derivatives_of'
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def derivative_name(name, variant, fmt):
+    stem, _ = os.path.splitext(name)
+    return f"{DERIVATIVES_DIR}/{stem}.{variant}.{FORMATS[fmt][0]}"
+
+
+def _flatten(image):
+    """RGB copy of image; transparent areas become white since JPEG has no alpha"""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def generate_derivatives(name, storage=None):
+    """Write every variant of the stored image name; returns the derivative names written.
+
+    Runs in pool workers, so it only takes picklable arguments and touches nothing but storage.
+    """
+    storage = storage or default_storage
+    with storage.open(name, 'rb') as source:
+        original = Image.open(source)
+        original.load()
+    original = _flatten(ImageOps.exif_transpose(original))
+
+    written = []
+    for variant, width in VARIANTS.items():
+        image = original
+        if image.width > width:
+            image = image.resize((width, max(1, round(image.height * width / image.width))), Image.Resampling.LANCZOS)
+        for fmt, (_, options) in FORMATS.items():
+            buffer = io.BytesIO()
+            image.save(buffer, **options)
+            target = derivative_name(name, variant, fmt)
+            if storage.exists(target):
+                storage.delete(target)
+            written.append(storage.save(target, ContentFile(buffer.getvalue())))
+    return written
+
+
+def has_derivatives(name, storage=None):
+    storage = storage or default_storage
+    return storage.exists(derivative_name(name, 'thumb', 'webp'))
+
+
+def mark_derivatives_ready(name):
+    """Record on every row using the image name that its derivatives exist"""
+    for model, field in IMAGE_FIELDS.items():
+        model.objects.filter(**{field: name}).exclude(**{READY_FIELD: name}).update(**{READY_FIELD: name})
+
+
+def new_pool(workers):
+    """Encoding processes, spawned with their own Django setup"""
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup,
+    )
+
+
+def _get_pool(workers):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = new_pool(workers)
+        return _pool
+
+
+def _drop_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def _finish(name, pool):
+    def done(future):
+        if future.exception():
+            logger.error("Derivative generation failed for %s: %s", name, future.exception())
+            if isinstance(future.exception(), BrokenProcessPool):
+                _drop_pool(pool)
+            return
+        try:
+            mark_derivatives_ready(name)
+        finally:
+            # Runs on the pool's result thread, outside any request
+            close_old_connections()
+    return done
+
+
+def schedule_derivatives(name):
+    """Generate derivatives for name in the background (inline when IMAGE_DERIVATIVE_WORKERS is 0).
+
+    Returns the pool future, or None when run inline or when no pool would take the job.
+    """
+    workers = getattr(settings, 'IMAGE_DERIVATIVE_WORKERS', 2)
+    if not workers:
+        try:
+            generate_derivatives(name)
+        except Exception as e:
+            logger.error("Derivative generation failed for %s: %s", name, e)
+        else:
+            mark_derivatives_ready(name)
+        return None
+    for _ in range(2):
+        pool = _get_pool(workers)
+        try:
+            future = pool.submit(generate_derivatives, name)
+        except BrokenProcessPool as e:
+            # A worker died (e.g. out of memory on a huge image); start a fresh pool
+            logger.error("Derivative pool is broken (%s), replacing it", e)
+            _drop_pool(pool)
+            continue
+        future.add_done_callback(_finish(name, pool))
+        return future
+    logger.error("Derivative generation for %s was not scheduled", name)
+    return None
+
+
+def variant_urls(instance, build_url=None):
+    """{'webp': {...}, 'jpeg': {...}, 'srcset': {...}} for the image of instance, or None if not generated yet.
+
+    Decided from the row alone (derivatives_of), so serializing a page of listings
+    never touches storage. build_url (e.g. request.build_absolute_uri) is applied
+    to every storage URL.
+    """
+    field_file = getattr(instance, IMAGE_FIELDS[type(instance)])
+    if not field_file or getattr(instance, READY_FIELD) != field_file.name:
+        return None
+    storage = field_file.storage
+    build_url = build_url or (lambda url: url)
+    variants = {
+        fmt: {variant: build_url(storage.url(derivative_name(field_file.name, variant, fmt))) for variant in VARIANTS}
+        for fmt in FORMATS
+    }
+    variants['srcset'] = {
+        fmt: ', '.join(f"{variants[fmt][variant]} {width}w" for variant, width in VARIANTS.items())
+        for fmt in FORMATS
+    }
+    return variants
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_save, sender=ServiceOffer)
+@receiver(post_save, sender=ServiceRequest)
+def image_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and IMAGE_FIELDS[sender] not in update_fields:
+        return
+    field_file = getattr(instance, IMAGE_FIELDS[sender])
+    if not field_file or getattr(instance, READY_FIELD) == field_file.name:
+        return
+    name = field_file.name
+    if has_derivatives(name, field_file.storage):
+        # Content-addressed names: the same image was uploaded before and already has derivatives
+        sender.objects.filter(pk=instance.pk).update(**{READY_FIELD: name})
+        setattr(instance, READY_FIELD, name)
+    else:
+        transaction.on_commit(lambda: schedule_derivatives(name))
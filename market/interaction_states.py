@@ -0,0 +1,117 @@
+"""
+Interaction state machine.
+
+Each transition is applied as one conditional UPDATE that only matches the row if
+it still has the id, version and status that were read, and it writes nothing but
+the columns the transition changes. When two parties act on the same interaction
+at the same moment exactly one UPDATE matches; the other gets TransitionConflict.
+
+Offer seats follow the same idea: accepting takes a seat with
+UPDATE ... SET reserved_seats = reserved_seats + 1 WHERE reserved_seats < capacity,
+and leaving a seat-holding status gives it back.
+"""
+from django.db import transaction
+from django.db.models import F
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .models import InteractionRequest, ServiceOffer
+
+# Sent after a commit that changed the status of one or more interactions (kwargs: interactions).
+# Conditional UPDATEs bypass post_save, so listeners that care about status use this instead.
+status_changed = Signal()
+
+# action -> (statuses it may start from, status it moves to; None keeps the status)
+TRANSITIONS = {
+    'accept': (('pending',), 'accepted'),
+    'decline': (('pending', 'accepted', 'date_proposed', 'negotiating'), 'declined'),
+    'schedule': (('pending', 'accepted', 'date_proposed', 'negotiating'), 'date_proposed'),
+    'reject_date': (('date_proposed',), 'negotiating'),
+    'accept_date': (('date_proposed',), 'scheduled'),
+    # A date still being negotiated does not block finishing the exchange (the UI offers both in those states)
+    'complete': (('accepted', 'date_proposed', 'negotiating', 'scheduled'), None),
+    'confirm': (('accepted', 'date_proposed', 'negotiating', 'scheduled'), 'completed'),
+    'cancel': (('pending', 'accepted', 'date_proposed', 'negotiating', 'scheduled'), 'cancelled'),
+}
+
+# Statuses in which an offer interaction occupies one of the offer's seats
+SEAT_HOLDING_STATUSES = ('accepted', 'date_proposed', 'negotiating', 'scheduled', 'completed')
+
+
+class InvalidTransition(Exception):
+    """The action is not allowed from the interaction's current status"""
+
+
+class OfferFull(InvalidTransition):
+    """Every seat of the offer is already taken"""
+
+
+class TransitionConflict(Exception):
+    """The interaction was changed by someone else between read and write"""
+
+    def __init__(self, interaction):
+        self.interaction = interaction
+        super().__init__(f"Interaction {interaction.pk} was modified concurrently (now {interaction.status})")
+
+
+def reserve_seat(offer_id):
+    """Take one seat of an offer; False if it is already full"""
+    return ServiceOffer.objects.filter(pk=offer_id, reserved_seats__lt=F('capacity')).update(
+        reserved_seats=F('reserved_seats') + 1
+    ) == 1
+
+
+def release_seat(offer_id):
+    ServiceOffer.objects.filter(pk=offer_id, reserved_seats__gt=0).update(reserved_seats=F('reserved_seats') - 1)
+
+
+def apply_transition(interaction, action, **changes):
+    """Apply action to interaction with a conditional UPDATE and mirror the result on the instance.
+
+    Extra column values (appointment_date, date_proposed_by, ...) are written in the
+    same statement. Raises InvalidTransition if the status read does not allow the
+    action and TransitionConflict if the row changed since it was read; in that case
+    the instance is refreshed so callers can report the current state.
+
+    Moving an offer interaction into a seat-holding status reserves a seat in the
+    same transaction (OfferFull if none is left); moving it out releases the seat.
+    """
+    sources, target = TRANSITIONS[action]
+    if interaction.status not in sources:
+        raise InvalidTransition(f"Cannot {action.replace('_', ' ')} an interaction that is {interaction.status}")
+    if target:
+        changes['status'] = target
+
+    held = interaction.status in SEAT_HOLDING_STATUSES
+    holds = target in SEAT_HOLDING_STATUSES if target else held
+    with transaction.atomic():
+        updated = InteractionRequest.objects.filter(
+            pk=interaction.pk, version=interaction.version, status__in=sources,
+        ).update(version=F('version') + 1, updated_at=timezone.now(), **changes)
+        if not updated:
+            interaction.refresh_from_db()
+            raise TransitionConflict(interaction)
+        if interaction.offer_id and holds and not held and not reserve_seat(interaction.offer_id):
+            # Raising rolls back the status change above
+            raise OfferFull("This offer is full")
+        if interaction.offer_id and held and not holds:
+            release_seat(interaction.offer_id)
+        if target:
+            transaction.on_commit(lambda: status_changed.send(sender=InteractionRequest, interactions=[interaction]))
+
+    for field, value in changes.items():
+        setattr(interaction, field, value)
+    interaction.version += 1
+    return interaction
+
+
+def complete_interactions(interactions, from_statuses=('accepted',), **changes):
+    """Move a whole set of interactions to completed, or raise TransitionConflict if any of them moved first"""
+    ids = [interaction.pk for interaction in interactions]
+    updated = InteractionRequest.objects.filter(pk__in=ids, status__in=from_statuses).update(
+        status='completed', version=F('version') + 1, updated_at=timezone.now(), **changes
+    )
+    if updated != len(ids):
+        raise TransitionConflict(interactions[0])
+    transaction.on_commit(lambda: status_changed.send(sender=InteractionRequest, interactions=interactions))
+    return updated
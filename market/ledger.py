@@ -0,0 +1,149 @@
+"""
+Time ledger helpers: recompute member balances from TimeTransaction rows.
+
+Profile.balance stays the single materialized column the app reads; these
+helpers only exist to audit (and if needed repair) it against the ledger.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Max, Q, Sum
+
+from .models import InteractionRequest, Profile, ServiceOffer, ServiceRequest, TimeTransaction, STARTING_BALANCE
+
+DEFAULT_CHUNK_SIZE = 50000
+STATEMENT_CHUNK_SIZE = 2000
+
+
+def ledger_deltas(chunk_size=DEFAULT_CHUNK_SIZE):
+    """Net credits minus debits per user id, walking the ledger in primary-key windows.
+
+    Each window is aggregated by the database (GROUP BY sender / receiver), so only
+    one running total per member is held in memory regardless of the ledger size.
+    Returns (deltas, last_id, unattributed_rows).
+    """
+    deltas = defaultdict(int)
+    unattributed = 0
+    last_id = TimeTransaction.objects.aggregate(last=Max('id'))['last'] or 0
+
+    lower = 0
+    while lower < last_id:
+        upper = min(lower + chunk_size, last_id)
+        window = TimeTransaction.objects.filter(id__gt=lower, id__lte=upper).order_by()
+
+        credits = window.filter(receiver__isnull=False).values('receiver_id').annotate(total=Sum('amount'))
+        for row in credits:
+            deltas[row['receiver_id']] += row['total']
+        debits = window.filter(sender__isnull=False).values('sender_id').annotate(total=Sum('amount'))
+        for row in debits:
+            deltas[row['sender_id']] -= row['total']
+        unattributed += window.filter(sender__isnull=True, receiver__isnull=True).count()
+
+        lower = upper
+    return deltas, last_id, unattributed
+
+
+class UnreconcilableBalance(Exception):
+    """The member's balance depends on ledger rows that do not name both parties"""
+
+
+def unreconcilable_members():
+    """Ids of members whose balance the ledger cannot explain.
+
+    These are the parties of legacy rows migration 0003 could not attribute (group
+    settlements: one debit row per participant and no provider credit at all), the
+    owners of those listings, and members left alone on a row whose counterpart was
+    deleted. Their Profile.balance is the only record of those movements.
+    """
+    members = set()
+    legacy = TimeTransaction.objects.filter(sender__isnull=True, receiver__isnull=True)
+    offer_ids = set(legacy.filter(offer__isnull=False).values_list('offer_id', flat=True))
+    request_ids = set(legacy.filter(request__isnull=False).values_list('request_id', flat=True))
+    if offer_ids or request_ids:
+        members.update(ServiceOffer.objects.filter(id__in=offer_ids).values_list('user_id', flat=True))
+        members.update(ServiceRequest.objects.filter(id__in=request_ids).values_list('user_id', flat=True))
+        completed = InteractionRequest.objects.filter(
+            Q(offer_id__in=offer_ids) | Q(service_request_id__in=request_ids), status='completed',
+        )
+        for sender_id, receiver_id in completed.values_list('sender_id', 'receiver_id'):
+            members.update((sender_id, receiver_id))
+    members.update(TimeTransaction.objects.filter(sender__isnull=True, receiver__isnull=False).values_list('receiver_id', flat=True))
+    members.update(TimeTransaction.objects.filter(sender__isnull=False, receiver__isnull=True).values_list('sender_id', flat=True))
+    return members
+
+
+def ledger_balance(user_id):
+    """Expected balance of a single user according to the ledger"""
+    rows = TimeTransaction.objects.filter(Q(sender_id=user_id) | Q(receiver_id=user_id))
+    totals = rows.aggregate(
+        credits=Sum('amount', filter=Q(receiver_id=user_id)),
+        debits=Sum('amount', filter=Q(sender_id=user_id)),
+    )
+    return STARTING_BALANCE + (totals['credits'] or 0) - (totals['debits'] or 0)
+
+
+def find_drift(deltas, chunk_size=DEFAULT_CHUNK_SIZE, skip=()):
+    """Yield (user_id, materialized_balance, ledger_balance) for every profile that disagrees with deltas.
+
+    Candidates from the bulk scan are re-checked one by one, so settlements that
+    land while the scan runs are not reported as drift. Members in skip
+    (see unreconcilable_members) are left out.
+    """
+    profiles = Profile.objects.values_list('user_id', 'balance').order_by('user_id')
+    for user_id, balance in profiles.iterator(chunk_size=chunk_size):
+        if user_id in skip or balance == STARTING_BALANCE + deltas.get(user_id, 0):
+            continue
+        # The scan and the profile read are not one snapshot; confirm with a fresh read
+        current = Profile.objects.filter(user_id=user_id).values_list('balance', flat=True).first()
+        expected = ledger_balance(user_id)
+        if current is not None and current != expected:
+            yield user_id, current, expected
+
+
+def repair_balance(user_id, force=False):
+    """Reset one profile to its ledger balance under a row lock. Returns (old, new) or None if already correct.
+
+    Raises UnreconcilableBalance for members the ledger cannot explain unless force is set.
+    """
+    if not force and user_id in unreconcilable_members():
+        raise UnreconcilableBalance(f"user #{user_id} has legacy transactions the ledger cannot attribute")
+    with transaction.atomic():
+        profile = Profile.objects.select_for_update().get(user_id=user_id)
+        expected = ledger_balance(user_id)
+        if profile.balance == expected:
+            return None
+        old = profile.balance
+        profile.balance = expected
+        profile.save(update_fields=['balance'])
+        return old, expected
+
+
+def iter_statement(user, chunk_size=STATEMENT_CHUNK_SIZE):
+    """Yield a user's ledger rows oldest first, each with the running balance after it.
+
+    Rows are streamed from a server-side cursor, so the whole history is never loaded
+    at once.
+    """
+    rows = (
+        TimeTransaction.objects
+        .filter(Q(sender=user) | Q(receiver=user))
+        .select_related('sender', 'receiver', 'offer', 'request')
+        .only('id', 'amount', 'created_at', 'sender__username', 'receiver__username', 'offer__title', 'request__title')
+        .order_by('id')
+    )
+    balance = STARTING_BALANCE
+    for tx in rows.iterator(chunk_size=chunk_size):
+        credit = tx.receiver_id == user.id
+        balance += tx.amount if credit else -tx.amount
+        counterparty = tx.sender if credit else tx.receiver
+        listing = tx.offer or tx.request
+        yield {
+            'id': tx.id,
+            'created_at': tx.created_at.isoformat(),
+            'direction': 'credit' if credit else 'debit',
+            'amount': tx.amount,
+            'counterparty': counterparty.username if counterparty else None,
+            'listing_type': 'offer' if tx.offer_id else ('request' if tx.request_id else None),
+            'listing_title': listing.title if listing else None,
+            'balance': balance,
+        }
@@ -0,0 +1,48 @@
+"""
+Rebuild the denormalized rating totals on Profile from the Review table.
+
+    python manage.py backfill_ratings
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from market.models import Profile, Review
+from market.ratings import RATING_FIELDS, rating_totals_by_user
+
+
+class Command(BaseCommand):
+    help = "Recompute provider/consumer rating sums and counts on every profile"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Profiles written per bulk_update (default: %(default)s)")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        updated = 0
+
+        with transaction.atomic():
+            Profile.objects.update(**{field: 0 for field in RATING_FIELDS})
+
+            totals = {}
+            for row in rating_totals_by_user(Review.objects.all()).iterator(chunk_size=batch_size):
+                user_totals = totals.setdefault(row['target_user'], {})
+                user_totals[f"{row['role']}_rating_sum"] = row['rating_sum']
+                user_totals[f"{row['role']}_rating_count"] = row['rating_count']
+                # Rows are ordered by user, so a full batch never splits one user's roles
+                if len(totals) > batch_size:
+                    last_user = row['target_user']
+                    last_totals = totals.pop(last_user)
+                    updated += self._write(totals, batch_size)
+                    totals = {last_user: last_totals}
+            updated += self._write(totals, batch_size)
+
+        self.stdout.write(self.style.SUCCESS(f"Rating totals rebuilt for {updated} profile(s) with reviews"))
+
+    def _write(self, totals, batch_size):
+        profiles = Profile.objects.in_bulk(list(totals), field_name='user_id')
+        for user_id, profile in profiles.items():
+            for field, value in totals[user_id].items():
+                setattr(profile, field, value)
+        Profile.objects.bulk_update(profiles.values(), RATING_FIELDS, batch_size=batch_size)
+        return len(profiles)
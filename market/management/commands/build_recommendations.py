@@ -0,0 +1,26 @@
+"""
+Rebuild the tag/category co-occurrence matrix behind "recommended for you".
+
+    python manage.py build_recommendations              # run periodically (e.g. nightly cron)
+    python manage.py build_recommendations --reindex    # also rebuild every offer's feature vector
+"""
+from django.core.management.base import BaseCommand
+
+from market.recommendations import BATCH_SIZE, build_cooccurrence, reindex_offers
+
+
+class Command(BaseCommand):
+    help = "Recompute listing feature co-occurrence for offer recommendations"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reindex', action='store_true',
+                            help="Rebuild offer feature vectors too (they are normally kept up to date on save)")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help="Rows per database round trip (default: %(default)s)")
+
+    def handle(self, *args, **options):
+        if options['reindex']:
+            indexed = reindex_offers(options['batch_size'])
+            self.stdout.write(f"Indexed {indexed} offer(s)")
+        pairs = build_cooccurrence(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Stored {pairs} feature pair(s)"))
@@ -0,0 +1,36 @@
+"""
+Give untagged listings semantic tags from their titles and categories.
+
+    python manage.py enrich_listing_tags                 # resumes from the last checkpoint
+    python manage.py enrich_listing_tags --restart       # start over from the first listing
+    python manage.py enrich_listing_tags --model offers
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from market.enrichment import LISTING_BATCH_SIZE, backfill
+from market.models import ServiceOffer, ServiceRequest
+from market.wikidata_client import WikidataError
+
+MODELS = {'offers': [ServiceOffer], 'requests': [ServiceRequest], 'all': [ServiceOffer, ServiceRequest]}
+
+
+class Command(BaseCommand):
+    help = "Backfill semantic tags of listings saved without any (resumable)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=list(MODELS), default='all')
+        parser.add_argument('--batch-size', type=int, default=LISTING_BATCH_SIZE,
+                            help="Listings per batch and checkpoint (default: %(default)s)")
+        parser.add_argument('--restart', action='store_true', help="Ignore the saved checkpoint")
+
+    def handle(self, *args, **options):
+        for model in MODELS[options['model']]:
+            name = model._meta.verbose_name_plural
+            total = 0
+            try:
+                for last_id, tagged in backfill(model, options['batch_size'], options['restart']):
+                    total += tagged
+                    self.stdout.write(f"{name}: up to id {last_id}, {tagged} tagged")
+            except WikidataError as e:
+                raise CommandError(f"Wikidata unavailable ({e}); rerun to resume from the checkpoint")
+            self.stdout.write(self.style.SUCCESS(f"{name}: {total} listing(s) tagged"))
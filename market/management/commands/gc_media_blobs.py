@@ -0,0 +1,31 @@
+"""
+Delete media blobs that no image field references any more.
+
+    python manage.py gc_media_blobs                 # blobs unreferenced for more than an hour
+    python manage.py gc_media_blobs --recount       # rebuild reference counts first
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from market.blobs import GC_BATCH_SIZE, collect_garbage, recount_references
+
+
+class Command(BaseCommand):
+    help = "Garbage-collect unreferenced content-addressed media blobs and their derivatives"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-minutes', type=int, default=60,
+                            help="Keep blobs touched within this many minutes (default: %(default)s)")
+        parser.add_argument('--batch-size', type=int, default=GC_BATCH_SIZE,
+                            help="Blobs deleted per batch (default: %(default)s)")
+        parser.add_argument('--recount', action='store_true',
+                            help="Recompute reference counts from the image fields before collecting")
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            referenced = recount_references(options['batch_size'])
+            self.stdout.write(f"Recounted references: {referenced} blob(s) in use")
+
+        freed, freed_bytes = collect_garbage(timedelta(minutes=options['grace_minutes']), options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {freed} blob(s), {freed_bytes} bytes freed"))
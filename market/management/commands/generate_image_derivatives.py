@@ -0,0 +1,63 @@
+"""
+Create thumbnail/WebP derivatives for images uploaded before the pipeline existed
+(or whose background job was lost).
+
+    python manage.py generate_image_derivatives             # only images without derivatives
+    python manage.py generate_image_derivatives --force     # regenerate everything
+
+Rows are marked ready (derivatives_of) as their image is done; images whose
+derivatives are already on disk are only marked.
+"""
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from market.images import IMAGE_FIELDS, READY_FIELD, generate_derivatives, has_derivatives, mark_derivatives_ready, new_pool
+
+
+class Command(BaseCommand):
+    help = "Generate resized WebP/JPEG derivatives for avatars and listing images"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Regenerate derivatives that already exist")
+        parser.add_argument('--workers', type=int, default=4,
+                            help="Encoding processes (default: %(default)s, 0 = run in this process)")
+
+    def handle(self, *args, **options):
+        names = set()
+        for model, field in IMAGE_FIELDS.items():
+            stored = model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+            if not options['force']:
+                stored = stored.exclude(**{READY_FIELD: F(field)})
+            names.update(stored.values_list(field, flat=True).iterator())
+        if not options['force']:
+            existing = {name for name in names if has_derivatives(name)}
+            for name in existing:
+                mark_derivatives_ready(name)
+            names -= existing
+        names = sorted(names)
+        self.stdout.write(f"{len(names)} image(s) to process")
+
+        failed = 0
+        if options['workers']:
+            with new_pool(options['workers']) as pool:
+                futures = [(name, pool.submit(generate_derivatives, name)) for name in names]
+                for name, future in futures:
+                    if future.exception():
+                        failed += 1
+                        self.stderr.write(f"{name}: {future.exception()}")
+                    else:
+                        mark_derivatives_ready(name)
+        else:
+            for name in names:
+                try:
+                    generate_derivatives(name)
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"{name}: {e}")
+                else:
+                    mark_derivatives_ready(name)
+
+        if failed:
+            self.stdout.write(self.style.WARNING(f"{len(names) - failed} done, {failed} failed"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Generated derivatives for {len(names)} image(s)"))
@@ -0,0 +1,41 @@
+"""
+Load a Wikidata subset for offline tag suggestions (see market.taxonomy for the formats).
+
+    python manage.py load_wikidata_taxonomy taxonomy.tsv
+    python manage.py load_wikidata_taxonomy subset.json.gz --replace    # drop the previous load first
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from market.taxonomy import BATCH_SIZE, load_taxonomy, open_dump, parse_json, parse_tsv, rebuild_neighbours
+
+
+class Command(BaseCommand):
+    help = "Bulk-load Wikidata labels and P279/P366/P3095/P1056 relations into the local tag taxonomy"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="TSV or JSON-lines file, optionally .gz")
+        parser.add_argument('--format', choices=['auto', 'tsv', 'json'], default='auto',
+                            help="Input format; auto picks by file extension (default: %(default)s)")
+        parser.add_argument('--language', default='en', help="Label language of JSON dumps (default: %(default)s)")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help="Rows per insert (default: %(default)s)")
+        parser.add_argument('--replace', action='store_true', help="Delete the existing taxonomy before loading")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format']
+        if fmt == 'auto':
+            fmt = 'tsv' if path.removesuffix('.gz').endswith(('.tsv', '.tab')) else 'json'
+
+        try:
+            with open_dump(path) as lines:
+                records = parse_tsv(lines) if fmt == 'tsv' else parse_json(lines, options['language'])
+                labels, relations = load_taxonomy(records, options['batch_size'], options['replace'])
+        except OSError as e:
+            raise CommandError(f"Cannot read {path}: {e}")
+        except (ValueError, KeyError) as e:
+            raise CommandError(f"Malformed {fmt} input in {path}: {e}")
+        self.stdout.write(f"Loaded {labels} label(s) and {relations} relation(s)")
+
+        entities = rebuild_neighbours(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Precomputed neighbours of {entities} entities"))
@@ -0,0 +1,66 @@
+"""
+Audit Profile.balance against the TimeTransaction ledger.
+
+    python manage.py reconcile_balances            # report drift only
+    python manage.py reconcile_balances --repair   # reset drifting profiles to the ledger value
+
+Members tied to legacy rows the ledger cannot attribute (see
+ledger.unreconcilable_members) are listed separately and never repaired unless
+named with --force-user.
+"""
+from django.core.management.base import BaseCommand
+
+from market.ledger import (
+    DEFAULT_CHUNK_SIZE, find_drift, ledger_balance, ledger_deltas, repair_balance, unreconcilable_members,
+)
+from market.models import Profile
+
+
+class Command(BaseCommand):
+    help = "Recompute member balances from the transaction ledger and report or repair drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help="Ledger rows aggregated per query (default: %(default)s)")
+        parser.add_argument('--repair', action='store_true',
+                            help="Overwrite drifting Profile.balance values with the ledger balance")
+        parser.add_argument('--force-user', type=int, action='append', default=[], metavar='USER_ID',
+                            help="Also check and repair this member despite legacy unattributed transactions (repeatable)")
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        repair = options['repair']
+        forced = set(options['force_user'])
+
+        deltas, last_id, unattributed = ledger_deltas(chunk_size)
+        self.stdout.write(f"Scanned ledger up to transaction #{last_id} ({len(deltas)} members with activity)")
+
+        legacy = unreconcilable_members()
+        unchecked = sorted(legacy - forced)
+        if unattributed or unchecked:
+            self.stdout.write(self.style.WARNING(
+                f"{unattributed} legacy transaction(s) have no sender/receiver; "
+                f"{len(unchecked)} member(s) tied to unattributed rows are not checked"
+            ))
+        balances = dict(Profile.objects.filter(user_id__in=unchecked).values_list('user_id', 'balance'))
+        for user_id in unchecked:
+            if user_id in balances:
+                self.stdout.write(
+                    f"user #{user_id}: balance={balances[user_id]} ledger={ledger_balance(user_id)} "
+                    f"(legacy, not repaired; use --force-user {user_id})"
+                )
+
+        drifted = 0
+        repaired = 0
+        for user_id, balance, expected in find_drift(deltas, chunk_size, skip=legacy - forced):
+            drifted += 1
+            self.stdout.write(f"user #{user_id}: balance={balance} ledger={expected} drift={balance - expected:+d}")
+            if repair and repair_balance(user_id, force=user_id in forced):
+                repaired += 1
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS("All checked balances match the ledger"))
+        elif repair:
+            self.stdout.write(self.style.SUCCESS(f"Repaired {repaired} of {drifted} drifting balance(s)"))
+        else:
+            self.stdout.write(self.style.WARNING(f"{drifted} balance(s) drift from the ledger; rerun with --repair to fix"))
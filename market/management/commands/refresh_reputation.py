@@ -0,0 +1,23 @@
+"""
+Recompute member reputation metrics (completion rate, response time, repeat partners).
+
+    python manage.py refresh_reputation                  # every member
+    python manage.py refresh_reputation --incremental    # members touched since the last run
+"""
+from django.core.management.base import BaseCommand
+
+from market.reputation import CHUNK_SIZE, refresh_metrics
+
+
+class Command(BaseCommand):
+    help = "Precompute reputation metrics from interaction and chat history"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true',
+                            help="Only recompute members whose interactions or messages changed since the last run")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help="Rows fetched per database round trip (default: %(default)s)")
+
+    def handle(self, *args, **options):
+        written = refresh_metrics(incremental=options['incremental'], chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Updated reputation metrics for {written} member(s)"))
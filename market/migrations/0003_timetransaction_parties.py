@@ -0,0 +1,52 @@
+# Generated by Django 5.2.8 on 2026-10-18 22:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def attribute_legacy_transactions(apps, schema_editor):
+    """Fill in sender/receiver for old rows whose listing has exactly one completed interaction"""
+    TimeTransaction = apps.get_model('market', 'TimeTransaction')
+    InteractionRequest = apps.get_model('market', 'InteractionRequest')
+
+    legacy = TimeTransaction.objects.filter(sender__isnull=True, receiver__isnull=True)
+    for tx in legacy.iterator(chunk_size=2000):
+        if tx.offer_id:
+            completed = InteractionRequest.objects.filter(offer_id=tx.offer_id, status='completed')
+        elif tx.request_id:
+            completed = InteractionRequest.objects.filter(service_request_id=tx.request_id, status='completed')
+        else:
+            continue
+        matches = list(completed[:2])
+        # Group settlements are ambiguous (one row per participant, no provider row); leave them unattributed
+        if len(matches) != 1:
+            continue
+        interaction = matches[0]
+        if tx.offer_id:
+            consumer_id, provider_id = interaction.sender_id, interaction.receiver_id
+        else:
+            consumer_id, provider_id = interaction.receiver_id, interaction.sender_id
+        TimeTransaction.objects.filter(pk=tx.pk).update(sender_id=consumer_id, receiver_id=provider_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0002_serviceoffer_tags_servicerequest_tags'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timetransaction',
+            name='receiver',
+            field=models.ForeignKey(blank=True, help_text='User credited by this transaction', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='received_transactions', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='timetransaction',
+            name='sender',
+            field=models.ForeignKey(blank=True, help_text='User debited by this transaction', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sent_transactions', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(attribute_legacy_transactions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 22:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0003_timetransaction_parties'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='interactionrequest',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
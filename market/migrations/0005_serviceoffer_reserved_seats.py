@@ -0,0 +1,32 @@
+# Generated by Django 5.2.8 on 2026-10-18 22:47
+
+from django.db import migrations, models
+
+
+# Must match interaction_states.SEAT_HOLDING_STATUSES at the time of this migration
+SEAT_HOLDING_STATUSES = ['accepted', 'date_proposed', 'negotiating', 'scheduled', 'completed']
+
+
+def count_reserved_seats(apps, schema_editor):
+    ServiceOffer = apps.get_model('market', 'ServiceOffer')
+    taken = ServiceOffer.objects.annotate(
+        taken=models.Count('interactions', filter=models.Q(interactions__status__in=SEAT_HOLDING_STATUSES))
+    ).filter(taken__gt=0).values_list('pk', 'taken')
+    for offer_id, count in list(taken):
+        ServiceOffer.objects.filter(pk=offer_id).update(reserved_seats=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0004_interactionrequest_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='serviceoffer',
+            name='reserved_seats',
+            field=models.PositiveIntegerField(default=0, help_text='Number of spots already taken'),
+        ),
+        migrations.RunPython(count_reserved_seats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.8 on 2026-10-18 22:49
+
+from django.db import migrations, models
+from django.db.models import Case, CharField, Count, F, Sum, Value, When
+
+
+def fill_rating_totals(apps, schema_editor):
+    """Same grouping as market.ratings, frozen against the historical models"""
+    Review = apps.get_model('market', 'Review')
+    Profile = apps.get_model('market', 'Profile')
+    role = Case(
+        When(offer__isnull=False, offer__user=F('target_user'), then=Value('provider')),
+        When(offer__isnull=False, then=Value('consumer')),
+        When(service_request__isnull=False, service_request__user=F('target_user'), then=Value('consumer')),
+        When(service_request__isnull=False, then=Value('provider')),
+        default=Value('consumer'),
+        output_field=CharField(),
+    )
+    totals = (
+        Review.objects.filter(target_user__isnull=False)
+        .annotate(role=role)
+        .values('target_user', 'role')
+        .annotate(rating_sum=Sum('rating'), rating_count=Count('id'))
+        .order_by()
+    )
+    for row in list(totals):
+        Profile.objects.filter(user_id=row['target_user']).update(**{
+            f"{row['role']}_rating_sum": row['rating_sum'],
+            f"{row['role']}_rating_count": row['rating_count'],
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0005_serviceoffer_reserved_seats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='consumer_rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='consumer_rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='provider_rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='provider_rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_rating_totals, migrations.RunPython.noop),
+    ]
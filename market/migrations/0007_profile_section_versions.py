@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-18 22:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0006_profile_rating_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='completed_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='listings_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='reviews_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-18 23:02
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_user_balance'),
+        ('market', '0008_media_blob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReputationMetrics',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='reputation', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('completion_rate', models.FloatField(blank=True, null=True)),
+                ('finished_count', models.PositiveIntegerField(default=0)),
+                ('median_response_seconds', models.FloatField(blank=True, null=True)),
+                ('response_samples', models.PositiveIntegerField(default=0)),
+                ('repeat_partner_ratio', models.FloatField(blank=True, null=True)),
+                ('partner_count', models.PositiveIntegerField(default=0)),
+                ('computed_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='interactionrequest',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.8 on 2026-10-18 23:04
+
+import math
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def index_existing_offers(apps, schema_editor):
+    # Same features as recommendations.listing_features at the time of this migration
+    ServiceOffer = apps.get_model('market', 'ServiceOffer')
+    ListingFeature = apps.get_model('market', 'ListingFeature')
+    rows = []
+    for offer_id, category, tags in ServiceOffer.objects.values_list('id', 'category', 'tags').iterator():
+        features = {f"cat:{category.strip().lower()}"[:120]} if category else set()
+        features |= {f"tag:{tag.strip().lower()}"[:120] for tag in tags or () if isinstance(tag, str) and tag.strip()}
+        rows += [ListingFeature(offer_id=offer_id, feature=feature, weight=1 / math.sqrt(len(features))) for feature in features]
+    ListingFeature.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0009_reputation_metrics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeatureCooccurrence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('feature', models.CharField(max_length=120)),
+                ('related', models.CharField(max_length=120)),
+                ('weight', models.FloatField()),
+            ],
+            options={
+                'unique_together': {('feature', 'related')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ListingFeature',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('feature', models.CharField(max_length=120)),
+                ('weight', models.FloatField()),
+                ('offer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='features', to='market.serviceoffer')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['feature', 'offer'], name='market_list_feature_34e6af_idx')],
+                'unique_together': {('offer', 'feature')},
+            },
+        ),
+        migrations.RunPython(index_existing_offers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.8 on 2026-10-18 23:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0010_recommendation_features'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WikidataCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('entity', 'Search term -> candidate entity ids'), ('related', 'Entity id -> related tags')], max_length=10)),
+                ('key', models.CharField(max_length=200)),
+                ('value', models.JSONField(null=True)),
+                ('is_negative', models.BooleanField(default=False)),
+                ('fetched_at', models.DateTimeField()),
+            ],
+            options={
+                'unique_together': {('kind', 'key')},
+            },
+        ),
+    ]
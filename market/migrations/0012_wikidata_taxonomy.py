@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-18 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0011_wikidata_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaxonomyEntity',
+            fields=[
+                ('qid', models.CharField(max_length=20, primary_key=True, serialize=False)),
+                ('label', models.CharField(max_length=255)),
+                ('label_lower', models.CharField(db_index=True, max_length=255)),
+                ('neighbours', models.JSONField(default=list)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TaxonomyRelation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=20)),
+                ('property', models.CharField(choices=[('P279', 'subclass of'), ('P366', 'has use'), ('P3095', 'practiced by'), ('P1056', 'product or material produced')], max_length=10)),
+                ('target', models.CharField(db_index=True, max_length=20)),
+            ],
+            options={
+                'unique_together': {('source', 'property', 'target')},
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.8 on 2026-10-18 23:52
+
+import re
+from collections import Counter
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def link_existing_tags(apps, schema_editor):
+    # Same normalization as tagging.normalize_tag at the time of this migration
+    Tag = apps.get_model('market', 'Tag')
+    ListingTag = apps.get_model('market', 'ListingTag')
+    links = []
+    for model, field in ((apps.get_model('market', 'ServiceOffer'), 'offer_id'), (apps.get_model('market', 'ServiceRequest'), 'service_request_id')):
+        for listing_id, tags in model.objects.values_list('id', 'tags').iterator():
+            names = {re.sub(r'\s+', ' ', tag.strip().lower())[:100] for tag in tags or () if isinstance(tag, str) and tag.strip()}
+            links += [(field, listing_id, name) for name in names]
+    usage = Counter(name for _, _, name in links)
+    Tag.objects.bulk_create([Tag(name=name, usage_count=count) for name, count in usage.items()], batch_size=1000)
+    ids = dict(Tag.objects.values_list('name', 'id'))
+    ListingTag.objects.bulk_create([ListingTag(tag_id=ids[name], **{field: listing_id}) for field, listing_id, name in links], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0012_wikidata_taxonomy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('usage_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-usage_count', 'name'], name='market_tag_usage_c_86e940_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ListingTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('offer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='tag_links', to='market.serviceoffer')),
+                ('service_request', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='tag_links', to='market.servicerequest')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='listings', to='market.tag')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('tag', 'offer'), name='unique_offer_tag'), models.UniqueConstraint(fields=('tag', 'service_request'), name='unique_request_tag')],
+            },
+        ),
+        migrations.RunPython(link_existing_tags, migrations.RunPython.noop),
+    ]
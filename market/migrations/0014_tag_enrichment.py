@@ -0,0 +1,27 @@
+# Generated by Django 5.2.8 on 2026-10-19 00:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0013_listing_tags'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackfillCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='wikidatacacheentry',
+            name='kind',
+            field=models.CharField(choices=[('entity', 'Search term -> candidate entity ids'), ('related', 'Entity id -> related tags'), ('term', 'Listing key term -> entity id')], max_length=10),
+        ),
+    ]
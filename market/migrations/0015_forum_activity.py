@@ -0,0 +1,58 @@
+# Generated by Django 5.2.8 on 2026-10-19 00:31
+
+import math
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def count_existing_comments(apps, schema_editor):
+    # Same score as models.forum_hot_score at the time of this migration
+    ForumTopic = apps.get_model('market', 'ForumTopic')
+    topics = list(ForumTopic.objects.annotate(num_comments=Count('comments'), last_comment_at=Max('comments__created_at')))
+    for topic in topics:
+        topic.comment_count = topic.num_comments
+        topic.last_activity_at = topic.last_comment_at or topic.created_at
+        topic.hot_score = math.log10(1 + topic.comment_count) + topic.last_activity_at.timestamp() / 45000
+    ForumTopic.objects.bulk_update(topics, ['comment_count', 'last_activity_at', 'hot_score'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0014_tag_enrichment'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='forumtopic',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='forumtopic',
+            name='hot_score',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='forumtopic',
+            name='last_activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='forumtopic',
+            index=models.Index(fields=['-created_at', '-id'], name='forum_topic_new_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='forumtopic',
+            index=models.Index(fields=['-last_activity_at', '-id'], name='forum_topic_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='forumtopic',
+            index=models.Index(fields=['-hot_score', '-id'], name='forum_topic_hot_idx'),
+        ),
+        migrations.RunPython(count_existing_comments, migrations.RunPython.noop),
+    ]
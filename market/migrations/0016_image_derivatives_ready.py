@@ -0,0 +1,44 @@
+# Generated by Django 5.2.8 on 2026-10-18 23:34
+
+import os
+
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+IMAGE_FIELDS = {'profile': 'avatar', 'serviceoffer': 'image', 'servicerequest': 'image'}
+
+
+def mark_existing_derivatives(apps, schema_editor):
+    # One storage check per distinct image, as market.images.has_derivatives did at the time
+    for model_name, field in IMAGE_FIELDS.items():
+        model = apps.get_model('market', model_name)
+        names = set(model.objects.exclude(**{f'{field}__isnull': True}).exclude(**{field: ''}).values_list(field, flat=True))
+        for name in names:
+            if default_storage.exists(f"derivatives/{os.path.splitext(name)[0]}.thumb.webp"):
+                model.objects.filter(**{field: name}).update(derivatives_of=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0015_forum_activity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='derivatives_of',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='serviceoffer',
+            name='derivatives_of',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='servicerequest',
+            name='derivatives_of',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+        migrations.RunPython(mark_existing_derivatives, migrations.RunPython.noop),
+    ]
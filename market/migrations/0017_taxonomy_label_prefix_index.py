@@ -0,0 +1,22 @@
+# Generated by Django 5.2.8 on 2026-10-18 23:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0016_image_derivatives_ready'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='taxonomyentity',
+            name='label_lower',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='taxonomyentity',
+            index=models.Index(fields=['label_lower'], name='taxonomy_label_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
@@ -1,30 +1,58 @@
-from django.db import models
+import math
+
+from django.db import models, transaction
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_save, pre_delete, post_delete
 from django.dispatch import receiver
+from django.utils import timezone
 
 User = settings.AUTH_USER_MODEL
 
+# Every new member starts with this many hours; the ledger only records transfers after that
+STARTING_BALANCE = 3
+
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
-    balance = models.IntegerField(default=3, help_text="User time balance")
+    balance = models.IntegerField(default=STARTING_BALANCE, help_text="User time balance")
     bio = models.TextField(blank=True, null=True)
     avatar = models.ImageField(upload_to='avatars/', blank=True, null=True)
+    # Image name whose resized derivatives exist (market.images); lets serializers skip storage checks
+    derivatives_of = models.CharField(max_length=100, blank=True, default='', editable=False)
     location = models.CharField(max_length=200, blank=True, null=True, help_text="User location")
     show_history = models.BooleanField(default=True)
+    # Received review totals split by the role the user had in the service.
+    # Maintained by Review.save()/post_delete; rebuild with `manage.py backfill_ratings`
+    provider_rating_sum = models.PositiveIntegerField(default=0)
+    provider_rating_count = models.PositiveIntegerField(default=0)
+    consumer_rating_sum = models.PositiveIntegerField(default=0)
+    consumer_rating_count = models.PositiveIntegerField(default=0)
+    # Change counters for the cached sections of the public profile page (see profile_cache)
+    listings_version = models.PositiveIntegerField(default=0)
+    completed_version = models.PositiveIntegerField(default=0)
+    reviews_version = models.PositiveIntegerField(default=0)
     
     @property
     def average_rating(self):
-        """Calculate average rating from reviews"""
-        reviews = Review.objects.filter(target_user=self.user)
-        if reviews.count() == 0:
+        """Average of all received ratings (from the stored totals, no query)"""
+        count = self.review_count
+        if count == 0:
             return 0.0
-        return reviews.aggregate(models.Avg('rating'))['rating__avg'] or 0.0
+        return (self.provider_rating_sum + self.consumer_rating_sum) / count
     
     @property
     def review_count(self):
         """Get total number of reviews"""
-        return Review.objects.filter(target_user=self.user).count()
+        return self.provider_rating_count + self.consumer_rating_count
+    
+    @property
+    def provider_average_rating(self):
+        return self.provider_rating_sum / self.provider_rating_count if self.provider_rating_count else 0.0
+    
+    @property
+    def consumer_average_rating(self):
+        return self.consumer_rating_sum / self.consumer_rating_count if self.consumer_rating_count else 0.0
     
     def get_average_rating(self):
         """Get average rating as a method (for template compatibility)"""
@@ -39,11 +67,15 @@ class ServiceOffer(models.Model):
     category = models.CharField(max_length=50)
     duration = models.IntegerField(default=1)
     capacity = models.IntegerField(default=1, help_text="Number of spots available for this offer")
+    # Seats taken by accepted interactions; only changed through conditional UPDATEs (see interaction_states)
+    reserved_seats = models.PositiveIntegerField(default=0, help_text="Number of spots already taken")
     latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True, help_text="Latitude coordinate")
     longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True, help_text="Longitude coordinate")
     address = models.TextField(blank=True, null=True, help_text="Address text")
     location = models.CharField(max_length=200, blank=True, null=True, help_text="Location name (city, district, etc.)")
     image = models.ImageField(upload_to='listings/', blank=True, null=True, help_text="Listing image")
+    # Image name whose resized derivatives exist (market.images); lets serializers skip storage checks
+    derivatives_of = models.CharField(max_length=100, blank=True, default='', editable=False)
     is_visible = models.BooleanField(default=True)
     is_online = models.BooleanField(default=False)
     tags = models.JSONField(default=list, blank=True, help_text="Semantic tags from Wikidata")
@@ -61,6 +93,8 @@ class ServiceRequest(models.Model):
     address = models.TextField(blank=True, null=True, help_text="Address text")
     location = models.CharField(max_length=200, blank=True, null=True, help_text="Location name (city, district, etc.)")
     image = models.ImageField(upload_to='listings/', blank=True, null=True, help_text="Listing image")
+    # Image name whose resized derivatives exist (market.images); lets serializers skip storage checks
+    derivatives_of = models.CharField(max_length=100, blank=True, default='', editable=False)
     is_visible = models.BooleanField(default=True)
     is_online = models.BooleanField(default=False)
     tags = models.JSONField(default=list, blank=True, help_text="Semantic tags from Wikidata")
@@ -90,7 +124,11 @@ class InteractionRequest(models.Model):
     is_confirmed_by_receiver = models.BooleanField(default=False)
     deleted_by_sender = models.BooleanField(default=False)
     deleted_by_receiver = models.BooleanField(default=False)
+    # Bumped by every state transition (see interaction_states); guards against concurrent updates
+    version = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Conditional UPDATEs set this explicitly; the reputation job uses it to find touched users
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     class Meta: ordering = ['-created_at']
 
 class ChatMessage(models.Model):
@@ -105,6 +143,10 @@ class ChatMessage(models.Model):
 class TimeTransaction(models.Model):
     offer = models.ForeignKey(ServiceOffer, on_delete=models.CASCADE, null=True)
     request = models.ForeignKey(ServiceRequest, on_delete=models.CASCADE, null=True)
+    # Ledger parties: sender is debited by amount, receiver is credited.
+    # Group settlements debit each participant on its own row and credit the provider once, so one side may be empty
+    sender = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='sent_transactions', help_text="User debited by this transaction")
+    receiver = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='received_transactions', help_text="User credited by this transaction")
     amount = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -147,6 +189,27 @@ class Review(models.Model):
             return self.service_request.id
         return None
     
+    @property
+    def target_role(self):
+        """'provider' or 'consumer': the side of the service the reviewed user was on"""
+        if self.offer_id:
+            return 'provider' if self.offer.user_id == self.target_user_id else 'consumer'
+        if self.service_request_id:
+            return 'consumer' if self.service_request.user_id == self.target_user_id else 'provider'
+        return 'consumer'
+    
+    def save(self, *args, **kwargs):
+        # Profile rating totals are updated in the same transaction as the review
+        with transaction.atomic():
+            previous = None
+            if self.pk:
+                previous = Review.objects.select_related('offer', 'service_request').filter(pk=self.pk).first()
+            super().save(*args, **kwargs)
+            if previous and previous.target_user_id:
+                _update_rating_totals(previous.target_user_id, previous.target_role, -previous.rating, -1)
+            if self.target_user_id:
+                _update_rating_totals(self.target_user_id, self.target_role, self.rating, 1)
+    
     class Meta:
         ordering = ['-created_at']
         # Prevent duplicate reviews for the same service
@@ -212,16 +275,27 @@ class ForumTopic(models.Model):
     category = models.CharField(max_length=50, choices=CATEGORY_CHOICES, default='general')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Yorumlardan türetilir; yorum eklenip silinirken F() ile güncellenir (_update_topic_activity)
+    comment_count = models.PositiveIntegerField(default=0)
+    last_activity_at = models.DateTimeField(default=timezone.now)
+    # Etkileşim + güncellik; zamanla yalnızca artar, bu yüzden indekslenebilir (forum_hot_score)
+    hot_score = models.FloatField(default=0.0)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='forum_topic_new_idx'),
+            models.Index(fields=['-last_activity_at', '-id'], name='forum_topic_active_idx'),
+            models.Index(fields=['-hot_score', '-id'], name='forum_topic_hot_idx'),
+        ]
     
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            self.hot_score = forum_hot_score(self.comment_count, self.last_activity_at)
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.title
-    
-    @property
-    def comment_count(self):
-        return self.comments.count()
 
 class ForumComment(models.Model):
     """Forum comment modeli"""
@@ -231,12 +305,221 @@ class ForumComment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    def save(self, *args, **kwargs):
+        # Topic counters are updated in the same transaction as the comment
+        with transaction.atomic():
+            adding = self._state.adding
+            super().save(*args, **kwargs)
+            if adding:
+                _update_topic_activity(
+                    self.topic_id, 1, Greatest(F('last_activity_at'), Value(self.created_at)),
+                )
+    
     class Meta:
         ordering = ['created_at']
     
     def __str__(self):
         return f"Comment by {self.author.username} on {self.topic.title}"
 
+class ReputationMetrics(models.Model):
+    """Kullanıcının etkileşim geçmişinden hesaplanan itibar metrikleri (market.reputation, refresh_reputation komutu)"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='reputation')
+    # completed / (completed + declined + cancelled) over interactions the user took part in
+    completion_rate = models.FloatField(null=True, blank=True)
+    finished_count = models.PositiveIntegerField(default=0)
+    # Median seconds between a request reaching the user and the user's first message in it
+    median_response_seconds = models.FloatField(null=True, blank=True)
+    response_samples = models.PositiveIntegerField(default=0)
+    # Share of completed-service partners the user completed more than one service with
+    repeat_partner_ratio = models.FloatField(null=True, blank=True)
+    partner_count = models.PositiveIntegerField(default=0)
+    computed_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"Reputation of {self.user}"
+
+class ListingFeature(models.Model):
+    """Bir teklifin öneri motorundaki özellik vektörü: 'tag:guitar', 'cat:music' (market.recommendations)"""
+    offer = models.ForeignKey(ServiceOffer, on_delete=models.CASCADE, related_name='features')
+    feature = models.CharField(max_length=120)
+    weight = models.FloatField()
+
+    class Meta:
+        unique_together = ['offer', 'feature']
+        indexes = [models.Index(fields=['feature', 'offer'])]
+
+
+class FeatureCooccurrence(models.Model):
+    """İki özelliğin üyelerin ilanlarında birlikte görülme skoru (build_recommendations komutu yeniden hesaplar)"""
+    feature = models.CharField(max_length=120)
+    related = models.CharField(max_length=120)
+    weight = models.FloatField()
+
+    class Meta:
+        unique_together = ['feature', 'related']
+
+
+class WikidataCacheEntry(models.Model):
+    """Wikidata arama sonuçlarının kalıcı cache'i (market.wikidata_cache)"""
+    KIND_CHOICES = [
+        ('entity', 'Search term -> candidate entity ids'),
+        ('related', 'Entity id -> related tags'),
+        ('term', 'Listing key term -> entity id'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    # Normalized search term or entity id
+    key = models.CharField(max_length=200)
+    value = models.JSONField(null=True)
+    # Upstream answered but found nothing; these expire sooner
+    is_negative = models.BooleanField(default=False)
+    fetched_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ['kind', 'key']
+
+    def __str__(self):
+        return f"{self.kind}:{self.key}"
+
+
+class TaxonomyEntity(models.Model):
+    """Yerel Wikidata alt kümesindeki bir kavram (market.taxonomy)"""
+    qid = models.CharField(max_length=20, primary_key=True)
+    label = models.CharField(max_length=255)
+    # Lowercased label; prefix lookups (LIKE 'term%') use the pattern index below
+    label_lower = models.CharField(max_length=255)
+    # Precomputed labels of related concepts, in suggestion order
+    neighbours = models.JSONField(default=list)
+
+    class Meta:
+        indexes = [
+            # varchar_pattern_ops lets PostgreSQL use the index for LIKE under any collation;
+            # other backends ignore the operator class
+            models.Index(fields=['label_lower'], name='taxonomy_label_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ]
+
+    def __str__(self):
+        return f"{self.qid} ({self.label})"
+
+
+class TaxonomyRelation(models.Model):
+    """İki kavram arasındaki Wikidata ilişkisi (source --property--> target)"""
+    PROPERTY_CHOICES = [
+        ('P279', 'subclass of'),
+        ('P366', 'has use'),
+        ('P3095', 'practiced by'),
+        ('P1056', 'product or material produced'),
+    ]
+
+    source = models.CharField(max_length=20)
+    property = models.CharField(max_length=10, choices=PROPERTY_CHOICES)
+    target = models.CharField(max_length=20, db_index=True)
+
+    class Meta:
+        unique_together = ['source', 'property', 'target']
+
+    def __str__(self):
+        return f"{self.source} {self.property} {self.target}"
+
+
+class Tag(models.Model):
+    """İlanlarda kullanılan normalize edilmiş etiket (market.tagging)"""
+    # Lowercased, whitespace-collapsed tag text
+    name = models.CharField(max_length=100, unique=True)
+    # Listings (offers + requests) carrying the tag; maintained by market.tagging
+    usage_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=['-usage_count', 'name'])]
+
+    def __str__(self):
+        return self.name
+
+
+class ListingTag(models.Model):
+    """Bir ilan ile etiketi arasındaki bağ; ilan ya offer ya da request'tir"""
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='listings')
+    offer = models.ForeignKey(ServiceOffer, on_delete=models.CASCADE, null=True, blank=True, related_name='tag_links')
+    service_request = models.ForeignKey(ServiceRequest, on_delete=models.CASCADE, null=True, blank=True, related_name='tag_links')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['tag', 'offer'], name='unique_offer_tag'),
+            models.UniqueConstraint(fields=['tag', 'service_request'], name='unique_request_tag'),
+        ]
+
+    def __str__(self):
+        return f"{self.offer or self.service_request} #{self.tag}"
+
+
+class BackfillCheckpoint(models.Model):
+    """Uzun süren bir backfill işinin kaldığı yer (yeniden başlatılınca buradan devam eder)"""
+    name = models.CharField(max_length=100, unique=True)
+    # Highest primary key already processed
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.last_id}"
+
+
+class MediaBlob(models.Model):
+    """Yüklenen bir dosya içeriği; aynı içerik diskte tek kez tutulur (core.storage.ContentAddressedStorage)"""
+    digest = models.CharField(max_length=64, unique=True, help_text="sha256 of the content")
+    name = models.CharField(max_length=100, unique=True, help_text="Storage name of the blob")
+    size = models.PositiveBigIntegerField(default=0)
+    # Number of image fields pointing at this blob; maintained by market.blobs
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Last upload or release; garbage collection keeps recently touched blobs
+    touched_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['ref_count', 'touched_at'])]
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} refs)"
+
+def _update_rating_totals(user_id, role, rating_delta, count_delta):
+    Profile.objects.filter(user_id=user_id).update(**{
+        f'{role}_rating_sum': F(f'{role}_rating_sum') + rating_delta,
+        f'{role}_rating_count': F(f'{role}_rating_count') + count_delta,
+    })
+
+# Seconds of recency worth one order of magnitude of comments in the hot ordering
+FORUM_HOT_DECAY_SECONDS = 45000
+
+def forum_hot_score(comment_count, last_activity_at):
+    """log10(1 + comments) + last activity / decay: newer activity always adds, so no periodic rescoring is needed"""
+    return math.log10(1 + comment_count) + last_activity_at.timestamp() / FORUM_HOT_DECAY_SECONDS
+
+def _update_topic_activity(topic_id, count_delta, last_activity_at):
+    topics = ForumTopic.objects.filter(pk=topic_id)
+    topics.update(comment_count=F('comment_count') + count_delta, last_activity_at=last_activity_at)
+    row = topics.values_list('comment_count', 'last_activity_at').first()
+    if row:
+        topics.update(hot_score=forum_hot_score(*row))
+
+@receiver(post_delete, sender=ForumComment)
+def remove_topic_comment(sender, instance, origin=None, **kwargs):
+    # Konu silinirken yorumları da silinir; o konuyu güncellemeye gerek yok
+    if isinstance(origin, ForumTopic) and origin.pk == instance.topic_id:
+        return
+    latest = ForumComment.objects.filter(topic=OuterRef('pk')).order_by('-created_at').values('created_at')[:1]
+    _update_topic_activity(instance.topic_id, -1, Coalesce(Subquery(latest), F('created_at')))
+
+@receiver(pre_delete, sender=Review)
+def remember_review_role(sender, instance, **kwargs):
+    # Cascade silmelerde ilan, post_delete'ten önce silinmiş olabilir; rolü şimdiden hesapla
+    if instance.target_user_id:
+        instance._target_role = instance.target_role
+
+@receiver(post_delete, sender=Review)
+def remove_review_rating(sender, instance, **kwargs):
+    # Model.delete() ve cascade silmeler bu sinyali transaction içinde gönderir
+    if instance.target_user_id:
+        _update_rating_totals(instance.target_user_id, instance._target_role, -instance.rating, -1)
+
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     if created: Profile.objects.create(user=instance)
@@ -0,0 +1,41 @@
+from rest_framework.pagination import CursorPagination
+
+
+class TransactionCursorPagination(CursorPagination):
+    """Newest first; the cursor is the transaction id, so deep pages cost the same as the first"""
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = '-id'
+
+
+class ReviewCursorPagination(CursorPagination):
+    """Newest reviews first, with id as tie-breaker so equal timestamps never skip or repeat rows"""
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
+
+
+class ForumTopicCursorPagination(CursorPagination):
+    """Forum index; ?sort=new (default), active (latest comment) or hot. Each ordering has a matching index"""
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
+    orderings = {
+        'new': ('-created_at', '-id'),
+        'active': ('-last_activity_at', '-id'),
+        'hot': ('-hot_score', '-id'),
+    }
+
+    def get_ordering(self, request, queryset, view):
+        return self.orderings.get(request.query_params.get('sort'), self.ordering)
+
+
+class ForumCommentCursorPagination(CursorPagination):
+    """Comments of one topic in reading order"""
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = ('created_at', 'id')
@@ -0,0 +1,131 @@
+"""
+Section cache for the server-rendered profile page.
+
+Each section (active listings, completed services, reviews) is cached under a key
+that includes the owner's change counter for that section, stored on Profile. The
+counters are bumped when something that feeds the section changes, so a new
+listing only rebuilds the listings section and the old entries simply expire.
+Because the counters live in the database, every worker process sees the bump
+even with a per-process cache backend. Header stats are derived from the cached
+sections and Profile's stored rating totals, so they need no queries of their own.
+"""
+from django.core.cache import cache
+from django.db.models import F
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from .interaction_states import status_changed
+from .models import InteractionRequest, Profile, Review, ServiceOffer, ServiceRequest
+
+SECTIONS = ('listings', 'completed', 'reviews')
+SECTION_TIMEOUT = 60 * 60 * 24
+# Profile cards are not versioned; ratings change through UPDATEs, so they simply expire quickly
+CARD_TIMEOUT = 60
+
+
+def section_key(profile, section):
+    return f"profile-section:{profile.user_id}:{section}:{getattr(profile, f'{section}_version')}"
+
+
+def cached_section(profile, section, build):
+    """Return the cached value of a section, calling build() only when its version changed"""
+    return cache.get_or_set(section_key(profile, section), build, SECTION_TIMEOUT)
+
+
+def card_key(username):
+    return f"profile-card:{username}"
+
+
+def profile_cards(usernames):
+    """Compact cards for usernames as {username: card}; cache misses are loaded in one query"""
+    from .serializers import ProfileCardSerializer
+
+    keys = {card_key(username): username for username in usernames}
+    cards = {keys[key]: card for key, card in cache.get_many(keys).items()}
+    missing = [username for username in usernames if username not in cards]
+    if missing:
+        profiles = Profile.objects.filter(user__username__in=missing).select_related('user')
+        loaded = {card['username']: card for card in ProfileCardSerializer(profiles, many=True).data}
+        cache.set_many({card_key(username): card for username, card in loaded.items()}, CARD_TIMEOUT)
+        cards.update(loaded)
+    return cards
+
+
+def bump(user_ids, *sections):
+    """Invalidate sections for the given users by moving their counters forward"""
+    user_ids = {user_id for user_id in user_ids if user_id}
+    if user_ids:
+        Profile.objects.filter(user_id__in=user_ids).update(
+            **{f'{section}_version': F(f'{section}_version') + 1 for section in sections}
+        )
+
+
+@receiver(post_save, sender=Profile)
+def profile_saved(sender, instance, **kwargs):
+    cache.delete(card_key(instance.user.username))
+
+
+# Listing fields copied into the cached completed-services cards (views._listing_card);
+# reviews only show the title
+CARD_FIELDS = {'title', 'description', 'category', 'duration', 'is_online', 'image'}
+REVIEW_FIELDS = {'title'}
+# Review foreign key of each listing model
+REVIEW_LINKS = {ServiceOffer: 'offer', ServiceRequest: 'service_request'}
+
+
+def _card_values(instance):
+    deferred = instance.get_deferred_fields()
+    return {field: getattr(instance, field) for field in CARD_FIELDS if field not in deferred}
+
+
+@receiver(post_init, sender=ServiceOffer)
+@receiver(post_init, sender=ServiceRequest)
+def remember_card_values(sender, instance, **kwargs):
+    instance._card_values = _card_values(instance) if instance.pk else {}
+
+
+def _changed_fields(instance, update_fields):
+    if update_fields is not None:
+        return CARD_FIELDS & set(update_fields)
+    loaded = getattr(instance, '_card_values', {})
+    return {field for field, value in loaded.items() if getattr(instance, field) != value}
+
+
+@receiver(post_save, sender=ServiceOffer)
+@receiver(post_save, sender=ServiceRequest)
+def listing_saved(sender, instance, created, update_fields=None, **kwargs):
+    bump([instance.user_id], 'listings')
+    changed = set() if created else _changed_fields(instance, update_fields)
+    instance._card_values = _card_values(instance)
+    if changed:
+        # The owner's completed-service cards and every review of the listing show these values
+        bump([instance.user_id], 'completed')
+        if changed & REVIEW_FIELDS:
+            reviews = Review.objects.filter(**{REVIEW_LINKS[sender]: instance})
+            bump(set(reviews.values_list('target_user_id', flat=True)), 'reviews')
+
+
+@receiver(post_delete, sender=ServiceOffer)
+@receiver(post_delete, sender=ServiceRequest)
+def listing_deleted(sender, instance, **kwargs):
+    # Completed services of the listing disappear with it
+    bump([instance.user_id], 'listings', 'completed')
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def review_changed(sender, instance, **kwargs):
+    bump([instance.target_user_id, instance.reviewer_id], 'reviews')
+
+
+@receiver(status_changed, sender=InteractionRequest)
+def interaction_status_changed(sender, interactions, **kwargs):
+    # A status change can hide or show the listing and add a completed service for its owner
+    user_ids = [interaction.sender_id for interaction in interactions]
+    user_ids += [interaction.receiver_id for interaction in interactions]
+    bump(user_ids, 'listings', 'completed')
+
+
+@receiver(post_delete, sender=InteractionRequest)
+def interaction_deleted(sender, instance, **kwargs):
+    bump([instance.sender_id, instance.receiver_id], 'listings', 'completed')
@@ -0,0 +1,50 @@
+"""
+Review rating aggregates computed by the database.
+
+review_role() is the SQL counterpart of Review.target_role, so role splits can be
+grouped or filtered without loading reviews and their listings into Python.
+"""
+from django.db.models import Avg, Case, CharField, Count, F, Q, Sum, Value, When
+
+RATING_FIELDS = ['provider_rating_sum', 'provider_rating_count', 'consumer_rating_sum', 'consumer_rating_count']
+
+
+def review_role():
+    """'provider' or 'consumer' for each review, relative to its target_user"""
+    return Case(
+        When(offer__isnull=False, offer__user=F('target_user'), then=Value('provider')),
+        When(offer__isnull=False, then=Value('consumer')),
+        When(service_request__isnull=False, service_request__user=F('target_user'), then=Value('consumer')),
+        When(service_request__isnull=False, then=Value('provider')),
+        default=Value('consumer'),
+        output_field=CharField(),
+    )
+
+
+def rating_totals_by_user(reviews):
+    """Rows of (target_user, role, rating_sum, rating_count), one per user and role, ordered by user"""
+    return (
+        reviews.filter(target_user__isnull=False)
+        .annotate(role=review_role())
+        .values('target_user', 'role')
+        .annotate(rating_sum=Sum('rating'), rating_count=Count('id'))
+        .order_by('target_user')
+    )
+
+
+def review_summary(reviews):
+    """Per-role counts and averages plus the 1-5 star distribution of reviews, in one aggregate query"""
+    aggregates = {}
+    for role in ('provider', 'consumer'):
+        aggregates[f'{role}_count'] = Count('id', filter=Q(role=role))
+        aggregates[f'{role}_average'] = Avg('rating', filter=Q(role=role))
+    for stars in range(1, 6):
+        aggregates[f'stars_{stars}'] = Count('id', filter=Q(rating=stars))
+    row = reviews.annotate(role=review_role()).aggregate(total=Count('id'), average=Avg('rating'), **aggregates)
+    return {
+        'count': row['total'],
+        'average': round(row['average'] or 0, 2),
+        'distribution': {str(stars): row[f'stars_{stars}'] for stars in range(1, 6)},
+        'provider': {'count': row['provider_count'], 'average': round(row['provider_average'] or 0, 2)},
+        'consumer': {'count': row['consumer_count'], 'average': round(row['consumer_average'] or 0, 2)},
+    }
@@ -0,0 +1,175 @@
+"""
+"Recommended for you": offers scored against a member's interests.
+
+Every offer has a small feature vector (ListingFeature: its category and tags,
+L2-normalized) that is rewritten whenever the offer is saved. A periodic job
+(build_recommendations) counts which features appear together in members'
+baskets (their own offers and requests plus listings they completed services
+on) and stores the strongest normalized pairs as a sparse matrix
+(FeatureCooccurrence).
+
+Online, a member's interest vector is their own basket expanded one step through
+the matrix; offers are then scored with a single indexed GROUP BY over
+ListingFeature rows of those features, so only offers sharing a feature are ever
+touched. Visibility, free seats and blocks are applied in the same query.
+"""
+import math
+from collections import Counter, defaultdict
+from itertools import combinations
+
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Q, Sum, Value, When
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import Block, FeatureCooccurrence, InteractionRequest, ListingFeature, ServiceOffer, ServiceRequest
+
+# Matrix pairs kept per feature, and the minimum number of baskets a pair must share
+RELATED_PER_FEATURE = 20
+MIN_SUPPORT = 2
+# Weight of features reached through the matrix relative to the member's own features
+EXPANSION_WEIGHT = 0.5
+MAX_INTEREST_FEATURES = 50
+BATCH_SIZE = 1000
+
+
+def listing_features(category, tags):
+    """Normalized feature names of a listing"""
+    features = set()
+    if category:
+        features.add(f"cat:{category.strip().lower()}"[:120])
+    for tag in tags or ():
+        if isinstance(tag, str) and tag.strip():
+            features.add(f"tag:{tag.strip().lower()}"[:120])
+    return features
+
+
+def index_offers(offers):
+    """Rewrite the feature vectors of offers"""
+    rows = []
+    for offer in offers:
+        features = listing_features(offer.category, offer.tags)
+        rows += [ListingFeature(offer=offer, feature=feature, weight=1 / math.sqrt(len(features))) for feature in features]
+    with transaction.atomic():
+        ListingFeature.objects.filter(offer_id__in=[offer.id for offer in offers]).delete()
+        ListingFeature.objects.bulk_create(rows)
+
+
+def index_offer(offer):
+    """Rewrite the feature vector of one offer"""
+    index_offers([offer])
+
+
+@receiver(post_save, sender=ServiceOffer)
+def offer_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {'category', 'tags'} & set(update_fields):
+        return
+    index_offer(instance)
+
+
+def _baskets(batch_size=BATCH_SIZE):
+    """{user_id: set of features} over own listings and listings of completed services"""
+    baskets = defaultdict(set)
+    for model in (ServiceOffer, ServiceRequest):
+        rows = model.objects.values_list('user_id', 'category', 'tags').order_by()
+        for user_id, category, tags in rows.iterator(chunk_size=batch_size):
+            baskets[user_id] |= listing_features(category, tags)
+    completed = InteractionRequest.objects.filter(status='completed').values_list(
+        'sender_id', 'receiver_id', 'offer__category', 'offer__tags',
+        'service_request__category', 'service_request__tags',
+    ).order_by()
+    for sender_id, receiver_id, offer_category, offer_tags, request_category, request_tags in completed.iterator(chunk_size=batch_size):
+        features = listing_features(offer_category, offer_tags) | listing_features(request_category, request_tags)
+        baskets[sender_id] |= features
+        baskets[receiver_id] |= features
+    return baskets
+
+
+def build_cooccurrence(batch_size=BATCH_SIZE):
+    """Recompute the co-occurrence matrix from every member's basket; returns the number of pairs stored"""
+    counts = Counter()
+    pairs = Counter()
+    for features in _baskets(batch_size).values():
+        counts.update(features)
+        pairs.update(combinations(sorted(features), 2))
+
+    related = defaultdict(list)
+    for (a, b), together in pairs.items():
+        if together < MIN_SUPPORT:
+            continue
+        weight = together / math.sqrt(counts[a] * counts[b])
+        related[a].append((weight, b))
+        related[b].append((weight, a))
+
+    rows = [
+        FeatureCooccurrence(feature=feature, related=other, weight=weight)
+        for feature, candidates in related.items()
+        for weight, other in sorted(candidates, reverse=True)[:RELATED_PER_FEATURE]
+    ]
+    with transaction.atomic():
+        FeatureCooccurrence.objects.all().delete()
+        FeatureCooccurrence.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
+
+
+def reindex_offers(batch_size=BATCH_SIZE):
+    """Rebuild every offer's feature vector (backfill for offers saved before indexing existed)"""
+    indexed = 0
+    batch = []
+    offers = ServiceOffer.objects.only('id', 'category', 'tags').order_by('id')
+    for offer in offers.iterator(chunk_size=batch_size):
+        batch.append(offer)
+        if len(batch) == batch_size:
+            index_offers(batch)
+            indexed += len(batch)
+            batch = []
+    if batch:
+        index_offers(batch)
+        indexed += len(batch)
+    return indexed
+
+
+def interest_vector(user):
+    """{feature: weight} for user: own features plus their neighbours in the co-occurrence matrix"""
+    own = set()
+    for model in (ServiceOffer, ServiceRequest):
+        for category, tags in model.objects.filter(user=user).values_list('category', 'tags'):
+            own |= listing_features(category, tags)
+    completed = InteractionRequest.objects.filter(Q(sender=user) | Q(receiver=user), status='completed').values_list(
+        'offer__category', 'offer__tags', 'service_request__category', 'service_request__tags',
+    )
+    for offer_category, offer_tags, request_category, request_tags in completed:
+        own |= listing_features(offer_category, offer_tags) | listing_features(request_category, request_tags)
+
+    vector = Counter({feature: 1.0 for feature in own})
+    if own:
+        neighbours = FeatureCooccurrence.objects.filter(feature__in=own).values_list('related', 'weight')
+        for related, weight in neighbours:
+            vector[related] += EXPANSION_WEIGHT * weight
+    return dict(vector.most_common(MAX_INTEREST_FEATURES))
+
+
+def recommend_offers(user, limit=10):
+    """Top offers for user as [(offer_id, score)], best first"""
+    vector = interest_vector(user)
+    if not vector:
+        return []
+
+    blocked = Block.objects.filter(blocker=user).values('blocked_id')
+    blocking = Block.objects.filter(blocked=user).values('blocker_id')
+    matches = (
+        ListingFeature.objects
+        .filter(feature__in=vector)
+        .filter(offer__is_visible=True, offer__reserved_seats__lt=F('offer__capacity'))
+        .exclude(offer__user=user)
+        .exclude(offer__user_id__in=blocked)
+        .exclude(offer__user_id__in=blocking)
+        .exclude(offer__interactions__status='completed')
+        .values('offer_id')
+        .annotate(score=Sum(F('weight') * Case(
+            *[When(feature=feature, then=Value(weight)) for feature, weight in vector.items()],
+            default=Value(0.0), output_field=FloatField(),
+        )))
+        .order_by('-score', '-offer_id')
+    )
+    return [(row['offer_id'], row['score']) for row in matches[:limit]]
@@ -0,0 +1,147 @@
+"""
+Member reputation metrics, precomputed into ReputationMetrics by a batch job.
+
+    completion_rate          completed / (completed + declined + cancelled) over the
+                             interactions a user took part in
+    median_response_seconds  median time between a request reaching a user (they are
+                             its receiver) and their first chat message in it
+    repeat_partner_ratio     share of completed-service partners with more than one
+                             completed service together
+
+refresh_metrics() streams the interaction rows and per-interaction first replies
+(the GROUP BY runs in the database) once, accumulating per-user counters and
+compact float arrays, so the whole member base is processed in one pass. An
+incremental run only recomputes users whose interactions or messages changed
+since the previous run, each from their full history.
+"""
+from array import array
+from collections import Counter, defaultdict
+from statistics import median
+
+from django.db import transaction
+from django.db.models import F, Min, Q
+from django.utils import timezone
+
+from .models import ChatMessage, InteractionRequest, ReputationMetrics
+
+FINISHED_STATUSES = ('completed', 'declined', 'cancelled')
+METRIC_FIELDS = [
+    'completion_rate', 'finished_count', 'median_response_seconds', 'response_samples',
+    'repeat_partner_ratio', 'partner_count',
+]
+CHUNK_SIZE = 5000
+WRITE_BATCH_SIZE = 1000
+
+
+def touched_users(since):
+    """Ids of users with interactions or chat messages changed after since"""
+    interactions = InteractionRequest.objects.filter(updated_at__gt=since)
+    users = set(interactions.values_list('sender_id', flat=True))
+    users.update(interactions.values_list('receiver_id', flat=True))
+    replied = ChatMessage.objects.filter(timestamp__gt=since).values_list('interaction__receiver_id', flat=True)
+    users.update(replied.distinct())
+    return users
+
+
+def _scope(queryset, user_ids, *paths):
+    if user_ids is None:
+        return queryset
+    condition = Q()
+    for path in paths:
+        condition |= Q(**{f'{path}__in': user_ids})
+    return queryset.filter(condition)
+
+
+def compute_metrics(user_ids=None, chunk_size=CHUNK_SIZE):
+    """{user_id: field values} for user_ids (None = everyone with interactions)"""
+    finished = Counter()
+    completed = Counter()
+    partners = defaultdict(Counter)
+    responses = defaultdict(lambda: array('d'))
+
+    interactions = _scope(InteractionRequest.objects.all(), user_ids, 'sender_id', 'receiver_id')
+    rows = interactions.filter(status__in=FINISHED_STATUSES).values_list('sender_id', 'receiver_id', 'status')
+    for sender_id, receiver_id, status in rows.order_by().iterator(chunk_size=chunk_size):
+        for user_id, partner_id in ((sender_id, receiver_id), (receiver_id, sender_id)):
+            finished[user_id] += 1
+            if status == 'completed':
+                completed[user_id] += 1
+                partners[user_id][partner_id] += 1
+
+    first_replies = (
+        _scope(InteractionRequest.objects.all(), user_ids, 'receiver_id')
+        .filter(messages__sender_id=F('receiver_id'))
+        .values_list('id', 'receiver_id', 'created_at')
+        .annotate(first_reply=Min('messages__timestamp'))
+        .order_by()
+    )
+    for _, receiver_id, created_at, first_reply in first_replies.iterator(chunk_size=chunk_size):
+        responses[receiver_id].append(max((first_reply - created_at).total_seconds(), 0.0))
+
+    metrics = {}
+    for user_id in set(finished) | set(responses) | set(user_ids or ()):
+        if user_ids is not None and user_id not in user_ids:
+            continue  # A partner of a scoped user; their own history was not read
+        samples = responses.get(user_id)
+        partner_counts = partners.get(user_id, {})
+        metrics[user_id] = {
+            'completion_rate': completed[user_id] / finished[user_id] if finished[user_id] else None,
+            'finished_count': finished[user_id],
+            'median_response_seconds': median(samples) if samples else None,
+            'response_samples': len(samples) if samples else 0,
+            'repeat_partner_ratio': (
+                sum(1 for count in partner_counts.values() if count > 1) / len(partner_counts)
+                if partner_counts else None
+            ),
+            'partner_count': len(partner_counts),
+        }
+    return metrics
+
+
+def write_metrics(metrics, computed_at, batch_size=WRITE_BATCH_SIZE):
+    """Upsert metrics rows in batches: bulk_update the existing ones, bulk_create the rest"""
+    user_ids = list(metrics)
+    with transaction.atomic():
+        existing = set(ReputationMetrics.objects.filter(user_id__in=user_ids).values_list('user_id', flat=True))
+        rows = [ReputationMetrics(user_id=user_id, computed_at=computed_at, **values) for user_id, values in metrics.items()]
+        ReputationMetrics.objects.bulk_update(
+            [row for row in rows if row.user_id in existing],
+            ['computed_at'] + METRIC_FIELDS,
+            batch_size=batch_size,
+        )
+        ReputationMetrics.objects.bulk_create([row for row in rows if row.user_id not in existing], batch_size=batch_size)
+
+
+def last_run():
+    return ReputationMetrics.objects.order_by('-computed_at').values_list('computed_at', flat=True).first()
+
+
+def refresh_metrics(incremental=False, chunk_size=CHUNK_SIZE):
+    """Recompute metrics (all users, or only those touched since the last run); returns the number written"""
+    started = timezone.now()
+    user_ids = None
+    if incremental:
+        since = last_run()
+        if since is not None:
+            user_ids = touched_users(since)
+            if not user_ids:
+                return 0
+    metrics = compute_metrics(user_ids, chunk_size)
+    if metrics:
+        # Rows carry the start time, so changes made while the job runs are picked up next time
+        write_metrics(metrics, started)
+    return len(metrics)
+
+
+def reputation_summary(user):
+    """Public reputation figures of user for profiles, or None before the first job run"""
+    try:
+        metrics = user.reputation
+    except ReputationMetrics.DoesNotExist:
+        return None
+    return {
+        'completion_rate': metrics.completion_rate,
+        'median_response_seconds': metrics.median_response_seconds,
+        'repeat_partner_ratio': metrics.repeat_partner_ratio,
+        'computed_at': metrics.computed_at,
+    }
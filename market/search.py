@@ -0,0 +1,99 @@
+"""
+Listing search with semantic query expansion.
+
+?q= on the listing endpoints matches title, description, category and tags
+directly, then widens the query with tags related to it: the neighbours of the
+term in the locally loaded taxonomy (one indexed lookup) and in an in-memory
+graph built from the Wikidata answers already cached in WikidataCacheEntry
+(search term -> candidate entities -> related labels, linked both ways), which
+is rebuilt in the background like the other snapshots. The expansion is matched against the indexed ListingTag links and ranks below any
+direct match. Nothing on this path calls Wikidata.
+"""
+from collections import defaultdict
+
+from django.db.models import Case, FloatField, Q, Value, When
+
+from .models import ListingTag, TaxonomyEntity, WikidataCacheEntry
+from .snapshots import Snapshot
+from .tagging import LINK_FIELDS, normalize_tag
+
+# Rank weights of the ways a listing can match
+TITLE_WEIGHT = 3.0
+TAG_WEIGHT = 2.0
+TEXT_WEIGHT = 1.0
+EXPANSION_WEIGHT = 0.5
+MAX_EXPANSIONS = 20
+
+
+class RelatedTagGraph(Snapshot):
+    """term -> related tag names, from the positive entries of the Wikidata cache"""
+    name = 'search graph'
+
+    def empty(self):
+        return {}
+
+    def load(self):
+        entities = defaultdict(list)
+        related = {}
+        rows = WikidataCacheEntry.objects.filter(kind__in=('entity', 'related'), is_negative=False)
+        for kind, key, value in rows.values_list('kind', 'key', 'value').iterator():
+            if kind == 'entity':
+                for entity_id in value:
+                    entities[entity_id].append(key)
+            else:
+                related[key] = value or []
+
+        edges = defaultdict(set)
+        for entity_id, labels in related.items():
+            names = {normalize_tag(label) for label in labels}
+            for term in entities.get(entity_id, ()):
+                term = normalize_tag(term)
+                edges[term] |= names - {term}
+                for name in names - {term}:
+                    edges[name].add(term)
+        return dict(edges)
+
+    def install(self, state):
+        self.edges = state
+
+    def related(self, term):
+        self.ensure_fresh()
+        with self._lock:
+            return set(self.edges.get(term, ()))
+
+
+graph = RelatedTagGraph()
+
+
+def expand_query(term):
+    """Tag names related to a normalized search term, most relevant source first"""
+    expansions = []
+    for neighbours in TaxonomyEntity.objects.filter(label_lower=term).values_list('neighbours', flat=True):
+        expansions += [normalize_tag(label) for label in neighbours]
+    expansions += sorted(graph.related(term))
+    return [name for name in dict.fromkeys(expansions) if name != term][:MAX_EXPANSIONS]
+
+
+def _score(condition, weight):
+    return Case(When(condition, then=Value(weight)), default=Value(0.0), output_field=FloatField())
+
+
+def search_listings(queryset, query):
+    """Filter a ServiceOffer/ServiceRequest queryset to listings matching query, best first"""
+    term = normalize_tag(query)
+    if not term:
+        return queryset
+    field = LINK_FIELDS[queryset.model]
+    links = ListingTag.objects.filter(**{f'{field}__isnull': False})
+    tagged = Q(id__in=links.filter(tag__name=term).values(field))
+    title = Q(title__icontains=term)
+    text = Q(description__icontains=term) | Q(category__iexact=term)
+    condition = title | tagged | text
+
+    expansions = expand_query(term)
+    score = _score(title, TITLE_WEIGHT) + _score(tagged, TAG_WEIGHT) + _score(text, TEXT_WEIGHT)
+    if expansions:
+        related = Q(id__in=links.filter(tag__name__in=expansions).values(field))
+        condition |= related
+        score = score + _score(related, EXPANSION_WEIGHT)
+    return queryset.filter(condition).annotate(search_score=score).order_by('-search_score', '-created_at')
@@ -1,17 +1,27 @@
 from rest_framework import serializers
 from .models import ServiceOffer, ServiceRequest, TimeTransaction, InteractionRequest, Profile, ChatMessage, Review, ForumTopic, ForumComment
+from .images import variant_urls
+from .reputation import reputation_summary
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
+
+def _variants(serializer, instance):
+    request = serializer.context.get('request')
+    return variant_urls(instance, request.build_absolute_uri if request else None)
+
+
 class ProfileSerializer(serializers.ModelSerializer):
     username = serializers.CharField(source='user.username', read_only=True)
     email = serializers.CharField(source='user.email', read_only=True)
     avatar_url = serializers.SerializerMethodField(read_only=True)
+    avatar_variants = serializers.SerializerMethodField(read_only=True)
+    reputation = serializers.SerializerMethodField(read_only=True)
     
     class Meta:
         model = Profile
-        fields = ['username', 'email', 'balance', 'bio', 'avatar', 'avatar_url', 'location', 'show_history', 'average_rating', 'review_count']
+        fields = ['username', 'email', 'balance', 'bio', 'avatar', 'avatar_url', 'avatar_variants', 'location', 'show_history', 'average_rating', 'review_count', 'reputation']
         extra_kwargs = {
             'avatar': {'required': False, 'allow_null': True},
             'bio': {'required': False, 'allow_blank': True},
@@ -25,6 +35,24 @@ class ProfileSerializer(serializers.ModelSerializer):
                 return request.build_absolute_uri(obj.avatar.url)
             return obj.avatar.url
         return None
+    
+    def get_avatar_variants(self, obj):
+        return _variants(self, obj)
+    
+    def get_reputation(self, obj):
+        return reputation_summary(obj.user)
+
+class ProfileCardSerializer(serializers.ModelSerializer):
+    """Compact public profile for chat headers and participant lists"""
+    username = serializers.CharField(source='user.username', read_only=True)
+    avatar_url = serializers.SerializerMethodField(read_only=True)
+    
+    class Meta:
+        model = Profile
+        fields = ['username', 'avatar_url', 'location', 'average_rating', 'review_count']
+    
+    def get_avatar_url(self, obj):
+        return obj.avatar.url if obj.avatar else None
 
 class ReviewSerializer(serializers.ModelSerializer):
     reviewer_username = serializers.CharField(source='reviewer.username', read_only=True)
@@ -139,12 +167,13 @@ class ServiceOfferSerializer(serializers.ModelSerializer):
     user = serializers.HiddenField(default=serializers.CurrentUserDefault())
     user_info = serializers.SerializerMethodField(read_only=True)
     image_url = serializers.SerializerMethodField(read_only=True)
+    image_variants = serializers.SerializerMethodField(read_only=True)
     accepted_count = serializers.SerializerMethodField(read_only=True)
     pending_interactions = serializers.SerializerMethodField(read_only=True)
     
     class Meta:
         model = ServiceOffer
-        fields = ['id','user','user_info','title','description','category','duration','capacity','accepted_count','pending_interactions','latitude','longitude','address','location','image','image_url','is_visible','is_online','tags','created_at']
+        fields = ['id','user','user_info','title','description','category','duration','capacity','accepted_count','pending_interactions','latitude','longitude','address','location','image','image_url','image_variants','is_visible','is_online','tags','created_at']
         extra_kwargs = {
             'latitude': {'required': False, 'allow_null': True},
             'longitude': {'required': False, 'allow_null': True},
@@ -162,6 +191,9 @@ class ServiceOfferSerializer(serializers.ModelSerializer):
             return obj.image.url
         return None
     
+    def get_image_variants(self, obj):
+        return _variants(self, obj)
+    
     def get_accepted_count(self, obj):
         """Accepted interaction sayısını hesapla"""
         from .models import InteractionRequest
@@ -191,10 +223,11 @@ class ServiceRequestSerializer(serializers.ModelSerializer):
     user = serializers.HiddenField(default=serializers.CurrentUserDefault())
     user_info = serializers.SerializerMethodField(read_only=True)
     image_url = serializers.SerializerMethodField(read_only=True)
+    image_variants = serializers.SerializerMethodField(read_only=True)
     
     class Meta:
         model = ServiceRequest
-        fields = ['id','user','user_info','title','description','category','duration','latitude','longitude','address','location','image','image_url','is_visible','is_online','tags','created_at']
+        fields = ['id','user','user_info','title','description','category','duration','latitude','longitude','address','location','image','image_url','image_variants','is_visible','is_online','tags','created_at']
         extra_kwargs = {
             'latitude': {'required': False, 'allow_null': True},
             'longitude': {'required': False, 'allow_null': True},
@@ -211,6 +244,9 @@ class ServiceRequestSerializer(serializers.ModelSerializer):
                 return request.build_absolute_uri(obj.image.url)
             return obj.image.url
         return None
+    
+    def get_image_variants(self, obj):
+        return _variants(self, obj)
 
 class TimeTransactionSerializer(serializers.ModelSerializer):
     class Meta:
@@ -225,15 +261,20 @@ class ForumCommentSerializer(serializers.ModelSerializer):
         fields = ['id', 'topic', 'author', 'author_username', 'content', 'created_at', 'updated_at']
         read_only_fields = ['topic', 'author', 'created_at', 'updated_at']
 
+class ForumTopicListSerializer(serializers.ModelSerializer):
+    """Forum index row: stored counters instead of nested comments"""
+    author_username = serializers.CharField(source='author.username', read_only=True)
+
+    class Meta:
+        model = ForumTopic
+        fields = ['id', 'author', 'author_username', 'title', 'content', 'category', 'created_at', 'updated_at', 'comment_count', 'last_activity_at']
+        read_only_fields = fields
+
 class ForumTopicSerializer(serializers.ModelSerializer):
     author_username = serializers.CharField(source='author.username', read_only=True)
-    comment_count = serializers.SerializerMethodField()
     comments = ForumCommentSerializer(many=True, read_only=True)
     
     class Meta:
         model = ForumTopic
-        fields = ['id', 'author', 'author_username', 'title', 'content', 'category', 'created_at', 'updated_at', 'comment_count', 'comments']
-        read_only_fields = ['author', 'created_at', 'updated_at']
-    
-    def get_comment_count(self, obj):
-        return obj.comments.count()
\ No newline at end of file
+        fields = ['id', 'author', 'author_username', 'title', 'content', 'category', 'created_at', 'updated_at', 'comment_count', 'last_activity_at', 'comments']
+        read_only_fields = ['author', 'created_at', 'updated_at', 'comment_count', 'last_activity_at']
\ No newline at end of file
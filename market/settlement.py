@@ -0,0 +1,66 @@
+"""
+Settlement of confirmed services: moves hours between profiles and writes the ledger.
+
+Balances are changed with single UPDATE ... SET balance = balance +/- n statements,
+so concurrent settlements never overwrite each other, and every settlement runs in
+one database transaction together with its TimeTransaction rows.
+"""
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+
+from .interaction_states import complete_interactions
+from .models import Profile, TimeTransaction
+
+User = get_user_model()
+
+
+def _ensure_profiles(user_ids):
+    """Create missing profiles for user_ids in one insert (normally the post_save signal already did)"""
+    existing = set(Profile.objects.filter(user_id__in=user_ids).values_list('user_id', flat=True))
+    missing = [Profile(user_id=user_id) for user_id in user_ids if user_id not in existing]
+    if missing:
+        Profile.objects.bulk_create(missing, ignore_conflicts=True)
+
+
+def settle_interaction(interaction, consumer, provider, duration):
+    """Settle a 1-1 interaction: consumer pays duration hours to provider.
+
+    The caller moves the interaction to completed first (interaction_states) in the
+    same transaction, so a double confirm can never pay twice.
+    """
+    with transaction.atomic():
+        _ensure_profiles([consumer.id, provider.id])
+        Profile.objects.filter(user=consumer).update(balance=F('balance') - duration)
+        Profile.objects.filter(user=provider).update(balance=F('balance') + duration)
+        TimeTransaction.objects.create(
+            offer=interaction.offer, request=interaction.service_request,
+            sender=consumer, receiver=provider, amount=duration,
+        )
+
+
+def settle_group_offer(offer, provider, participant_usernames, group_interactions, duration):
+    """Settle a group offer once every participant has confirmed.
+
+    Each participant pays duration hours and the provider receives duration hours once.
+    All participants are resolved in one query and the whole settlement takes a fixed
+    number of statements no matter how many people joined. Returns the settled users.
+    Raises TransitionConflict (rolling everything back) if another request already
+    completed any of the group interactions.
+    """
+    group_interactions = list(group_interactions)
+    with transaction.atomic():
+        complete_interactions(group_interactions, is_confirmed_by_receiver=True)
+
+        participants = list(User.objects.filter(username__in=set(participant_usernames)).only('id', 'username'))
+        participant_ids = [participant.id for participant in participants]
+        _ensure_profiles(participant_ids + [provider.id])
+
+        if participant_ids:
+            Profile.objects.filter(user_id__in=participant_ids).update(balance=F('balance') - duration)
+        Profile.objects.filter(user=provider).update(balance=F('balance') + duration)
+
+        ledger = [TimeTransaction(offer=offer, sender=participant, amount=duration) for participant in participants]
+        ledger.append(TimeTransaction(offer=offer, receiver=provider, amount=duration))
+        TimeTransaction.objects.bulk_create(ledger)
+    return participants
@@ -0,0 +1,100 @@
+"""
+In-memory snapshots of database tables, rebuilt off the request path.
+
+A snapshot (the tag autocomplete index, the search expansion graph) is loaded
+when a server process starts (MarketConfig.warm_up, called from core.wsgi and
+core.asgi) and reloaded every REFRESH_INTERVAL on a background thread. Readers
+keep using the previous state until the new one is swapped in, and only one
+rebuild per snapshot runs at a time, so an expired snapshot never makes a
+request wait or sends several requests to reload the same table.
+
+INDEX_REFRESH_WORKERS sets the background threads; 0 rebuilds inline in the
+thread that noticed the snapshot was stale.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+REFRESH_INTERVAL = 600
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool(workers):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='snapshot-refresh')
+        return _pool
+
+
+class Snapshot:
+    """Base class: subclasses load() the new state from the database and install() it (called under _lock)"""
+    name = 'snapshot'
+
+    def __init__(self):
+        self.built_at = None
+        self._lock = threading.RLock()
+        self._rebuilding = threading.Lock()
+        self.install(self.empty())
+
+    def empty(self):
+        raise NotImplementedError
+
+    def load(self):
+        raise NotImplementedError
+
+    def install(self, state):
+        raise NotImplementedError
+
+    def build(self):
+        """Load and swap in a new state in the calling thread"""
+        state = self.load()
+        with self._lock:
+            self.install(state)
+            self.built_at = time.monotonic()
+
+    def _rebuild(self):
+        try:
+            self.build()
+        except Exception as e:
+            logger.error("Rebuilding the %s failed: %s", self.name, e)
+        finally:
+            self._rebuilding.release()
+
+    def _rebuild_in_thread(self):
+        try:
+            self._rebuild()
+        finally:
+            close_old_connections()
+
+    def refresh(self):
+        """Start a rebuild unless one is already running; in the background unless INDEX_REFRESH_WORKERS is 0"""
+        if not self._rebuilding.acquire(blocking=False):
+            return
+        workers = getattr(settings, 'INDEX_REFRESH_WORKERS', 1)
+        if not workers:
+            self._rebuild()
+            return
+        _get_pool(workers).submit(self._rebuild_in_thread)
+
+    def is_stale(self):
+        with self._lock:
+            return self.built_at is None or time.monotonic() - self.built_at > REFRESH_INTERVAL
+
+    def ensure_fresh(self):
+        """Called by readers: schedules a rebuild when the snapshot expired, never waits for it"""
+        if self.is_stale():
+            self.refresh()
+
+    def clear(self):
+        with self._lock:
+            self.install(self.empty())
+            self.built_at = None
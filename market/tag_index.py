@@ -0,0 +1,65 @@
+"""
+In-memory tag autocomplete.
+
+Each process keeps the names of tags in use in a sorted list with their usage
+counts. A prefix is answered with two bisects for the matching slice and a
+top-N by usage, so a keystroke never touches the database. The index is loaded
+from Tag with one query when the server starts and reloaded in the background
+every REFRESH_INTERVAL (market.snapshots), so processes pick up changes made by
+other workers; in between it is kept current from market.tagging as listings
+are saved or deleted (after commit).
+"""
+import heapq
+from bisect import bisect_left, insort
+
+from .models import Tag
+from .snapshots import Snapshot
+
+DEFAULT_LIMIT = 10
+
+
+class TagIndex(Snapshot):
+    name = 'tag index'
+
+    def empty(self):
+        return {}, []
+
+    def load(self):
+        counts = dict(Tag.objects.filter(usage_count__gt=0).values_list('name', 'usage_count'))
+        return counts, sorted(counts)
+
+    def install(self, state):
+        self.counts, self.names = state
+
+    def adjust(self, name, delta):
+        """Change the usage of one tag, adding or dropping it from the index"""
+        with self._lock:
+            if self.built_at is None:
+                return  # Not loaded yet; the first build reads the table
+            count = self.counts.get(name, 0) + delta
+            if count > 0:
+                if name not in self.counts:
+                    insort(self.names, name)
+                self.counts[name] = count
+            elif name in self.counts:
+                del self.counts[name]
+                del self.names[bisect_left(self.names, name)]
+
+    def apply(self, added, removed):
+        with self._lock:
+            for name in added:
+                self.adjust(name, 1)
+            for name in removed:
+                self.adjust(name, -1)
+
+    def complete(self, prefix, limit=DEFAULT_LIMIT):
+        """[(name, usage)] of tags starting with prefix, most used first"""
+        self.ensure_fresh()
+        with self._lock:
+            start = bisect_left(self.names, prefix)
+            end = bisect_left(self.names, prefix + '\U0010ffff', start)
+            matches = ((name, self.counts[name]) for name in self.names[start:end])
+            return heapq.nsmallest(limit, matches, key=lambda item: (-item[1], item[0]))
+
+
+index = TagIndex()
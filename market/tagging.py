@@ -0,0 +1,139 @@
+"""
+Normalized listing tags.
+
+ServiceOffer.tags / ServiceRequest.tags stay the JSON the API reads and writes;
+every save (or sync_listings_tags after a bulk_update) mirrors them into Tag
+rows and ListingTag links, so tag filters are index lookups on (tag, listing)
+instead of decoding every row's JSON.
+Tag.usage_count (listings carrying the tag) is adjusted with F() updates as links
+are added and removed, and the in-memory autocomplete index (market.tag_index)
+follows once the change commits.
+
+    ?tag=guitar               listings tagged "guitar"
+    ?tags_any=guitar,piano    tagged with at least one of them
+    ?tags_all=guitar,lessons  tagged with all of them
+"""
+import re
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import ListingTag, ServiceOffer, ServiceRequest, Tag
+from .tag_index import index as tag_index
+
+MAX_FILTER_TAGS = 10
+# Listing model -> its ListingTag foreign key
+LINK_FIELDS = {ServiceOffer: 'offer', ServiceRequest: 'service_request'}
+
+
+def normalize_tag(tag):
+    return re.sub(r'\s+', ' ', tag.strip().lower())[:100]
+
+
+def tag_names(tags):
+    """Normalized, de-duplicated names of a listing's tags JSON"""
+    return {normalize_tag(tag) for tag in tags or () if isinstance(tag, str) and tag.strip()}
+
+
+def _adjust_usage(deltas):
+    """Apply {tag_id: delta} to usage counts, one UPDATE per distinct delta"""
+    by_delta = defaultdict(list)
+    for tag_id, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(tag_id)
+    for delta, tag_ids in by_delta.items():
+        Tag.objects.filter(id__in=tag_ids).update(usage_count=F('usage_count') + delta)
+
+
+def sync_listings_tags(listings):
+    """Bring the ListingTag links of listings (all of one model) in line with their tags JSON"""
+    if not listings:
+        return
+    field = LINK_FIELDS[type(listings[0])]
+    with transaction.atomic():
+        current = defaultdict(dict)
+        links = ListingTag.objects.filter(**{f'{field}_id__in': [listing.id for listing in listings]})
+        for link_id, listing_id, tag_id, name in links.values_list('id', f'{field}_id', 'tag_id', 'tag__name'):
+            current[listing_id][name] = (link_id, tag_id)
+
+        added = []    # (listing, name)
+        removed = []  # (link id, tag id, name)
+        for listing in listings:
+            have = current[listing.id]
+            wanted = tag_names(listing.tags)
+            added += [(listing, name) for name in wanted - have.keys()]
+            removed += [(*have[name], name) for name in have.keys() - wanted]
+
+        usage = Counter()
+        if removed:
+            ListingTag.objects.filter(id__in=[link_id for link_id, _, _ in removed]).delete()
+            usage.subtract(tag_id for _, tag_id, _ in removed)
+        if added:
+            names = {name for _, name in added}
+            Tag.objects.bulk_create([Tag(name=name) for name in names], ignore_conflicts=True)
+            ids = dict(Tag.objects.filter(name__in=names).values_list('name', 'id'))
+            ListingTag.objects.bulk_create([ListingTag(tag_id=ids[name], **{field: listing}) for listing, name in added])
+            usage.update(ids[name] for _, name in added)
+        _adjust_usage(usage)
+
+        added_names = [name for _, name in added]
+        removed_names = [name for _, _, name in removed]
+        if added_names or removed_names:
+            transaction.on_commit(lambda: tag_index.apply(added_names, removed_names))
+
+
+def sync_listing_tags(listing):
+    sync_listings_tags([listing])
+
+
+@receiver(post_save, sender=ServiceOffer)
+@receiver(post_save, sender=ServiceRequest)
+def listing_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'tags' not in update_fields:
+        return
+    sync_listing_tags(instance)
+
+
+@receiver(pre_delete, sender=ServiceOffer)
+@receiver(pre_delete, sender=ServiceRequest)
+def listing_deleted(sender, instance, **kwargs):
+    # The links themselves go with the listing (CASCADE)
+    links = list(ListingTag.objects.filter(**{LINK_FIELDS[sender]: instance}).values_list('tag_id', 'tag__name'))
+    _adjust_usage(Counter({tag_id: -1 for tag_id, _ in links}))
+    names = [name for _, name in links]
+    if names:
+        transaction.on_commit(lambda: tag_index.apply((), names))
+
+
+def _param_tags(params, name):
+    values = params.get(name, '')
+    return list(tag_names(values.split(',')))[:MAX_FILTER_TAGS]
+
+
+def filter_by_tags(queryset, params):
+    """Apply ?tag= / ?tags_any= / ?tags_all= to a ServiceOffer or ServiceRequest queryset"""
+    field = LINK_FIELDS[queryset.model]
+    links = ListingTag.objects.filter(**{f'{field}__isnull': False})
+
+    tag = params.get('tag', '').strip()
+    if tag:
+        queryset = queryset.filter(id__in=links.filter(tag__name=normalize_tag(tag)).values(field))
+
+    any_of = _param_tags(params, 'tags_any')
+    if any_of:
+        queryset = queryset.filter(id__in=links.filter(tag__name__in=any_of).values(field))
+
+    all_of = _param_tags(params, 'tags_all')
+    if all_of:
+        having_all = (
+            links.filter(tag__name__in=all_of)
+            .values(field)
+            .annotate(matched=Count('tag_id'))
+            .filter(matched=len(all_of))
+            .values(field)
+        )
+        queryset = queryset.filter(id__in=having_all)
+    return queryset
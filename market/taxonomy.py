@@ -0,0 +1,178 @@
+"""
+Local copy of the slice of Wikidata behind tag suggestions.
+
+A subset of entity labels and their P279 (subclass of), P366 (has use), P3095
+(practiced by) and P1056 (product or material produced) statements is bulk-loaded
+into TaxonomyEntity / TaxonomyRelation by the load_wikidata_taxonomy command.
+After a load every entity's neighbour labels are precomputed with the same
+semantics as the live SPARQL query (superclasses, subclasses, things used for it,
+practitioners, products), so a suggestion is one indexed prefix LIKE on the
+lowercased labels plus the stored lists - no call to query.wikidata.org.
+
+Input formats (one record per line, optionally gzipped):
+
+    TSV    Q6607<TAB>guitar                 entity label
+           Q6607<TAB>P279<TAB>Q1798603      relation
+    JSON   {"id": "Q6607", "label": "guitar", "claims": {"P279": ["Q1798603"]}}
+           or entity lines of a Wikidata JSON dump ("labels"/"claims" statements)
+"""
+import gzip
+import json
+from collections import defaultdict
+
+from django.db import transaction
+
+from .models import TaxonomyEntity, TaxonomyRelation
+from .wikidata_cache import normalize_term
+
+RELATION_PROPERTIES = ('P279', 'P366', 'P3095', 'P1056')
+# entity --P--> item makes item a neighbour of entity ...
+FORWARD_PROPERTIES = ('P279', 'P3095', 'P1056')
+# ... and item --P--> entity does too
+REVERSE_PROPERTIES = ('P279', 'P366')
+MAX_NEIGHBOURS = 20
+MAX_CANDIDATES = 3
+BATCH_SIZE = 2000
+
+
+def is_tag_label(label):
+    """Whether a label is usable as a tag (not a bare id, lexeme or number)"""
+    if label.startswith('Q') and label[1:].isdigit():
+        return False
+    if label.startswith('L') and '-' in label:
+        return False
+    return not label.isdigit() and len(label) > 2
+
+
+def open_dump(path):
+    if str(path).endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+
+def parse_tsv(lines):
+    """('label', qid, label) and ('relation', source, property, target) records"""
+    for line in lines:
+        line = line.rstrip('\n')
+        if not line or line.startswith('#'):
+            continue
+        fields = line.split('\t')
+        if len(fields) == 2:
+            yield ('label', fields[0], fields[1])
+        elif len(fields) == 3 and fields[1] in RELATION_PROPERTIES:
+            yield ('relation', *fields)
+
+
+def _claim_target(claim):
+    if isinstance(claim, str):
+        return claim
+    value = claim.get('mainsnak', {}).get('datavalue', {}).get('value')
+    return value.get('id') if isinstance(value, dict) else None
+
+
+def parse_json(lines, language='en'):
+    """Records of JSON-lines entities, simplified or in Wikidata dump shape"""
+    for line in lines:
+        line = line.strip().rstrip(',')
+        if line in ('', '[', ']'):
+            continue
+        entity = json.loads(line)
+        qid = entity['id']
+        label = entity.get('label') or entity.get('labels', {}).get(language, {}).get('value')
+        if label:
+            yield ('label', qid, label)
+        claims = entity.get('claims', {})
+        for prop in RELATION_PROPERTIES:
+            for claim in claims.get(prop, ()):
+                target = _claim_target(claim)
+                if target:
+                    yield ('relation', qid, prop, target)
+
+
+def load_taxonomy(records, batch_size=BATCH_SIZE, replace=False):
+    """Insert parsed records in batches; returns (labels, relations) written"""
+    # qid -> entity: a dump may label the same entity twice, and one upsert
+    # statement cannot touch the same row twice, so the last label wins
+    entities, relations = {}, []
+    counts = [0, 0]
+
+    def flush():
+        if entities:
+            TaxonomyEntity.objects.bulk_create(
+                list(entities.values()), batch_size=batch_size,
+                update_conflicts=True, unique_fields=['qid'], update_fields=['label', 'label_lower'],
+            )
+            counts[0] += len(entities)
+            entities.clear()
+        if relations:
+            TaxonomyRelation.objects.bulk_create(relations, batch_size=batch_size, ignore_conflicts=True)
+            counts[1] += len(relations)
+            relations.clear()
+
+    with transaction.atomic():
+        if replace:
+            TaxonomyRelation.objects.all().delete()
+            TaxonomyEntity.objects.all().delete()
+        for record in records:
+            if record[0] == 'label':
+                _, qid, label = record
+                label = label[:255]
+                entities[qid] = TaxonomyEntity(qid=qid, label=label, label_lower=normalize_term(label)[:255])
+            else:
+                _, source, prop, target = record
+                relations.append(TaxonomyRelation(source=source, property=prop, target=target))
+            if len(entities) + len(relations) >= batch_size:
+                flush()
+        flush()
+    return tuple(counts)
+
+
+def rebuild_neighbours(batch_size=BATCH_SIZE):
+    """Precompute every entity's neighbour labels from the relation table; returns entities updated"""
+    labels = dict(TaxonomyEntity.objects.values_list('qid', 'label').iterator(chunk_size=batch_size))
+    linked = defaultdict(list)
+    relations = TaxonomyRelation.objects.values_list('source', 'property', 'target').order_by('id')
+    for source, prop, target in relations.iterator(chunk_size=batch_size):
+        if prop in FORWARD_PROPERTIES:
+            linked[source].append(target)
+        if prop in REVERSE_PROPERTIES:
+            linked[target].append(source)
+
+    updated = []
+    for qid in labels:
+        neighbours = []
+        seen = set()
+        for other in linked.get(qid, ()):
+            label = labels.get(other)
+            if label and is_tag_label(label) and label.lower() not in seen:
+                seen.add(label.lower())
+                neighbours.append(label)
+                if len(neighbours) == MAX_NEIGHBOURS:
+                    break
+        updated.append(TaxonomyEntity(qid=qid, neighbours=neighbours))
+    with transaction.atomic():
+        TaxonomyEntity.objects.bulk_update(updated, ['neighbours'], batch_size=batch_size)
+    return len(updated)
+
+
+def local_suggestions(term, limit=20):
+    """Neighbour labels of the entities whose label starts with term (exact match first), or
+    None when no local entity matches"""
+    prefix = normalize_term(term)
+    matches = list(
+        TaxonomyEntity.objects
+        .filter(label_lower__startswith=prefix)
+        .order_by('label_lower')
+        .values_list('neighbours', flat=True)[:MAX_CANDIDATES]
+    )
+    if not matches:
+        return None
+
+    suggestions = []
+    seen = set()
+    for neighbours in matches:
+        for label in neighbours:
+            if label.lower() not in seen:
+                seen.add(label.lower())
+                suggestions.append(label)
+    return suggestions[:limit]
@@ -1,3 +1,1530 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+import requests
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.db.models import QuerySet
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from PIL import Image
+from rest_framework.test import APIClient
+
+from core.storage import ContentAddressedStorage
+
+from . import enrichment, images, recommendations, search, snapshots, wikidata, wikidata_cache, wikidata_client
+from .tag_index import index as tag_index
+from .blobs import collect_garbage
+from .images import derivative_name, has_derivatives
+from .interaction_states import TRANSITIONS, OfferFull, TransitionConflict, apply_transition
+from .ledger import UnreconcilableBalance, repair_balance, unreconcilable_members
+from .models import (
+    BackfillCheckpoint, Block, ChatMessage, ForumComment, ForumTopic, InteractionRequest, ListingFeature, MediaBlob, Profile, ReputationMetrics, Review, ServiceOffer, ServiceRequest,
+    Tag, TaxonomyEntity, TaxonomyRelation, TimeTransaction, WikidataCacheEntry, forum_hot_score,
+)
+from .ratings import RATING_FIELDS
+from .reputation import refresh_metrics
+from .serializers import ServiceOfferSerializer
+from .settlement import settle_group_offer
+from .snapshots import Snapshot
+
+User = get_user_model()
+
+
+class GroupSettlementTests(TestCase):
+    def setUp(self):
+        self.provider = User.objects.create_user(username='host', email='host@example.com')
+        self.offer = ServiceOffer.objects.create(
+            user=self.provider, title='Workshop', description='-', category='education', duration=2, capacity=50,
+        )
+        self.participants = [
+            User.objects.create_user(username=f'member{n}', email=f'member{n}@example.com')
+            for n in range(50)
+        ]
+        self.interactions = [
+            InteractionRequest.objects.create(sender=member, receiver=self.provider, offer=self.offer, status='accepted')
+            for member in self.participants
+        ]
+
+    def test_fifty_person_workshop_settles_in_constant_statements(self):
+        usernames = [member.username for member in self.participants]
+        with CaptureQueriesContext(connection) as ctx:
+            settle_group_offer(self.offer, self.provider, usernames, self.interactions, self.offer.duration)
+        self.assertLessEqual(len(ctx.captured_queries), 10)
+
+        self.assertEqual(Profile.objects.get(user=self.provider).balance, 3 + 2)
+        self.assertEqual(set(Profile.objects.filter(user__in=self.participants).values_list('balance', flat=True)), {1})
+        self.assertEqual(TimeTransaction.objects.filter(offer=self.offer).count(), 51)
+        self.assertFalse(InteractionRequest.objects.filter(offer=self.offer).exclude(status='completed').exists())
+
+
+
+class InteractionTransitionTests(TestCase):
+    """A transition applied to a stale copy must be rejected, never silently overwrite"""
+
+    # action -> (status to start from, extra column values)
+    CASES = {
+        'accept': ('pending', {}),
+        'decline': ('accepted', {}),
+        'schedule': ('accepted', {'appointment_date': '2030-01-01T10:00:00Z'}),
+        'reject_date': ('date_proposed', {'appointment_date': None}),
+        'accept_date': ('date_proposed', {}),
+        'complete': ('scheduled', {'is_completed_by_provider': True}),
+        'confirm': ('scheduled', {'is_confirmed_by_receiver': True}),
+        'cancel': ('accepted', {}),
+    }
+
+    def setUp(self):
+        self.consumer = User.objects.create_user(username='consumer', email='consumer@example.com')
+        self.provider = User.objects.create_user(username='provider', email='provider@example.com')
+        self.offer = ServiceOffer.objects.create(user=self.provider, title='Lesson', description='-', category='music')
+
+    def test_every_transition_is_covered(self):
+        self.assertEqual(set(self.CASES), set(TRANSITIONS))
+
+    def test_stale_copy_conflicts_for_every_transition(self):
+        for action, (start, changes) in self.CASES.items():
+            with self.subTest(action=action):
+                interaction = InteractionRequest.objects.create(
+                    sender=self.consumer, receiver=self.provider, offer=self.offer, status=start,
+                )
+                first = InteractionRequest.objects.get(pk=interaction.pk)
+                second = InteractionRequest.objects.get(pk=interaction.pk)
+
+                apply_transition(first, action, **dict(changes))
+                with self.assertRaises(TransitionConflict):
+                    apply_transition(second, action, **dict(changes))
+
+                interaction.refresh_from_db()
+                self.assertEqual(interaction.version, 1)
+                self.assertEqual(second.version, 1)
+
+    def test_seat_is_released_on_decline_and_cancel(self):
+        self.offer.capacity = 1
+        self.offer.save()
+        first = InteractionRequest.objects.create(sender=self.consumer, receiver=self.provider, offer=self.offer)
+        other = User.objects.create_user(username='other', email='other@example.com')
+        second = InteractionRequest.objects.create(sender=other, receiver=self.provider, offer=self.offer)
+
+        apply_transition(first, 'accept')
+        with self.assertRaises(OfferFull):
+            apply_transition(second, 'accept')
+        second.refresh_from_db()
+        self.assertEqual(second.status, 'pending')
+
+        apply_transition(first, 'decline')
+        apply_transition(second, 'accept')
+        apply_transition(second, 'cancel')
+        self.offer.refresh_from_db()
+        self.assertEqual(self.offer.reserved_seats, 0)
+
+    def test_complete_and_confirm_while_a_date_is_pending(self):
+        for start in ('date_proposed', 'negotiating'):
+            with self.subTest(start=start):
+                interaction = InteractionRequest.objects.create(
+                    sender=self.consumer, receiver=self.provider, offer=self.offer, status=start,
+                )
+                client = APIClient()
+                client.force_authenticate(self.provider)
+                self.assertEqual(client.post(f'/api/interaction/{interaction.pk}/complete/').status_code, 200)
+                client.force_authenticate(self.consumer)
+                self.assertEqual(client.post(f'/api/interaction/{interaction.pk}/confirm/').status_code, 200)
+
+                interaction.refresh_from_db()
+                self.assertEqual(interaction.status, 'completed')
+                self.assertTrue(interaction.is_completed_by_provider)
+                self.assertTrue(interaction.is_confirmed_by_receiver)
+
+    def test_api_returns_409_when_interaction_changed_under_it(self):
+        interaction = InteractionRequest.objects.create(
+            sender=self.consumer, receiver=self.provider, offer=self.offer, status='pending',
+        )
+        stale = InteractionRequest.objects.get(pk=interaction.pk)
+        InteractionRequest.objects.filter(pk=interaction.pk).update(status='declined', version=1)
+
+        client = APIClient()
+        client.force_authenticate(self.provider)
+        with mock.patch('market.views.get_object_or_404', return_value=stale):
+            response = client.post(f'/api/interaction/{interaction.pk}/accept/')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['status'], 'declined')
+
+
+class InteractionConcurrencyTests(TransactionTestCase):
+    """Fire the same or competing actions from parallel requests and check exactly one wins"""
+
+    WORKERS = 6
+
+    def setUp(self):
+        self.consumer = User.objects.create_user(username='consumer', email='consumer@example.com')
+        self.provider = User.objects.create_user(username='provider', email='provider@example.com')
+        self.offer = ServiceOffer.objects.create(
+            user=self.provider, title='Lesson', description='-', category='music', duration=2,
+            tags=['music'],  # Tagged, so no background enrichment runs alongside the races
+        )
+
+    def _interaction(self, **fields):
+        return InteractionRequest.objects.create(sender=self.consumer, receiver=self.provider, offer=self.offer, **fields)
+
+    def _race(self, interaction, calls):
+        """Run (user, action, data) calls against the action endpoint at the same moment; return status codes"""
+        barrier = threading.Barrier(len(calls))
+
+        def call(args):
+            user, action, data = args
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                barrier.wait()
+                return client.post(f'/api/interaction/{interaction.pk}/{action}/', data, format='json').status_code
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(len(calls)) as pool:
+            codes = list(pool.map(call, calls))
+        self.assertTrue(all(code in (200, 400, 409) for code in codes), codes)
+        return codes
+
+    def test_parallel_accepts(self):
+        interaction = self._interaction(status='pending')
+        codes = self._race(interaction, [(self.provider, 'accept', {})] * self.WORKERS)
+        self.assertEqual(codes.count(200), 1)
+        interaction.refresh_from_db()
+        self.assertEqual((interaction.status, interaction.version), ('accepted', 1))
+
+    def test_accept_races_decline(self):
+        interaction = self._interaction(status='pending')
+        calls = [(self.provider, 'accept', {}), (self.provider, 'decline', {})] * (self.WORKERS // 2)
+        self._race(interaction, calls)
+        interaction.refresh_from_db()
+        self.assertIn(interaction.status, ('accepted', 'declined'))
+        # accept may still be followed by a decline, but never the other way round
+        self.assertLessEqual(interaction.version, 2)
+
+    def test_parallel_schedule_proposals(self):
+        interaction = self._interaction(status='accepted')
+        calls = [(self.consumer, 'schedule', {'date': '2030-01-01T10:00:00Z'}),
+                 (self.provider, 'schedule', {'date': '2030-02-01T10:00:00Z'})] * (self.WORKERS // 2)
+        codes = self._race(interaction, calls)
+        interaction.refresh_from_db()
+        self.assertEqual(interaction.status, 'date_proposed')
+        self.assertEqual(interaction.version, codes.count(200))
+
+    def test_accept_date_races_reject_date(self):
+        interaction = self._interaction(status='date_proposed', date_proposed_by=self.consumer,
+                                        appointment_date='2030-01-01T10:00:00Z')
+        calls = [(self.provider, 'accept_date', {}), (self.provider, 'reject_date', {})] * (self.WORKERS // 2)
+        codes = self._race(interaction, calls)
+        self.assertEqual(codes.count(200), 1)
+        interaction.refresh_from_db()
+        self.assertIn(interaction.status, ('scheduled', 'negotiating'))
+        self.assertEqual(interaction.version, 1)
+
+    def test_parallel_completes(self):
+        interaction = self._interaction(status='scheduled')
+        codes = self._race(interaction, [(self.provider, 'complete', {})] * self.WORKERS)
+        interaction.refresh_from_db()
+        self.assertTrue(interaction.is_completed_by_provider)
+        self.assertEqual(interaction.status, 'scheduled')
+        self.assertEqual(interaction.version, codes.count(200))
+
+    def test_parallel_confirms_pay_once(self):
+        interaction = self._interaction(status='scheduled', is_completed_by_provider=True)
+        codes = self._race(interaction, [(self.consumer, 'confirm', {})] * self.WORKERS)
+        self.assertEqual(codes.count(200), 1)
+        self.assertEqual(TimeTransaction.objects.count(), 1)
+        self.assertEqual(Profile.objects.get(user=self.consumer).balance, 3 - 2)
+        self.assertEqual(Profile.objects.get(user=self.provider).balance, 3 + 2)
+
+    def test_group_confirms_settle_once(self):
+        self.offer.capacity = 4
+        self.offer.save()
+        members = [User.objects.create_user(username=f'member{n}', email=f'member{n}@example.com') for n in range(4)]
+        interactions = [
+            InteractionRequest.objects.create(sender=member, receiver=self.provider, offer=self.offer,
+                                              status='accepted', is_completed_by_provider=True)
+            for member in members
+        ]
+        ChatMessage.objects.create(interaction=interactions[0], sender=self.provider, content=json.dumps({
+            'type': 'completion_card', 'offer_id': self.offer.id,
+            'participants': [member.username for member in members], 'confirmed': [],
+        }))
+
+        barrier = threading.Barrier(len(members))
+
+        def confirm(pair):
+            member, interaction = pair
+            client = APIClient()
+            client.force_authenticate(member)
+            try:
+                barrier.wait()
+                return client.post(f'/api/interaction/{interaction.pk}/confirm/').status_code
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(len(members)) as pool:
+            codes = list(pool.map(confirm, zip(members, interactions)))
+        self.assertTrue(all(code in (200, 400, 409) for code in codes), codes)
+
+        # Rejected confirmations are retried the way a client would after a 409
+        for member, interaction, code in zip(members, interactions, codes):
+            if code != 200:
+                client = APIClient()
+                client.force_authenticate(member)
+                client.post(f'/api/interaction/{interaction.pk}/confirm/')
+
+        self.assertEqual(TimeTransaction.objects.filter(receiver=self.provider).count(), 1)
+        self.assertEqual(TimeTransaction.objects.filter(sender__in=members).count(), len(members))
+        self.assertEqual(Profile.objects.get(user=self.provider).balance, 3 + 2)
+        self.assertFalse(InteractionRequest.objects.filter(offer=self.offer).exclude(status='completed').exists())
+
+
+class SeatReservationTests(TransactionTestCase):
+    def test_parallel_accepts_never_overbook(self):
+        provider = User.objects.create_user(username='host', email='host@example.com')
+        offer = ServiceOffer.objects.create(
+            user=provider, title='Workshop', description='-', category='education', capacity=3, tags=['education'],
+        )
+        interactions = [
+            InteractionRequest.objects.create(
+                sender=User.objects.create_user(username=f'member{n}', email=f'member{n}@example.com'),
+                receiver=provider, offer=offer,
+            )
+            for n in range(10)
+        ]
+        barrier = threading.Barrier(len(interactions))
+
+        def accept(interaction):
+            client = APIClient()
+            client.force_authenticate(provider)
+            try:
+                barrier.wait()
+                return client.post(f'/api/interaction/{interaction.pk}/accept/').status_code
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(len(interactions)) as pool:
+            codes = list(pool.map(accept, interactions))
+
+        self.assertEqual(codes.count(200), 3)
+        self.assertEqual(codes.count(400), 7)
+        offer.refresh_from_db()
+        self.assertEqual(offer.reserved_seats, 3)
+        self.assertEqual(InteractionRequest.objects.filter(offer=offer, status='accepted').count(), 3)
+
+
+class TransactionStatementTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com')
+        self.carol = User.objects.create_user(username='carol', email='carol@example.com')
+        TimeTransaction.objects.create(sender=self.alice, receiver=self.bob, amount=2)
+        TimeTransaction.objects.create(sender=self.bob, receiver=self.alice, amount=1)
+        TimeTransaction.objects.create(sender=self.carol, receiver=self.bob, amount=3)
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def test_list_is_scoped_to_requesting_user(self):
+        response = self.client.get('/api/transactions/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIn('next', response.data)
+
+    def test_ndjson_statement_has_running_balance(self):
+        response = self.client.get('/api/transactions/statement/', {'output': 'ndjson'})
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([(row['direction'], row['balance']) for row in rows], [('debit', 1), ('credit', 2)])
+
+    def test_csv_statement(self):
+        response = self.client.get('/api/transactions/statement/')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[-1], 'balance')
+        self.assertEqual(len(lines), 3)
+
+
+class BalanceReconciliationTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com')
+        self.carol = User.objects.create_user(username='carol', email='carol@example.com')
+        for sender, receiver, amount in ((self.alice, self.bob, 2), (self.bob, self.alice, 1), (self.carol, self.bob, 3)):
+            TimeTransaction.objects.create(sender=sender, receiver=receiver, amount=amount)
+        for user, balance in ((self.alice, 2), (self.bob, 7), (self.carol, 0)):
+            Profile.objects.filter(user=user).update(balance=balance)
+
+    def reconcile(self, *args):
+        out = io.StringIO()
+        # chunk_size=1 makes every ledger row its own aggregation window
+        call_command('reconcile_balances', '--chunk-size=1', *args, stdout=out)
+        return out.getvalue()
+
+    def test_drift_is_reported_then_repaired(self):
+        self.assertIn('All checked balances match the ledger', self.reconcile())
+
+        Profile.objects.filter(user=self.bob).update(balance=10)
+        output = self.reconcile()
+        self.assertIn(f'user #{self.bob.id}: balance=10 ledger=7 drift=+3', output)
+        self.assertIn('1 balance(s) drift from the ledger', output)
+        self.assertEqual(Profile.objects.get(user=self.bob).balance, 10)
+
+        self.assertIn('Repaired 1 of 1 drifting balance(s)', self.reconcile('--repair'))
+        self.assertEqual(Profile.objects.get(user=self.bob).balance, 7)
+        self.assertIn('All checked balances match the ledger', self.reconcile())
+
+
+    def test_legacy_group_settlement_is_reported_but_not_repaired(self):
+        # Before 0003 a group settlement wrote one unattributed debit row per participant and no provider credit
+        provider = User.objects.create_user(username='teacher', email='teacher@example.com')
+        offer = ServiceOffer.objects.create(user=provider, title='Workshop', description='-', category='music', capacity=2, tags=['music'])
+        for participant in (self.alice, self.carol):
+            InteractionRequest.objects.create(sender=participant, receiver=provider, offer=offer, status='completed')
+            TimeTransaction.objects.create(offer=offer, amount=1)
+        Profile.objects.filter(user=self.alice).update(balance=1)
+        Profile.objects.filter(user=self.carol).update(balance=-1)
+        Profile.objects.filter(user=provider).update(balance=5)
+
+        self.assertEqual(unreconcilable_members(), {provider.id, self.alice.id, self.carol.id})
+        output = self.reconcile('--repair')
+        self.assertIn(f'user #{provider.id}: balance=5 ledger=3 (legacy, not repaired', output)
+        self.assertIn('All checked balances match the ledger', output)
+        self.assertEqual(Profile.objects.get(user=provider).balance, 5)
+        with self.assertRaises(UnreconcilableBalance):
+            repair_balance(provider.id)
+
+        self.assertIn('Repaired 1 of 1', self.reconcile('--repair', f'--force-user={provider.id}'))
+        self.assertEqual(Profile.objects.get(user=provider).balance, 3)
+        self.assertEqual(Profile.objects.get(user=self.alice).balance, 1)
+
+
+class ProfileRatingTotalsTests(TestCase):
+    def setUp(self):
+        self.provider = User.objects.create_user(username='provider', email='provider@example.com')
+        self.consumer = User.objects.create_user(username='consumer', email='consumer@example.com')
+        self.offer = ServiceOffer.objects.create(user=self.provider, title='Lesson', description='-', category='music')
+        self.request = ServiceRequest.objects.create(user=self.provider, title='Need help', description='-', category='home')
+
+    def _totals(self, user):
+        profile = Profile.objects.get(user=user)
+        return [getattr(profile, field) for field in RATING_FIELDS]
+
+    def test_totals_follow_review_create_update_delete(self):
+        # Offer owner reviewed by the consumer -> provider rating
+        review = Review.objects.create(reviewer=self.consumer, target_user=self.provider, offer=self.offer, rating=4)
+        # Request owner reviewed by the helper -> consumer rating
+        Review.objects.create(reviewer=self.consumer, target_user=self.provider, service_request=self.request, rating=2)
+        self.assertEqual(self._totals(self.provider), [4, 1, 2, 1])
+
+        review.rating = 5
+        review.save()
+        self.assertEqual(self._totals(self.provider), [5, 1, 2, 1])
+
+        self.offer.delete()
+        self.assertEqual(self._totals(self.provider), [0, 0, 2, 1])
+
+        profile = Profile.objects.get(user=self.provider)
+        with self.assertNumQueries(0):
+            self.assertEqual(profile.average_rating, 2.0)
+            self.assertEqual(profile.review_count, 1)
+
+    def test_backfill_matches_incremental_totals(self):
+        Review.objects.create(reviewer=self.consumer, target_user=self.provider, offer=self.offer, rating=3)
+        Review.objects.create(reviewer=self.provider, target_user=self.consumer, offer=self.offer, rating=5)
+        Review.objects.create(reviewer=self.consumer, target_user=self.provider, service_request=self.request, rating=1)
+        expected = {user.pk: self._totals(user) for user in (self.provider, self.consumer)}
+
+        Profile.objects.update(**{field: 0 for field in RATING_FIELDS})
+        call_command('backfill_ratings', stdout=io.StringIO())
+        self.assertEqual({user.pk: self._totals(user) for user in (self.provider, self.consumer)}, expected)
+
+
+class ProfileSectionCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com')
+        self.member = User.objects.create_user(username='member', email='member@example.com')
+        self.offer = ServiceOffer.objects.create(user=self.owner, title='Lesson', description='-', category='music')
+
+    def _versions(self):
+        profile = Profile.objects.get(user=self.owner)
+        return profile.listings_version, profile.completed_version, profile.reviews_version
+
+    def _render(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/profile/owner/')
+        self.assertEqual(response.status_code, 200)
+        return response, len(ctx.captured_queries)
+
+    def test_second_render_reads_sections_from_cache(self):
+        _, cold = self._render()
+        response, warm = self._render()
+        self.assertLess(warm, cold)
+        self.assertEqual([listing['title'] for listing in response.context['active_listings']], ['Lesson'])
+
+    def test_changes_only_bump_their_sections(self):
+        listings, completed, reviews = self._versions()
+
+        Review.objects.create(reviewer=self.member, target_user=self.owner, offer=self.offer, rating=5)
+        self.assertEqual(self._versions(), (listings, completed, reviews + 1))
+
+        interaction = InteractionRequest.objects.create(sender=self.member, receiver=self.owner, offer=self.offer)
+        with self.captureOnCommitCallbacks(execute=True):
+            apply_transition(interaction, 'accept')
+        self.assertEqual(self._versions(), (listings + 1, completed + 1, reviews + 1))
+
+    def test_renamed_listing_shows_up_in_cached_sections(self):
+        InteractionRequest.objects.create(sender=self.member, receiver=self.owner, offer=self.offer, status='completed')
+        Review.objects.create(reviewer=self.member, target_user=self.owner, offer=self.offer, rating=5)
+        self._render()
+
+        self.offer.title = 'Piano lesson'
+        self.offer.save()
+        response, _ = self._render()
+        self.assertEqual([service['title'] for service in response.context['completed_services']], ['Piano lesson'])
+        self.assertEqual(response.context['reviews_as_provider'][0]['offer']['title'], 'Piano lesson')
+
+        # Saves that leave the cards alone keep the cached sections
+        _, completed, reviews = self._versions()
+        self.offer.save(update_fields=['tags'])
+        ServiceOffer.objects.get(pk=self.offer.pk).save()
+        self.assertEqual(self._versions()[1:], (completed, reviews))
+
+    def test_new_listing_shows_up_after_cached_render(self):
+        self._render()
+        ServiceRequest.objects.create(user=self.owner, title='Need help', description='-', category='home')
+        response, _ = self._render()
+        self.assertEqual(response.context['active_count'], 2)
+
+    def test_completed_services_one_row_per_listing(self):
+        for _ in range(3):
+            InteractionRequest.objects.create(sender=self.member, receiver=self.owner, offer=self.offer, status='completed')
+        other = ServiceOffer.objects.create(user=self.owner, title='Other', description='-', category='music')
+        latest = InteractionRequest.objects.create(sender=self.member, receiver=self.owner, offer=other, status='completed')
+        Review.objects.create(reviewer=self.member, target_user=self.owner, offer=self.offer, rating=4)
+        Review.objects.create(reviewer=self.member, target_user=self.owner, offer=other, rating=2)
+
+        response, queries = self._render()
+        self.assertEqual(response.context['completed_count'], 2)
+        self.assertEqual([service['title'] for service in response.context['completed_services']], ['Other', 'Lesson'])
+        self.assertEqual(response.context['completed_services'][0]['completed_at'], latest.created_at)
+        self.assertEqual(len(response.context['reviews_as_provider']), 2)
+        self.assertEqual(response.context['provider_avg'], 3.0)
+
+        # Rendering does not grow with the number of reviews
+        for n in range(20):
+            reviewer = User.objects.create_user(username=f'reviewer{n}', email=f'reviewer{n}@example.com')
+            Review.objects.create(reviewer=reviewer, target_user=self.owner, offer=other, rating=5)
+        cache.clear()
+        _, more_queries = self._render()
+        self.assertEqual(more_queries, queries)
+
+
+class UserReviewsApiTests(TestCase):
+    def setUp(self):
+        self.provider = User.objects.create_user(username='provider', email='provider@example.com')
+        self.offer = ServiceOffer.objects.create(user=self.provider, title='Lesson', description='-', category='music')
+        self.request = ServiceRequest.objects.create(user=self.provider, title='Need help', description='-', category='home')
+        for n in range(25):
+            reviewer = User.objects.create_user(username=f'reviewer{n}', email=f'reviewer{n}@example.com')
+            Review.objects.create(reviewer=reviewer, target_user=self.provider, offer=self.offer, rating=n % 5 + 1)
+        Review.objects.create(reviewer=reviewer, target_user=self.provider, service_request=self.request, rating=1)
+        self.client = APIClient()
+        self.client.force_authenticate(reviewer)
+
+    def test_pages_cost_a_fixed_number_of_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            first = self.client.get('/api/profile/provider/reviews/')
+        self.assertEqual(len(first.data['results']), 20)
+        self.assertEqual(first.data['results'][0]['service_title'], 'Need help')
+
+        with CaptureQueriesContext(connection) as next_ctx:
+            second = self.client.get(first.data['next'])
+        self.assertEqual(len(second.data['results']), 6)
+        self.assertIsNone(second.data['next'])
+        self.assertEqual(len(next_ctx.captured_queries), len(ctx.captured_queries))
+
+    def test_summary(self):
+        summary = self.client.get('/api/profile/provider/reviews/', {'summary': 1}).data['summary']
+        self.assertEqual(summary['count'], 26)
+        self.assertEqual(summary['distribution'], {'1': 6, '2': 5, '3': 5, '4': 5, '5': 5})
+        self.assertEqual(summary['provider']['count'], 25)
+        self.assertEqual(summary['provider']['average'], 3.0)
+        self.assertEqual(summary['consumer'], {'count': 1, 'average': 1.0})
+
+
+class ProfileCardsApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.members = [User.objects.create_user(username=f'member{n}', email=f'member{n}@example.com') for n in range(60)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.members[0])
+
+    def _get(self, usernames):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/profiles/', {'usernames': ','.join(usernames)})
+        self.assertEqual(response.status_code, 200)
+        return response, len(ctx.captured_queries)
+
+    def test_fixed_queries_and_cached_cards(self):
+        names = [member.username for member in self.members]
+        _, small = self._get(names[:30])
+        response, large = self._get(names[30:] + ['ghost'])
+        self.assertEqual(small, large)
+        self.assertEqual(len(response.data['results']), 30)
+        self.assertEqual(response.data['missing'], ['ghost'])
+
+        response, cached = self._get(list(reversed(names[:30])))
+        self.assertEqual(cached, 0)
+        self.assertEqual(response.data['results'][0]['username'], 'member29')
+        self.assertNotIn('balance', response.data['results'][0])
+
+    def test_limits(self):
+        self.assertEqual(self.client.get('/api/profiles/').status_code, 400)
+        too_many = ','.join(f'user{n}' for n in range(301))
+        self.assertEqual(self.client.get('/api/profiles/', {'usernames': too_many}).status_code, 400)
+
+
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, IMAGE_DERIVATIVE_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com')
+
+    def _upload(self, size, mode='RGB'):
+        buffer = io.BytesIO()
+        Image.new(mode, size, (200, 100, 50, 128)[:len(mode)]).save(buffer, format='PNG')
+        return SimpleUploadedFile('photo.png', buffer.getvalue(), content_type='image/png')
+
+    def test_variants_generated_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            offer = ServiceOffer.objects.create(
+                user=self.owner, title='Bike', description='-', category='sports', image=self._upload((2000, 1000), 'RGBA'),
+            )
+
+        widths = {}
+        for variant in ('thumb', 'card', 'full'):
+            for fmt in ('webp', 'jpeg'):
+                with default_storage.open(derivative_name(offer.image.name, variant, fmt)) as f:
+                    widths[variant] = Image.open(f).size
+        self.assertEqual(widths, {'thumb': (160, 80), 'card': (480, 240), 'full': (1280, 640)})
+
+        offer.refresh_from_db()
+        self.assertEqual(offer.derivatives_of, offer.image.name)
+        # Serializing decides from the row; storage is never asked
+        with mock.patch.object(ContentAddressedStorage, 'exists', side_effect=AssertionError):
+            variants = ServiceOfferSerializer(offer).data['image_variants']
+        self.assertTrue(variants['webp']['card'].endswith('.card.webp'))
+        self.assertIn(' 480w', variants['srcset']['jpeg'])
+
+    def test_reused_image_is_ready_without_regenerating(self):
+        image = self._upload((300, 200))
+        with self.captureOnCommitCallbacks(execute=True):
+            first = ServiceOffer.objects.create(user=self.owner, title='Bike', description='-', category='sports', image=image, tags=['bike'])
+        image.seek(0)
+        with mock.patch('market.images.generate_derivatives') as generate:
+            with self.captureOnCommitCallbacks(execute=True):
+                second = ServiceRequest.objects.create(user=self.owner, title='Bike', description='-', category='sports', image=image, tags=['bike'])
+        generate.assert_not_called()
+        self.assertEqual(second.image.name, first.image.name)
+        second.refresh_from_db()
+        self.assertEqual(second.derivatives_of, second.image.name)
+
+    def test_small_images_are_not_upscaled_and_pending_variants_are_null(self):
+        offer = ServiceOffer.objects.create(
+            user=self.owner, title='Bike', description='-', category='sports', image=self._upload((100, 50)),
+        )
+        self.assertIsNone(ServiceOfferSerializer(offer).data['image_variants'])
+        call_command('generate_image_derivatives', workers=0, stdout=io.StringIO())
+        with default_storage.open(derivative_name(offer.image.name, 'full', 'webp')) as f:
+            self.assertEqual(Image.open(f).size, (100, 50))
+        offer.refresh_from_db()
+        self.assertIsNotNone(ServiceOfferSerializer(offer).data['image_variants'])
+
+
+class DerivativePoolTests(TestCase):
+    def setUp(self):
+        self.addCleanup(self._shutdown)
+
+    def _shutdown(self):
+        if images._pool is not None:
+            images._pool.shutdown(cancel_futures=True)
+            images._pool = None
+
+    @override_settings(IMAGE_DERIVATIVE_WORKERS=1)
+    def test_broken_pool_is_replaced(self):
+        broken = images.new_pool(1)
+        self.assertEqual(broken._mp_context.get_start_method(), 'spawn')
+        images._pool = broken
+        # A worker dying takes the whole pool down
+        with self.assertRaises(BrokenProcessPool):
+            broken.submit(os._exit, 1).result(timeout=60)
+
+        with mock.patch('market.images.mark_derivatives_ready'), mock.patch('market.images.logger'):
+            future = images.schedule_derivatives('listings/missing.png')
+            # The fresh pool's worker set Django up and ran the job; the file itself does not exist
+            self.assertIsInstance(future.exception(timeout=60), FileNotFoundError)
+        self.assertIsNot(images._pool, broken)
+
+
+class MediaDeliveryTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, IMAGE_DERIVATIVE_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.name = default_storage.save('listings/notes.txt', io.BytesIO(b'0123456789'))
+
+    def test_full_and_range_responses(self):
+        response = self.client.get(f'/media/{self.name}')
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+        partial = self.client.get(f'/media/{self.name}', HTTP_RANGE='bytes=2-4')
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(partial['Content-Range'], 'bytes 2-4/10')
+        self.assertEqual(b''.join(partial.streaming_content), b'234')
+
+        suffix = self.client.get(f'/media/{self.name}', HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(suffix.streaming_content), b'789')
+        self.assertEqual(self.client.get(f'/media/{self.name}', HTTP_RANGE='bytes=20-').status_code, 416)
+
+        cached = self.client.get(f'/media/{self.name}', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+        unchanged = self.client.get(f'/media/{self.name}', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(unchanged.status_code, 304)
+        older = http_date(os.stat(default_storage.path(self.name)).st_mtime - 60)
+        self.assertEqual(self.client.get(f'/media/{self.name}', HTTP_IF_MODIFIED_SINCE=older).status_code, 200)
+        # A mismatching ETag is authoritative even when the date would match
+        stale = self.client.get(
+            f'/media/{self.name}', HTTP_IF_NONE_MATCH='"other"', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'],
+        )
+        self.assertEqual(stale.status_code, 200)
+
+    def test_proxy_handoff_and_path_checks(self):
+        with override_settings(MEDIA_DELIVERY='accel'):
+            response = self.client.get(f'/media/{self.name}')
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.name}')
+        os.makedirs(os.path.join(self.media_root, 'listings'), exist_ok=True)
+        with open(os.path.join(self.media_root, 'listings', 'my notes #1.txt'), 'wb') as f:
+            f.write(b'notes')
+        with override_settings(MEDIA_DELIVERY='accel'):
+            response = self.client.get('/media/listings/my%20notes%20%231.txt')
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/listings/my%20notes%20%231.txt')
+        self.assertEqual(response.content, b'')
+        self.assertEqual(self.client.get('/media/../core/settings.py').status_code, 404)
+        self.assertEqual(self.client.get('/media/listings/missing.txt').status_code, 404)
+
+
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, IMAGE_DERIVATIVE_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com')
+
+    def _photo(self, color):
+        buffer = io.BytesIO()
+        Image.new('RGB', (40, 20), color).save(buffer, format='PNG')
+        return SimpleUploadedFile('photo.png', buffer.getvalue(), content_type='image/png')
+
+    def _offer(self, color):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ServiceOffer.objects.create(
+                user=self.owner, title='Bike', description='-', category='sports', image=self._photo(color),
+            )
+
+    def _refs(self, name):
+        return MediaBlob.objects.get(name=name).ref_count
+
+    def test_names_come_from_content(self):
+        storage = ContentAddressedStorage(location=self.media_root)
+        digest = hashlib.sha256(b'0123456789').hexdigest()
+        name = storage.save('listings/Notes.TXT', io.BytesIO(b'0123456789'))
+        self.assertEqual(name, f'blobs/{digest[:2]}/{digest}.txt')
+        self.assertEqual(storage.save('avatars/copy.txt', io.BytesIO(b'0123456789')), name)
+        self.assertNotEqual(storage.save('listings/notes.txt', io.BytesIO(b'other')), name)
+        self.assertEqual(MediaBlob.objects.get(digest=digest).name, name)
+        self.assertEqual(storage.save('derivatives/a/b.webp', io.BytesIO(b'x')), 'derivatives/a/b.webp')
+
+    def test_duplicates_share_one_blob_until_collected(self):
+        first, second = self._offer('red'), self._offer('red')
+        name = first.image.name
+        self.assertRegex(name, r'^blobs/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+        self.assertEqual(second.image.name, name)
+        self.assertEqual(MediaBlob.objects.count(), 1)
+        self.assertEqual(self._refs(name), 2)
+        self.assertTrue(has_derivatives(name))
+
+        first.delete()
+        self.assertEqual(self._refs(name), 1)
+        second.image = self._photo('blue')
+        second.save()
+        self.assertEqual(self._refs(name), 0)
+        self.assertEqual(self._refs(second.image.name), 1)
+
+        self.assertEqual(collect_garbage(grace=timedelta(hours=1))[0], 0)
+        freed, _ = collect_garbage(grace=timedelta(0))
+        self.assertEqual(freed, 1)
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(has_derivatives(name))
+        self.assertTrue(default_storage.exists(second.image.name))
+
+    def test_collection_racing_a_reupload_keeps_the_file(self):
+        storage = ContentAddressedStorage(location=self.media_root)
+        name = storage.save('listings/notes.txt', io.BytesIO(b'0123456789'))
+        blob = MediaBlob.objects.get(name=name)
+        MediaBlob.objects.filter(pk=blob.pk).update(touched_at=timezone.now() - timedelta(days=1))
+
+        # The same bytes are uploaded again right after the collector removed the row
+        delete = QuerySet.delete
+        def delete_then_reupload(queryset):
+            result = delete(queryset)
+            if queryset.model is MediaBlob:
+                MediaBlob.objects.create(digest=blob.digest, name=name, size=blob.size)
+            return result
+        with mock.patch.object(QuerySet, 'delete', delete_then_reupload):
+            self.assertEqual(collect_garbage(grace=timedelta(hours=1), storage=storage)[0], 0)
+        self.assertTrue(storage.exists(name))
+
+    def test_upload_rewrites_a_blob_whose_row_was_collected(self):
+        storage = ContentAddressedStorage(location=self.media_root)
+        name = storage.save('listings/notes.txt', io.BytesIO(b'0123456789'))
+        # The collector deleted the row and is about to delete the file
+        MediaBlob.objects.filter(name=name).delete()
+        os.remove(storage.path(name))
+        self.assertEqual(storage.save('listings/again.txt', io.BytesIO(b'0123456789')), name)
+        self.assertTrue(MediaBlob.objects.filter(name=name).exists())
+        with storage.open(name) as f:
+            self.assertEqual(f.read(), b'0123456789')
+
+    def test_deferred_image_is_not_loaded_or_recounted(self):
+        offer = self._offer('red')
+        with self.assertNumQueries(1):
+            loaded = ServiceOffer.objects.only('id', 'title').get(pk=offer.pk)
+        loaded.title = 'Renamed'
+        loaded.save()
+        self.assertEqual(self._refs(offer.image.name), 1)
+
+        recounted = ServiceOffer.objects.defer('image').get(pk=offer.pk)
+        recounted.delete()
+        self.assertEqual(self._refs(offer.image.name), 0)
+
+
+class ReputationMetricsTests(TestCase):
+    def setUp(self):
+        self.owner, self.alice, self.bob, self.carol = [
+            User.objects.create_user(username=name, email=f'{name}@example.com')
+            for name in ('owner', 'alice', 'bob', 'carol')
+        ]
+        self.offer = ServiceOffer.objects.create(user=self.owner, title='Lesson', description='-', category='music', capacity=10)
+        statuses = [(self.alice, 'completed'), (self.alice, 'completed'), (self.alice, 'declined'), (self.bob, 'completed')]
+        self.interactions = [
+            InteractionRequest.objects.create(sender=sender, receiver=self.owner, offer=self.offer, status=status)
+            for sender, status in statuses
+        ]
+        requested_at = timezone.now() - timedelta(hours=1)
+        InteractionRequest.objects.update(created_at=requested_at, updated_at=requested_at)
+        for interaction, delay in zip(self.interactions, (60, 180, 600)):
+            # Only the first reply counts
+            for offset, content in ((delay, 'hi'), (delay + 30, 'again')):
+                reply = ChatMessage.objects.create(interaction=interaction, sender=self.owner, content=content)
+                ChatMessage.objects.filter(pk=reply.pk).update(timestamp=requested_at + timedelta(seconds=offset))
+
+    def test_full_refresh(self):
+        self.assertEqual(call_command('refresh_reputation', stdout=io.StringIO()), None)
+        owner = ReputationMetrics.objects.get(user=self.owner)
+        self.assertEqual(owner.completion_rate, 0.75)
+        self.assertEqual(owner.median_response_seconds, 180)
+        self.assertEqual(owner.repeat_partner_ratio, 0.5)
+        alice = ReputationMetrics.objects.get(user=self.alice)
+        self.assertAlmostEqual(alice.completion_rate, 2 / 3)
+        self.assertIsNone(alice.median_response_seconds)
+        self.assertEqual(alice.repeat_partner_ratio, 1.0)
+
+        response = self.client.get('/profile/owner/')
+        self.assertEqual(response.context['reputation']['completion_rate'], 0.75)
+        self.assertContains(response, 'Completion Rate')
+
+    def test_profile_api_reads_reputation_in_the_same_query(self):
+        refresh_metrics()
+        client = APIClient()
+        client.force_authenticate(self.owner)
+        with self.assertNumQueries(1):
+            mine = client.get('/api/profile/')
+        self.assertEqual(mine.data['reputation']['completion_rate'], 0.75)
+        with self.assertNumQueries(1):
+            other = client.get('/api/profile/alice/')
+        self.assertAlmostEqual(other.data['reputation']['completion_rate'], 2 / 3)
+        # Not computed yet: no extra query either
+        with self.assertNumQueries(1):
+            self.assertIsNone(client.get('/api/profile/carol/').data['reputation'])
+
+    def test_incremental_refresh_only_touches_changed_users(self):
+        refresh_metrics()
+        self.assertEqual(refresh_metrics(incremental=True), 0)
+
+        interaction = InteractionRequest.objects.create(sender=self.carol, receiver=self.owner, offer=self.offer)
+        apply_transition(interaction, 'decline')
+        self.assertEqual(refresh_metrics(incremental=True), 2)
+        self.assertEqual(ReputationMetrics.objects.get(user=self.owner).completion_rate, 0.6)
+        self.assertEqual(ReputationMetrics.objects.get(user=self.carol).completion_rate, 0.0)
+
+
+class RecommendationTests(TestCase):
+    def setUp(self):
+        self.me, self.fan1, self.fan2, self.teacher, self.chef, self.blocked = [
+            User.objects.create_user(username=name, email=f'{name}@example.com')
+            for name in ('me', 'fan1', 'fan2', 'teacher', 'chef', 'blocked')
+        ]
+        ServiceRequest.objects.create(user=self.me, title='Guitar help', description='-', category='music', tags=['Guitar'])
+        for fan in (self.fan1, self.fan2):
+            ServiceOffer.objects.create(user=fan, title='Strings', description='-', category='music', tags=['guitar', 'piano'])
+        self.piano = ServiceOffer.objects.create(user=self.teacher, title='Piano', description='-', category='education', tags=['piano'])
+        ServiceOffer.objects.create(user=self.chef, title='Cooking', description='-', category='food', tags=['cooking'])
+        ServiceOffer.objects.create(user=self.blocked, title='Piano too', description='-', category='education', tags=['piano'])
+        Block.objects.create(blocker=self.me, blocked=self.blocked)
+        call_command('build_recommendations', stdout=io.StringIO())
+        self.client = APIClient()
+        self.client.force_authenticate(self.me)
+
+    def test_related_offers_ranked_and_filtered(self):
+        titles = [item['title'] for item in self.client.get('/api/recommendations/').data['results']]
+        # Direct matches on category/tag first, then piano through the guitar/piano co-occurrence
+        self.assertEqual(titles[-1], 'Piano')
+        self.assertEqual(set(titles), {'Strings', 'Piano'})
+
+        self.piano.reserved_seats = self.piano.capacity
+        self.piano.save(update_fields=['reserved_seats'])
+        titles = [item['title'] for item in self.client.get('/api/recommendations/').data['results']]
+        self.assertNotIn('Piano', titles)
+
+    def test_feature_index_follows_tag_edits(self):
+        offer = ServiceOffer.objects.get(user=self.chef)
+        offer.tags = ['guitar']
+        offer.save(update_fields=['tags'])
+        self.assertEqual(set(offer.features.values_list('feature', flat=True)), {'cat:food', 'tag:guitar'})
+        titles = [item['title'] for item in self.client.get('/api/recommendations/').data['results']]
+        self.assertIn('Cooking', titles)
+
+
+    def test_reindex_writes_offers_in_batches(self):
+        ListingFeature.objects.all().delete()
+        with mock.patch('market.recommendations.index_offers', wraps=recommendations.index_offers) as index_offers:
+            self.assertEqual(recommendations.reindex_offers(batch_size=2), 5)
+        self.assertEqual([len(call.args[0]) for call in index_offers.call_args_list], [2, 2, 1])
+        self.assertEqual(set(self.piano.features.values_list('feature', flat=True)), {'cat:education', 'tag:piano'})
+
+class WikidataCacheTests(TestCase):
+    def setUp(self):
+        wikidata_cache.lru.clear()
+        search = mock.patch('market.wikidata.candidate_entities', return_value=['Q6607'])
+        related = mock.patch('market.wikidata.fetch_related_tags', return_value=['bass guitar', 'electric guitar'])
+        self.search = search.start()
+        self.related = related.start()
+        self.addCleanup(mock.patch.stopall)
+
+    def _age(self, kind, key, delta):
+        WikidataCacheEntry.objects.filter(kind=kind, key=key).update(fetched_at=timezone.now() - delta)
+        wikidata_cache.lru.clear()
+
+    def test_repeat_lookups_stay_local(self):
+        for term in ('Guitar', ' guitar ', 'GUITAR'):
+            self.assertEqual(wikidata.get_wikidata_suggestions(term), ['bass guitar', 'electric guitar'])
+        self.assertEqual(self.search.call_count, 1)
+        self.assertEqual(self.related.call_count, 1)
+
+        # Another process: empty LRU, answered from the table
+        # (plus the local taxonomy lookup, which has nothing for it)
+        wikidata_cache.lru.clear()
+        with self.assertNumQueries(3):
+            wikidata.get_wikidata_suggestions('guitar')
+        with self.assertNumQueries(1):
+            wikidata.get_wikidata_suggestions('guitar')
+        self.assertEqual(self.search.call_count, 1)
+
+    def test_negative_answers_expire_sooner(self):
+        self.search.return_value = []
+        self.assertEqual(wikidata.get_wikidata_suggestions('xyzzy'), [])
+        self.assertTrue(WikidataCacheEntry.objects.get(kind='entity', key='xyzzy').is_negative)
+        self._age('entity', 'xyzzy', wikidata_cache.NEGATIVE_TTL - timedelta(minutes=1))
+        wikidata.get_wikidata_suggestions('xyzzy')
+        self.assertEqual(self.search.call_count, 1)
+
+        self._age('entity', 'xyzzy', wikidata_cache.NEGATIVE_TTL + wikidata_cache.STALE_WINDOW + timedelta(minutes=1))
+        wikidata.get_wikidata_suggestions('xyzzy')
+        self.assertEqual(self.search.call_count, 2)
+
+    def test_stale_entries_are_served_while_refreshing(self):
+        wikidata.get_related_tags('Q6607')
+        self._age('related', 'Q6607', wikidata_cache.POSITIVE_TTL + timedelta(days=1))
+        self.related.return_value = ['new tag']
+        with mock.patch('market.wikidata_cache.schedule_refresh') as refresh:
+            self.assertEqual(wikidata.get_related_tags('Q6607'), ['bass guitar', 'electric guitar'])
+        refresh.assert_called_once()
+        self.assertEqual(self.related.call_count, 1)
+
+    def test_upstream_errors_are_not_cached(self):
+        self.related.side_effect = requests.ConnectionError('down')
+        wikidata_client.counters.clear()
+        self.assertEqual(wikidata.get_related_tags('Q1'), [])
+        self.assertEqual(wikidata_client.counters.snapshot(), {'lookup_failures': 1, 'empty_served': 1})
+        self.assertFalse(WikidataCacheEntry.objects.filter(key='Q1').exists())
+
+        self.related.side_effect = None
+        wikidata.get_related_tags('Q1')
+        self._age('related', 'Q1', wikidata_cache.POSITIVE_TTL + wikidata_cache.STALE_WINDOW + timedelta(days=1))
+        self.related.side_effect = requests.Timeout('slow')
+        self.assertEqual(wikidata.get_related_tags('Q1'), ['bass guitar', 'electric guitar'])
+        self.assertEqual(wikidata_client.counters.snapshot()['stale_served'], 1)
+
+
+class StubWikidataHandler(BaseHTTPRequestHandler):
+    """Answers like the Wikidata search API and SPARQL endpoint"""
+    protocol_version = 'HTTP/1.1'
+    # entity id -> (related labels, seconds to wait before answering)
+    neighbourhoods = {
+        'Q1': (['electric guitar', 'bass guitar'], 0.6),
+        'Q2': (['guitar amplifier', 'Bass Guitar'], 0.6),
+        'Q3': (['guitar pick'], 3.0),
+    }
+    # Entities the stub fails on
+    broken = {'Q9'}
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        self.server.connections.add(self.client_address)
+        self.server.hits.append(self.path)
+        if url.path == '/sparql' and params['query'][0].split('wd:')[1].split()[0] in self.broken:
+            self.send_error(503)
+            return
+        if url.path == '/w/api.php':
+            term = params['search'][0]
+            body = {'search': [
+                {'id': 'Q2', 'label': f'{term} amplifier', 'description': ''},
+                {'id': 'Q1', 'label': term, 'description': 'string instrument'},
+                {'id': 'Q3', 'label': f'{term} pick', 'description': ''},
+            ]}
+        else:
+            entity_id = params['query'][0].split('wd:')[1].split()[0]
+            labels, delay = self.neighbourhoods[entity_id]
+            time.sleep(delay)
+            body = {'results': {'bindings': [{'itemLabel': {'value': label}} for label in labels]}}
+        payload = json.dumps(body).encode()
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        except ConnectionError:
+            pass  # The client hit its deadline and hung up
+
+    def log_message(self, *args):
+        pass
+
+
+class WikidataClientTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubWikidataHandler)
+        cls.server.connections = set()
+        cls.server.hits = []
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        base = f'http://127.0.0.1:{cls.server.server_port}'
+        cls.urls = override_settings(WIKIDATA_SEARCH_URL=f'{base}/w/api.php', WIKIDATA_SPARQL_URL=f'{base}/sparql')
+        cls.urls.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.urls.disable()
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        wikidata_cache.lru.clear()
+        wikidata_client.counters.clear()
+        self.server.connections.clear()
+        self.server.hits.clear()
+
+    def test_candidates_are_ranked_and_connections_reused(self):
+        self.assertNotEqual(wikidata_client.get_client().search_url, wikidata_client.DEFAULT_SEARCH_URL)
+        for _ in range(3):
+            self.assertEqual(wikidata.candidate_entities('guitar'), ['Q1', 'Q2', 'Q3'])
+        self.assertEqual(len(self.server.connections), 1)
+
+    @override_settings(WIKIDATA_DEADLINE=1.5)
+    def test_neighbourhoods_are_fetched_concurrently_within_the_deadline(self):
+        started = time.monotonic()
+        suggestions = wikidata.get_wikidata_suggestions('guitar')
+        elapsed = time.monotonic() - started
+
+        # Q1 and Q2 (0.6s each) only both fit the 1.5s budget when they overlap;
+        # Q3 (3s) misses it and is dropped without being cached
+        self.assertLess(elapsed, 2.5)
+        self.assertEqual(suggestions, ['electric guitar', 'bass guitar', 'guitar amplifier'])
+        cached = set(WikidataCacheEntry.objects.filter(kind='related').values_list('key', flat=True))
+        self.assertEqual(cached, {'Q1', 'Q2'})
+
+    def test_identical_concurrent_lookups_share_one_upstream_call(self):
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(lambda _: wikidata.fetch_related_tags('Q1'), range(4)))
+
+        self.assertEqual(results, [['electric guitar', 'bass guitar']] * 4)
+        self.assertEqual(len(self.server.hits), 1)
+        self.assertEqual(wikidata_client.counters.snapshot()['deduplicated'], 3)
+
+    @override_settings(WIKIDATA_BREAKER_THRESHOLD=2, WIKIDATA_BREAKER_RESET=60)
+    def test_circuit_opens_after_repeated_failures(self):
+        for _ in range(2):
+            with self.assertRaises(wikidata_client.WikidataError):
+                wikidata.fetch_related_tags('Q9')
+        with self.assertRaises(wikidata_client.CircuitOpen):
+            wikidata.fetch_related_tags('Q1')
+        self.assertEqual(len(self.server.hits), 2)
+
+        # Suggestions degrade to empty without touching the upstream
+        staff = User.objects.create_user('ops', password='pw', is_staff=True)
+        api = APIClient()
+        api.force_authenticate(staff)
+        response = api.get('/api/wikidata/tags/', {'q': 'guitar'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'tags': []})
+        self.assertEqual(len(self.server.hits), 2)
+
+        status = api.get('/api/wikidata/status/').json()
+        self.assertEqual(status['circuit'], 'open')
+        self.assertEqual(status['counters']['circuit_opened'], 1)
+        self.assertGreaterEqual(status['counters']['short_circuited'], 2)
+
+        # After the reset timeout one trial call closes it again
+        wikidata_client.get_client().breaker.opened_at -= 60
+        self.assertEqual(wikidata.fetch_related_tags('Q1'), ['electric guitar', 'bass guitar'])
+        self.assertEqual(wikidata_client.get_client().breaker.state, 'closed')
+
+
+class TaxonomyTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def _write(self, name, text):
+        path = f'{self.tmp}/{name}'
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def _load(self, path, *args):
+        call_command('load_wikidata_taxonomy', path, *args, stdout=io.StringIO())
+
+    def test_tsv_load_precomputes_neighbours(self):
+        path = self._write('subset.tsv', '\n'.join([
+            '# label rows, then relation rows',
+            'Q6607\tguitar', 'Q1798603\tplucked string instrument', 'Q78987\telectric guitar',
+            'Q1\tguitar lessons', 'Q2\tguitarist', 'Q3\tQ12345',
+            'Q6607\tP279\tQ1798603',
+            'Q78987\tP279\tQ6607',
+            'Q1\tP366\tQ6607',
+            'Q6607\tP3095\tQ2',
+            'Q6607\tP279\tQ3',
+            'Q6607\tP279\tQ404',
+        ]))
+        self._load(path, '--batch-size', '2')
+
+        self.assertEqual(TaxonomyRelation.objects.count(), 6)
+        guitar = TaxonomyEntity.objects.get(qid='Q6607')
+        self.assertEqual(guitar.label_lower, 'guitar')
+        # Bare ids and entities without a loaded label are left out
+        self.assertEqual(
+            sorted(guitar.neighbours),
+            ['electric guitar', 'guitar lessons', 'guitarist', 'plucked string instrument'],
+        )
+        self.assertEqual(TaxonomyEntity.objects.get(qid='Q78987').neighbours, ['guitar'])
+
+        # Reloading is idempotent
+        self._load(path)
+        self.assertEqual(TaxonomyRelation.objects.count(), 6)
+
+    def test_repeated_entity_in_one_batch_keeps_the_last_label(self):
+        path = self._write('subset.tsv', 'Q6607\tguitar\nQ6607\tGuitar\nQ1\tguitar lessons\n')
+        self._load(path)
+
+        self.assertEqual(TaxonomyEntity.objects.get(qid='Q6607').label, 'Guitar')
+        self.assertEqual(TaxonomyEntity.objects.count(), 2)
+
+    def test_json_dump_load(self):
+        entity = {
+            'id': 'Q6607', 'labels': {'en': {'value': 'Guitar'}, 'tr': {'value': 'Gitar'}},
+            'claims': {'P279': [{'mainsnak': {'datavalue': {'value': {'id': 'Q1798603'}}}}]},
+        }
+        parent = {'id': 'Q1798603', 'label': 'plucked string instrument', 'claims': {}}
+        path = self._write('dump.json', '[\n' + json.dumps(entity) + ',\n' + json.dumps(parent) + '\n]\n')
+        self._load(path)
+
+        self.assertEqual(TaxonomyEntity.objects.get(qid='Q6607').label, 'Guitar')
+        self.assertEqual(TaxonomyEntity.objects.get(qid='Q6607').neighbours, ['plucked string instrument'])
+
+    def test_suggestions_come_from_the_local_graph(self):
+        TaxonomyEntity.objects.create(qid='Q6607', label='guitar', label_lower='guitar', neighbours=['electric guitar', 'guitarist'])
+        TaxonomyEntity.objects.create(qid='Q2', label='guitarist', label_lower='guitarist', neighbours=['Guitarist', 'musician'])
+        TaxonomyEntity.objects.create(qid='Q3', label='gun', label_lower='gun', neighbours=['firearm'])
+
+        with mock.patch('market.wikidata.candidate_entities') as live:
+            with self.assertNumQueries(1):
+                self.assertEqual(wikidata.get_wikidata_suggestions(' Guitar'), ['electric guitar', 'guitarist', 'musician'])
+            self.assertEqual(wikidata.get_wikidata_suggestions('guitari'), ['Guitarist', 'musician'])
+        live.assert_not_called()
+
+    @override_settings(WIKIDATA_LIVE_FALLBACK=False)
+    def test_unknown_terms_stay_offline_without_fallback(self):
+        with mock.patch('market.wikidata.candidate_entities') as live:
+            self.assertEqual(wikidata.get_wikidata_suggestions('banjo'), [])
+        live.assert_not_called()
+
+
+class ListingTagTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', email='owner@example.com', password='pw')
+        self.viewer = User.objects.create_user('viewer', email='viewer@example.com', password='pw')
+        self.guitar = ServiceOffer.objects.create(user=self.owner, title='Guitar', description='-', category='music', tags=['Guitar', 'Lessons'])
+        self.piano = ServiceOffer.objects.create(user=self.owner, title='Piano', description='-', category='music', tags=['piano', 'lessons '])
+        self.request = ServiceRequest.objects.create(user=self.owner, title='Need guitar', description='-', category='music', tags=['guitar'])
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def _usage(self):
+        return dict(Tag.objects.values_list('name', 'usage_count'))
+
+    def _titles(self, url, params):
+        response = self.client.get(url, params)
+        items = response.data['results'] if isinstance(response.data, dict) else response.data
+        return sorted(item['title'] for item in items)
+
+    def test_usage_counts_follow_edits_and_deletes(self):
+        self.assertEqual(self._usage(), {'guitar': 2, 'lessons': 2, 'piano': 1})
+
+        self.piano.tags = ['piano', 'harmony']
+        self.piano.save()
+        self.assertEqual(self._usage(), {'guitar': 2, 'lessons': 1, 'piano': 1, 'harmony': 1})
+
+        self.guitar.delete()
+        self.request.delete()
+        self.assertEqual(self._usage(), {'guitar': 0, 'lessons': 0, 'piano': 1, 'harmony': 1})
+
+    def test_tag_filters(self):
+        self.assertEqual(self._titles('/api/service-offers/', {'tag': 'GUITAR'}), ['Guitar'])
+        self.assertEqual(self._titles('/api/service-offers/', {'tags_any': 'guitar,piano'}), ['Guitar', 'Piano'])
+        self.assertEqual(self._titles('/api/service-offers/', {'tags_all': 'lessons, piano'}), ['Piano'])
+        self.assertEqual(self._titles('/api/service-offers/', {'tags_all': 'guitar,piano'}), [])
+        self.assertEqual(self._titles('/api/service-requests/', {'tag': 'guitar'}), ['Need guitar'])
+
+
+class SnapshotRefreshTests(TestCase):
+    class Slow(Snapshot):
+        def __init__(self):
+            self.loads = 0
+            self.release = threading.Event()
+            super().__init__()
+
+        def empty(self):
+            return 'empty'
+
+        def load(self):
+            self.loads += 1
+            self.release.wait(10)
+            return f'load {self.loads}'
+
+        def install(self, state):
+            self.state = state
+
+    def test_stale_snapshot_is_rebuilt_once_in_the_background(self):
+        snapshot = self.Slow()
+        snapshot.ensure_fresh()
+        snapshot.ensure_fresh()
+        # Readers keep the previous state while the single rebuild runs
+        self.assertEqual(snapshot.state, 'empty')
+        snapshot.release.set()
+        for _ in range(100):
+            if not snapshot.is_stale():
+                break
+            time.sleep(0.05)
+        self.assertEqual((snapshot.state, snapshot.loads), ('load 1', 1))
+
+        snapshot.built_at -= snapshots.REFRESH_INTERVAL + 1
+        snapshot.ensure_fresh()
+        for _ in range(100):
+            if snapshot.state == 'load 2':
+                break
+            time.sleep(0.05)
+        self.assertEqual(snapshot.loads, 2)
+
+
+@override_settings(INDEX_REFRESH_WORKERS=0)
+class TagAutocompleteTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('tagger', email='tagger@example.com', password='pw')
+        for tags in (['guitar', 'gardening'], ['guitar'], ['guitar lessons', 'piano']):
+            ServiceOffer.objects.create(user=self.user, title='-', description='-', category='music', tags=tags)
+        tag_index.clear()
+        self.addCleanup(tag_index.clear)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _complete(self, prefix, **params):
+        response = self.client.get('/api/tags/autocomplete/', {'prefix': prefix, **params})
+        return [(tag['name'], tag['usage_count']) for tag in response.data['tags']]
+
+    def test_ranked_by_usage_without_queries_per_keystroke(self):
+        self.assertEqual(self._complete('g'), [('guitar', 2), ('gardening', 1), ('guitar lessons', 1)])
+        with self.assertNumQueries(0):
+            tag_index.complete('gu')
+            tag_index.complete('gui')
+        self.assertEqual(self._complete('GUITAR ', limit=1), [('guitar', 2)])
+        self.assertEqual(self._complete('x'), [])
+
+    def test_index_follows_listing_saves_and_deletes(self):
+        tag_index.build()
+        with self.captureOnCommitCallbacks(execute=True):
+            ServiceRequest.objects.create(user=self.user, title='-', description='-', category='music', tags=['Gardening', 'grafting'])
+        self.assertEqual(tag_index.complete('g'), [('gardening', 2), ('guitar', 2), ('grafting', 1), ('guitar lessons', 1)])
+
+        offer = ServiceOffer.objects.get(tags=['guitar lessons', 'piano'])
+        with self.captureOnCommitCallbacks(execute=True):
+            offer.delete()
+        self.assertEqual(tag_index.complete('gui'), [('guitar', 2)])
+        self.assertEqual(tag_index.complete('p'), [])
+
+
+@override_settings(TAG_ENRICHMENT_WORKERS=0)
+class TagEnrichmentTests(TestCase):
+    CONCEPTS = {'guitar', 'guitar lessons', 'music', 'gardening', 'cooking'}
+
+    def setUp(self):
+        wikidata_cache.lru.clear()
+        self.user = User.objects.create_user('enricher', email='enricher@example.com')
+        fetch = mock.patch('market.enrichment.fetch_term_entities', side_effect=self._resolve)
+        self.fetch = fetch.start()
+        self.addCleanup(fetch.stop)
+
+    def _resolve(self, terms, deadline=None):
+        return {term: f'Q{len(term)}' if term in self.CONCEPTS else None for term in terms}
+
+    def _offer(self, title, category='music', tags=None):
+        return ServiceOffer.objects.create(user=self.user, title=title, description='-', category=category, tags=tags or [])
+
+    def test_extract_terms(self):
+        self.assertEqual(
+            enrichment.extract_terms('Guitar lessons for beginners!', 'Music'),
+            ['guitar lessons', 'lessons beginners', 'guitar', 'lessons', 'beginners', 'music'],
+        )
+
+    def test_new_listings_are_enriched_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            offer = self._offer('Guitar lessons')
+            tagged = self._offer('Own tags', tags=['custom'])
+        offer.refresh_from_db()
+        self.assertEqual(offer.tags, ['guitar lessons', 'guitar', 'music'])
+        self.assertEqual(tagged.tags, ['custom'])
+        self.assertEqual(self.fetch.call_count, 1)
+        # Links, usage counts and recommendation features follow the bulk update
+        self.assertEqual(Tag.objects.get(name='guitar lessons').usage_count, 1)
+        self.assertIn('tag:guitar', set(offer.features.values_list('feature', flat=True)))
+
+    def test_tags_set_by_the_owner_meanwhile_are_kept(self):
+        offers = [self._offer('Guitar lessons'), self._offer('Cooking class', 'food')]
+        loaded = list(enrichment.untagged(ServiceOffer))
+        offers[0].tags = ['mine']
+        offers[0].save()
+
+        self.assertEqual(enrichment.enrich_listings(loaded), 1)
+        offers[0].refresh_from_db()
+        offers[1].refresh_from_db()
+        self.assertEqual(offers[0].tags, ['mine'])
+        self.assertEqual(offers[1].tags, ['cooking'])
+        self.assertFalse(Tag.objects.filter(name='guitar').exists())
+
+    def test_backfill_batches_terms_and_resumes_from_checkpoint(self):
+        offers = [self._offer('Guitar help'), self._offer('Gardening tips', 'home'), self._offer('Cooking class', 'food')]
+        self.fetch.side_effect = [self._resolve(['guitar', 'music']), wikidata_client.WikidataError('down')]
+        with self.assertRaises(CommandError):
+            call_command('enrich_listing_tags', '--batch-size', '1', stdout=io.StringIO())
+        self.assertEqual(BackfillCheckpoint.objects.get(name='enrich_tags:serviceoffer').last_id, offers[0].id)
+
+        self.fetch.side_effect = self._resolve
+        call_command('enrich_listing_tags', '--batch-size', '2', stdout=io.StringIO())
+        self.assertEqual(
+            [offer.tags for offer in ServiceOffer.objects.order_by('id')],
+            [['guitar', 'music'], ['gardening'], ['cooking']],
+        )
+        # One SPARQL query per batch of terms, cached terms are not asked again
+        self.assertEqual(self.fetch.call_count, 3)
+        asked = [term for call in self.fetch.call_args_list[2:] for term in call.args[0]]
+        self.assertNotIn('music', asked)
+
+
+@override_settings(INDEX_REFRESH_WORKERS=0)
+class ListingSearchTests(TestCase):
+    def setUp(self):
+        search.graph.clear()
+        self.addCleanup(search.graph.clear)
+        self.user = User.objects.create_user('seeker', email='seeker@example.com')
+        make = lambda title, tags, category='music': ServiceOffer.objects.create(
+            user=self.user, title=title, description='-', category=category, tags=tags,
+        )
+        self.direct = make('Guitar repair', ['repair'])
+        self.tagged = make('Weekend jam', ['guitar'])
+        self.lessons = make('Beginner course', ['music lessons'])
+        self.strings = make('Violin and more', ['string instrument'], 'crafts')
+        self.unrelated = make('Cooking', ['cooking'], 'food')
+        # What earlier live suggestions left in the cache
+        now = timezone.now()
+        WikidataCacheEntry.objects.create(kind='entity', key='guitar', value=['Q6607'], fetched_at=now)
+        WikidataCacheEntry.objects.create(kind='related', key='Q6607', value=['String instrument', 'electric guitar'], fetched_at=now)
+        TaxonomyEntity.objects.create(qid='Q6607', label='guitar', label_lower='guitar', neighbours=['music lessons'])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _titles(self, q):
+        return [item['title'] for item in self.client.get('/api/service-offers/', {'q': q}).data]
+
+    def test_expanded_matches_rank_below_direct_ones(self):
+        with mock.patch('market.wikidata_client.WikidataClient.sparql') as sparql, \
+                mock.patch('market.wikidata_client.WikidataClient.search') as live_search:
+            titles = self._titles('Guitar')
+        sparql.assert_not_called()
+        live_search.assert_not_called()
+
+        self.assertEqual(titles[:2], ['Guitar repair', 'Weekend jam'])
+        self.assertEqual(set(titles[2:]), {'Beginner course', 'Violin and more'})
+
+    def test_graph_links_both_ways(self):
+        self.assertEqual(self._titles('string instrument'), ['Violin and more', 'Weekend jam'])
+        self.assertEqual(self._titles('cooking'), ['Cooking'])
+
+
+class ForumPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('poster', email='poster@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.topics = [ForumTopic.objects.create(author=self.user, title=f'Topic {n}', content='-') for n in range(5)]
+        for n in range(3):
+            ForumComment.objects.create(topic=self.topics[0], author=self.user, content=f'Reply {n}')
+
+    def test_topic_list_is_paginated_with_counts(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/forum-topics/', {'page_size': 3})
+        rows = response.data['results']
+        self.assertEqual([row['title'] for row in rows], ['Topic 4', 'Topic 3', 'Topic 2'])
+        self.assertNotIn('comments', rows[0])
+        self.assertEqual(rows[0]['comment_count'], 0)
+        self.assertEqual(rows[0]['last_activity_at'], self.topics[4].last_activity_at.isoformat().replace('+00:00', 'Z'))
+
+        rows = self.client.get(response.data['next']).data['results']
+        self.assertEqual([row['title'] for row in rows], ['Topic 1', 'Topic 0'])
+        last_reply = self.topics[0].comments.order_by('-created_at').first()
+        self.assertEqual(rows[1]['comment_count'], 3)
+        self.assertEqual(rows[1]['last_activity_at'], last_reply.created_at.isoformat().replace('+00:00', 'Z'))
+
+    def test_topic_detail_does_not_embed_comments(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/forum-topics/{self.topics[0].id}/')
+        self.assertNotIn('comments', response.data)
+        self.assertEqual(response.data['comment_count'], 3)
+        self.assertEqual(response.data['author_username'], 'poster')
+
+    def test_comments_are_paginated_per_topic(self):
+        url = f'/api/forum-topics/{self.topics[0].id}/comments/'
+        response = self.client.get(url, {'page_size': 2})
+        self.assertEqual([row['content'] for row in response.data['results']], ['Reply 0', 'Reply 1'])
+        rows = self.client.get(response.data['next']).data['results']
+        self.assertEqual([row['content'] for row in rows], ['Reply 2'])
+
+
+class ForumActivityTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('poster', email='poster@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.quiet = ForumTopic.objects.create(author=self.user, title='Quiet', content='-')
+        self.busy = ForumTopic.objects.create(author=self.user, title='Busy', content='-')
+        self.fresh = ForumTopic.objects.create(author=self.user, title='Fresh', content='-')
+
+    def test_counters_follow_comments(self):
+        first = ForumComment.objects.create(topic=self.busy, author=self.user, content='a')
+        second = ForumComment.objects.create(topic=self.busy, author=self.user, content='b')
+        self.busy.refresh_from_db()
+        self.assertEqual(self.busy.comment_count, 2)
+        self.assertEqual(self.busy.last_activity_at, second.created_at)
+        self.assertEqual(self.busy.hot_score, forum_hot_score(2, second.created_at))
+
+        second.delete()
+        self.busy.refresh_from_db()
+        self.assertEqual(self.busy.comment_count, 1)
+        self.assertEqual(self.busy.last_activity_at, first.created_at)
+
+        first.delete()
+        self.busy.refresh_from_db()
+        self.assertEqual(self.busy.comment_count, 0)
+        self.assertEqual(self.busy.last_activity_at, self.busy.created_at)
+
+    def test_sort_orders(self):
+        now = timezone.now()
+        ForumComment.objects.create(topic=self.quiet, author=self.user, content='-')
+        for _ in range(5):
+            ForumComment.objects.create(topic=self.busy, author=self.user, content='-')
+        # Busy: more comments, Quiet: the latest one
+        later = now + timedelta(minutes=5)
+        ForumTopic.objects.filter(pk=self.busy.pk).update(last_activity_at=now, hot_score=forum_hot_score(5, now))
+        ForumTopic.objects.filter(pk=self.quiet.pk).update(last_activity_at=later, hot_score=forum_hot_score(1, later))
+
+        def titles(sort):
+            with self.assertNumQueries(1):
+                response = self.client.get('/api/forum-topics/', {'sort': sort})
+            return [row['title'] for row in response.data['results']]
+
+        self.assertEqual(titles('new'), ['Fresh', 'Busy', 'Quiet'])
+        self.assertEqual(titles('active'), ['Quiet', 'Busy', 'Fresh'])
+        self.assertEqual(titles('hot'), ['Busy', 'Quiet', 'Fresh'])
+        self.assertEqual(titles('bogus'), titles('new'))
+
+    def test_hot_score_decays_by_recency(self):
+        now = timezone.now()
+        # A day newer outweighs ten times the comments
+        self.assertGreater(forum_hot_score(0, now + timedelta(days=1)), forum_hot_score(9, now))
+        self.assertGreater(forum_hot_score(9, now), forum_hot_score(0, now))
+
+    def test_deleting_topic_removes_its_comments(self):
+        ForumComment.objects.create(topic=self.busy, author=self.user, content='-')
+        self.busy.delete()
+        self.assertFalse(ForumComment.objects.exists())
+        self.quiet.refresh_from_db()
+        self.assertEqual(self.quiet.comment_count, 0)
@@ -1,20 +1,42 @@
 from django.shortcuts import get_object_or_404, render
 from rest_framework import viewsets, permissions, status
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
 from .models import ServiceOffer, ServiceRequest, TimeTransaction, InteractionRequest, Profile, ChatMessage, Review, Block, Notification, ForumTopic, ForumComment
 from .serializers import *
+from .settlement import settle_group_offer, settle_interaction
+from .interaction_states import apply_transition, InvalidTransition, TransitionConflict
+from .ledger import iter_statement
+from .pagination import ForumCommentCursorPagination, ForumTopicCursorPagination, ReviewCursorPagination, TransactionCursorPagination
+from .ratings import review_role, review_summary
+from .recommendations import recommend_offers
+from .reputation import reputation_summary
+from .search import search_listings
+from .tag_index import index as tag_index
+from .tagging import filter_by_tags, normalize_tag
+from . import profile_cache
 from django.contrib.auth import get_user_model
 from django.views.decorators.csrf import csrf_exempt
-from django.db.models import Q, Count, F
+from django.db import transaction
+from django.db.models import Q, F, Window
+from django.db.models.functions import RowNumber
+from django.http import StreamingHttpResponse
 from django.utils import timezone
 from datetime import timedelta
+import csv
 import json
 
 User = get_user_model()
 
 # Bu durumlar varsa ilan "DOLU" demektir ve listede gözükmemeli
 UNAVAILABLE_STATUSES = ['accepted', 'date_proposed', 'scheduled', 'completed']
+# Rows shown per list section of the profile page (the counts still cover everything)
+PROFILE_SECTION_LIMIT = 50
+# Upper bound for ?usernames= on the batch profile endpoint
+MAX_PROFILE_CARDS = 300
+MAX_RECOMMENDATIONS = 50
+TAG_AUTOCOMPLETE_LIMIT = 10
+MAX_TAG_AUTOCOMPLETE = 50
 
 # --- STANDART CRUD (FİLTRELİ) ---
 class ServiceOfferViewSet(viewsets.ModelViewSet):
@@ -23,23 +45,14 @@ class ServiceOfferViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         # Sadece "Müsait" olanları getir
-        # Grup offer'lar için (capacity > 1): Sadece tüm spotlar dolduğunda (accepted_count >= capacity) kaldır
-        # Normal offer'lar için (capacity = 1): Herhangi bir accepted interaction varsa kaldır
-        # Her iki durumda da completed status'ünde olan interaction'ları da kontrol et
-        
-        # Önce tüm offer'ları al ve accepted_count ekle
-        queryset = ServiceOffer.objects.filter(is_visible=True).annotate(
-            accepted_count=Count('interactions', filter=Q(interactions__status='accepted'))
-        )
-        
-        # Grup offer'ları (capacity > 1) ve normal offer'ları (capacity = 1) ayrı filtrele
-        # Grup offer: accepted_count >= capacity ise veya completed interaction varsa kaldır
-        # Normal offer: UNAVAILABLE_STATUSES'de interaction varsa kaldır
-        queryset = queryset.exclude(
-            Q(capacity__gt=1, accepted_count__gte=F('capacity')) |  # Grup offer: capacity doldu
-            Q(capacity__gt=1, interactions__status='completed') |  # Grup offer: completed interaction varsa
-            Q(capacity=1, interactions__status__in=UNAVAILABLE_STATUSES)  # Normal offer: UNAVAILABLE_STATUSES'de interaction varsa
-        ).distinct().order_by('-created_at')
+        # Boş yeri kalmayan (reserved_seats >= capacity) veya completed interaction'ı olan offer'ları kaldır.
+        # reserved_seats accept/decline/cancel sırasında atomik olarak güncellenir (interaction_states)
+        queryset = ServiceOffer.objects.filter(
+            is_visible=True,
+            reserved_seats__lt=F('capacity')
+        ).exclude(
+            interactions__status='completed'
+        ).order_by('-created_at')
         
         # Bloklama kontrolü
         if self.request.user.is_authenticated:
@@ -48,6 +61,13 @@ class ServiceOfferViewSet(viewsets.ModelViewSet):
             excluded_ids = list(blocked_user_ids) + list(blocking_user_ids)
             queryset = queryset.exclude(user_id__in=excluded_ids)
         
+        # Etiket filtreleri (?tag= / ?tags_any= / ?tags_all=)
+        queryset = filter_by_tags(queryset, self.request.query_params)
+
+        # Arama (?q=): doğrudan eşleşmeler önce, ilişkili etiketlerle genişletilmiş eşleşmeler sonra
+        query = self.request.query_params.get('q', '').strip()
+        if query:
+            queryset = search_listings(queryset, query)
         return queryset
 
     def get_serializer_context(self):
@@ -202,6 +222,13 @@ class ServiceRequestViewSet(viewsets.ModelViewSet):
             excluded_ids = list(blocked_user_ids) + list(blocking_user_ids)
             queryset = queryset.exclude(user_id__in=excluded_ids)
         
+        # Etiket filtreleri (?tag= / ?tags_any= / ?tags_all=)
+        queryset = filter_by_tags(queryset, self.request.query_params)
+
+        # Arama (?q=): doğrudan eşleşmeler önce, ilişkili etiketlerle genişletilmiş eşleşmeler sonra
+        query = self.request.query_params.get('q', '').strip()
+        if query:
+            queryset = search_listings(queryset, query)
         return queryset
 
     def get_serializer_context(self):
@@ -339,17 +366,57 @@ class ServiceRequestViewSet(viewsets.ModelViewSet):
         instance.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-class TimeTransactionViewSet(viewsets.ModelViewSet):
-    queryset = TimeTransaction.objects.all()
+class TimeTransactionViewSet(viewsets.ReadOnlyModelViewSet):
+    """Kullanıcının kendi hesap hareketleri (ledger sadece settlement tarafından yazılır)"""
     serializer_class = TimeTransactionSerializer
+    pagination_class = TransactionCursorPagination
 
     permission_classes = [permissions.IsAuthenticated]
 
+    def get_queryset(self):
+        user = self.request.user
+        return TimeTransaction.objects.filter(Q(sender=user) | Q(receiver=user)).order_by('-id')
+
+    @action(detail=False, methods=['get'])
+    def statement(self, request):
+        """Tüm geçmişi running balance ile CSV (varsayılan) veya NDJSON olarak stream et: ?output=csv|ndjson"""
+        output = request.query_params.get('output', 'csv')
+        rows = iter_statement(request.user)
+        if output == 'ndjson':
+            response = StreamingHttpResponse(
+                (json.dumps(row) + '\n' for row in rows),
+                content_type='application/x-ndjson'
+            )
+        elif output == 'csv':
+            response = StreamingHttpResponse(_csv_lines(rows, STATEMENT_FIELDS), content_type='text/csv')
+        else:
+            return Response({'error': 'output must be csv or ndjson'}, status=status.HTTP_400_BAD_REQUEST)
+        filename = f"statement-{request.user.username}.{output}"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+STATEMENT_FIELDS = ['id', 'created_at', 'direction', 'amount', 'counterparty', 'listing_type', 'listing_title', 'balance']
+
+
+class _LineBuffer:
+    """csv.writer hedefi: yazılan satırı biriktirmeden geri döndürür"""
+    def write(self, value):
+        return value
+
+
+def _csv_lines(rows, fields):
+    writer = csv.DictWriter(_LineBuffer(), fieldnames=fields)
+    yield writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
+
 # --- API ---
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def my_profile_api(request):
-    profile, _ = Profile.objects.get_or_create(user=request.user)
+    # Arayüz bunu sık sorgular: kullanıcı ve itibar metrikleri aynı sorguda gelir
+    profile, _ = Profile.objects.select_related('user__reputation').get_or_create(user=request.user)
     return Response(ProfileSerializer(profile).data)
 
 @api_view(['GET'])
@@ -583,15 +650,19 @@ def interaction_messages_api(request, interaction_id):
         
         # Mesaj atılınca etkileşim 'pending' ise ve alıcı yazdıysa kabul et
         if interaction.status == 'pending' and request.user == interaction.receiver:
-            interaction.status = 'accepted'
-            interaction.save()
-            # Bildirim oluştur
-            Notification.objects.create(
-                user=interaction.sender,
-                notification_type='interaction_accepted',
-                message=f"{interaction.receiver.username} accepted your interaction request",
-                interaction=interaction
-            )
+            try:
+                apply_transition(interaction, 'accept')
+            except (InvalidTransition, TransitionConflict):
+                # Başka bir istek zaten durumu değiştirdi ya da ilan doldu; mesaj yine de gönderildi
+                pass
+            else:
+                # Bildirim oluştur
+                Notification.objects.create(
+                    user=interaction.sender,
+                    notification_type='interaction_accepted',
+                    message=f"{interaction.receiver.username} accepted your interaction request",
+                    interaction=interaction
+                )
         else:
             if is_group_chat:
                 # Grup chat: Tüm grup üyelerine bildirim gönder
@@ -630,10 +701,21 @@ def interaction_action_api(request, interaction_id, action):
     user = request.user
     if user != i.sender and user != i.receiver: return Response({'error':'Auth'}, 403)
 
+    # Durum değişiklikleri interaction_states üzerinden koşullu UPDATE ile yapılır;
+    # aynı anda başka biri değiştirdiyse 409 döner
+    try:
+        with transaction.atomic():
+            return _apply_interaction_action(request, i, user, action)
+    except InvalidTransition as e:
+        return Response({'error': str(e), 'status': i.status}, status=status.HTTP_400_BAD_REQUEST)
+    except TransitionConflict as e:
+        return Response({'error': 'This interaction was updated by someone else. Please refresh and try again.',
+                         'status': e.interaction.status}, status=status.HTTP_409_CONFLICT)
+
+def _apply_interaction_action(request, i, user, action):
     if action in ['accept', 'decline']:
         if user != i.receiver: return Response({'error':'Unauthorized'},403)
-        i.status = 'accepted' if action=='accept' else 'declined'
-        i.save()
+        apply_transition(i, action)
         if action == 'accept':
             Notification.objects.create(
                 user=i.sender,
@@ -681,10 +763,21 @@ def interaction_action_api(request, interaction_id, action):
                             )
         return Response({'status': i.status})
 
+    elif action == 'cancel':
+        apply_transition(i, 'cancel')
+        other_user = i.receiver if user == i.sender else i.sender
+        Notification.objects.create(
+            user=other_user,
+            notification_type='message',
+            message=f"{user.username} cancelled the interaction",
+            interaction=i
+        )
+        return Response({'status': 'cancelled'})
+
     elif action == 'schedule':
         d = request.data.get('date')
         if not d: return Response({'error':'Date?'},400)
-        i.appointment_date = d; i.date_proposed_by = user; i.status = 'date_proposed'; i.save()
+        apply_transition(i, 'schedule', appointment_date=d, date_proposed_by=user)
         # Bildirim oluştur
         other_user = i.receiver if user == i.sender else i.sender
         Notification.objects.create(
@@ -698,12 +791,8 @@ def interaction_action_api(request, interaction_id, action):
     elif action == 'reject_date':
         if i.status != 'date_proposed': return Response({'error':'No date proposed'},400)
         if i.date_proposed_by == user: return Response({'error':'Cannot reject your own date'},400)
-        i.status = 'negotiating'
-        i.appointment_date = None
-        i.date_rejected_by = user
         proposed_by = i.date_proposed_by
-        i.date_proposed_by = None
-        i.save()
+        apply_transition(i, 'reject_date', appointment_date=None, date_rejected_by=user, date_proposed_by=None)
         # Bildirim oluştur
         Notification.objects.create(
             user=proposed_by,
@@ -715,7 +804,7 @@ def interaction_action_api(request, interaction_id, action):
 
     elif action == 'accept_date':
         if i.date_proposed_by == user: return Response({'error':'Wait other party'},400)
-        i.status = 'scheduled'; i.save()
+        apply_transition(i, 'accept_date')
         # Bildirim oluştur
         Notification.objects.create(
             user=i.date_proposed_by,
@@ -728,7 +817,7 @@ def interaction_action_api(request, interaction_id, action):
     elif action == 'complete':
         provider = i.receiver if i.offer else i.sender
         if user != provider: return Response({'error':'Only provider can complete'},403)
-        i.is_completed_by_provider = True; i.save()
+        apply_transition(i, 'complete', is_completed_by_provider=True)
         
         # Grup chat kontrolü
         is_group_chat = False
@@ -748,9 +837,7 @@ def interaction_action_api(request, interaction_id, action):
             )
             
             # Tüm grup interaction'larını is_completed_by_provider = True olarak işaretle
-            for group_i in group_interactions:
-                group_i.is_completed_by_provider = True
-                group_i.save()
+            group_interactions.update(is_completed_by_provider=True, version=F('version') + 1, updated_at=timezone.now())
             
             # Zaten completion card var mı kontrol et
             existing_card = ChatMessage.objects.filter(
@@ -862,7 +949,8 @@ def interaction_action_api(request, interaction_id, action):
                     continue
             
             if completion_card_msg:
-                # Completion card'ı güncelle
+                # Completion card'ı güncelle (aynı anda confirm eden katılımcılar birbirini ezmesin diye satırı kilitle)
+                completion_card_msg = ChatMessage.objects.select_for_update().get(pk=completion_card_msg.pk)
                 card_data = json.loads(completion_card_msg.content)
                 confirmed_list = card_data.get('confirmed', [])
                 
@@ -881,7 +969,7 @@ def interaction_action_api(request, interaction_id, action):
                 confirmed_list.append(user.username)
                 card_data['confirmed'] = confirmed_list
                 completion_card_msg.content = json.dumps(card_data)
-                completion_card_msg.save()
+                completion_card_msg.save(update_fields=['content'])
                 
                 # Tüm grup interaction'larındaki completion card'ları güncelle
                 for group_i in group_interactions:
@@ -892,7 +980,7 @@ def interaction_action_api(request, interaction_id, action):
                             if group_card_data.get('type') == 'completion_card' and group_card_data.get('offer_id') == i.offer.id:
                                 group_card_data['confirmed'] = confirmed_list
                                 group_msg.content = json.dumps(group_card_data)
-                                group_msg.save()
+                                group_msg.save(update_fields=['content'])
                                 break
                         except:
                             continue
@@ -902,37 +990,11 @@ def interaction_action_api(request, interaction_id, action):
                 confirmed = card_data.get('confirmed', [])
                 
                 if len(confirmed) >= len(participants):
-                    # Tüm katılımcılar confirm etti, her katılımcı için ayrı transfer yap
-                    prov_prof, _ = Profile.objects.get_or_create(user=provider)
-                    
-                    # Her katılımcı duration kadar öder
-                    for participant_username in participants:
-                        try:
-                            participant_user = User.objects.get(username=participant_username)
-                            cons_prof, _ = Profile.objects.get_or_create(user=participant_user)
-                            
-                            # Her katılımcı duration kadar öder
-                            cons_prof.balance -= duration
-                            cons_prof.save()
-                            
-                            # Her katılımcı için ayrı transaction kaydı
-                            TimeTransaction.objects.create(offer=i.offer, amount=duration)
-                        except User.DoesNotExist:
-                            continue
-                    
-                    # Provider sadece duration kadar alır (her katılımcıdan değil, toplam duration kadar)
-                    prov_prof.balance += duration
-                    prov_prof.save()
-                    
-                    # Provider toplam duration kadar alır
+                    # Tüm katılımcılar confirm etti: her katılımcı duration kadar öder,
+                    # provider toplam duration kadar alır (tek transaction içinde, toplu olarak)
+                    settle_group_offer(i.offer, provider, participants, group_interactions, duration)
                     total_duration = duration
                     
-                    # Tüm interaction'ları completed yap
-                    for group_i in group_interactions:
-                        group_i.is_confirmed_by_receiver = True
-                        group_i.status = 'completed'
-                        group_i.save()
-                    
                     # Bildirim gönder
                     Notification.objects.create(
                         user=provider,
@@ -948,17 +1010,9 @@ def interaction_action_api(request, interaction_id, action):
             else:
                 return Response({'error':'Completion card not found'}, 400)
         else:
-            # Normal 1-1 chat
-            cons_prof, _ = Profile.objects.get_or_create(user=consumer)
-            prov_prof, _ = Profile.objects.get_or_create(user=provider)
-            
-            cons_prof.balance -= duration
-            cons_prof.save()
-            prov_prof.balance += duration
-            prov_prof.save()
-            
-            TimeTransaction.objects.create(offer=i.offer, request=i.service_request, amount=duration)
-            i.is_confirmed_by_receiver = True; i.status = 'completed'; i.save()
+            # Normal 1-1 chat: önce durumu koşullu olarak completed yap, sonra transfer (aynı transaction)
+            apply_transition(i, 'confirm', is_confirmed_by_receiver=True)
+            settle_interaction(i, consumer, provider, duration)
             
             # Bildirim oluştur
             Notification.objects.create(
@@ -999,20 +1053,9 @@ def create_interaction_api(request):
             return Response({'error': 'You have already contacted this service provider. Check your inbox for the conversation.'}, 400)
         
         # Eğer bu ilan zaten DOLU ise başvurdurma!
-        # Grup offer'lar için (capacity > 1): Sadece tüm spotlar dolduğunda (accepted_count >= capacity) DOLU
-        # Normal offer'lar için (capacity = 1): Herhangi bir accepted interaction varsa DOLU
-        if offer.capacity > 1:
-            # Grup offer: accepted_count >= capacity ise DOLU
-            accepted_count = InteractionRequest.objects.filter(
-                offer=offer, 
-                status='accepted'
-            ).count()
-            if accepted_count >= offer.capacity:
-                return Response({'error':'This offer is no longer available.'}, 400)
-        else:
-            # Normal offer: accepted interaction varsa DOLU
-            if InteractionRequest.objects.filter(offer=offer, status__in=UNAVAILABLE_STATUSES).exists():
-                return Response({'error':'This offer is no longer available.'}, 400)
+        # Kesin kontrol accept sırasında yapılır (koşullu UPDATE ile yer ayırma); burası sadece erken uyarı
+        if offer.reserved_seats >= offer.capacity:
+            return Response({'error':'This offer is no longer available.'}, 400)
 
         buyer_p, _ = Profile.objects.get_or_create(user=request.user)
         if buyer_p.balance < offer.duration: return Response({'error': f'Insufficient balance!'},400)
@@ -1093,166 +1136,132 @@ def register_api(request):
         return Response({'success': True})
     except Exception as e: return Response({'error': str(e)}, status=400)
 
-def profile_view(request, username):
-    """Profil sayfası - Kullanıcının bilgilerini, ilanlarını ve yorumlarını göster"""
-    try:
-        user = User.objects.get(username=username)
-        profile = user.profile
-        
-        # Aktif ilanlar (sadece bu kullanıcının ilanları, is_visible=True ve UNAVAILABLE_STATUSES'de olmayan interaction'ı olmayanlar)
-        active_offers = ServiceOffer.objects.filter(
-            user=user, 
-            is_visible=True
-        ).exclude(
-            interactions__status__in=UNAVAILABLE_STATUSES
-        ).distinct().order_by('-created_at')
-        
-        active_requests = ServiceRequest.objects.filter(
-            user=user, 
+def _listing_card(listing, listing_type):
+    return {
+        'id': listing.id,
+        'title': listing.title,
+        'description': listing.description,
+        'category': listing.category,
+        'duration': listing.duration,
+        'type': listing_type,
+        'created_at': listing.created_at,
+        'is_online': listing.is_online,
+        'image_url': listing.image.url if listing.image else None,
+    }
+
+
+def _active_listings(user):
+    """Profil: aktif ilanlar (is_visible=True ve UNAVAILABLE_STATUSES'de interaction'ı olmayanlar)"""
+    active_listings = []
+    for model, listing_type in ((ServiceOffer, 'offer'), (ServiceRequest, 'request')):
+        listings = model.objects.filter(
+            user=user,
             is_visible=True
         ).exclude(
             interactions__status__in=UNAVAILABLE_STATUSES
         ).distinct().order_by('-created_at')
+        for listing in listings:
+            card = _listing_card(listing, listing_type)
+            card['address'] = listing.address or ''
+            card['user_username'] = user.username
+            active_listings.append(card)
+    active_listings.sort(key=lambda x: x['created_at'], reverse=True)
+    return active_listings
+
+
+def _completed_services(user):
+    """Profil: bu kullanıcının oluşturduğu ilanların completed interaction'ları (ilan başına en yenisi)
+
+    The per-listing deduplication runs in SQL with ROW_NUMBER() over each listing, so only
+    PROFILE_SECTION_LIMIT rows are loaded however many interactions were completed.
+    """
+    completed = InteractionRequest.objects.filter(
+        Q(sender=user) | Q(receiver=user),
+        Q(offer__user=user) | Q(service_request__user=user),
+        status='completed',
+    )
+    latest = completed.annotate(
+        listing_rank=Window(
+            RowNumber(),
+            partition_by=[F('offer_id'), F('service_request_id')],
+            order_by=[F('created_at').desc(), F('id').desc()],
+        )
+    ).filter(listing_rank=1).select_related('offer', 'service_request', 'sender', 'receiver').order_by('-created_at', '-id')
+
+    completed_services = []
+    for interaction in latest[:PROFILE_SECTION_LIMIT]:
+        if interaction.offer_id:
+            card = _listing_card(interaction.offer, 'offer')
+        else:
+            card = _listing_card(interaction.service_request, 'request')
+        other_user = interaction.receiver if interaction.sender_id == user.id else interaction.sender
+        card['completed_at'] = interaction.created_at
+        card['other_user'] = other_user.username
+        card['other_user_id'] = other_user.id
+        completed_services.append(card)
+    count = completed.values('offer_id', 'service_request_id').distinct().count()
+    return {'items': completed_services, 'count': count}
+
+
+def _received_reviews(user):
+    """Profil: alınan yorumların en yenileri, provider / consumer olarak ayrılmış
+
+    The role is classified in SQL (ratings.review_role) and each role is a limited query;
+    counts and averages come from the totals stored on Profile.
+    """
+    reviews_received = Review.objects.filter(target_user=user).annotate(role=review_role()).select_related(
+        'reviewer', 'offer', 'service_request'
+    ).order_by('-created_at', '-id')
+
+    sections = {}
+    for role in ('provider', 'consumer'):
+        sections[role] = [{
+            'reviewer': {'username': review.reviewer.username},
+            'rating': review.rating,
+            'comment': review.comment,
+            'created_at': review.created_at,
+            'offer': {'title': review.offer.title} if review.offer else None,
+            'service_request': {'title': review.service_request.title} if review.service_request else None,
+        } for review in reviews_received.filter(role=role)[:PROFILE_SECTION_LIMIT]]
+    return sections
+
+
+def profile_view(request, username):
+    """Profil sayfası - Kullanıcının bilgilerini, ilanlarını ve yorumlarını göster
+
+    Her bölüm profile_cache ile ayrı ayrı cache'lenir; sadece değişen bölüm yeniden hesaplanır.
+    """
+    try:
+        user = User.objects.select_related('profile', 'reputation').get(username=username)
+        profile = user.profile
         
-        # Aktif ilanları birleştir
-        active_listings = []
-        for offer in active_offers:
-            active_listings.append({
-                'id': offer.id,
-                'title': offer.title,
-                'description': offer.description,
-                'category': offer.category,
-                'duration': offer.duration,
-                'type': 'offer',
-                'created_at': offer.created_at,
-                'is_online': offer.is_online,
-                'image_url': offer.image.url if offer.image else None,
-                'address': offer.address or '',
-                'user_username': offer.user.username,
-            })
-        for req in active_requests:
-            active_listings.append({
-                'id': req.id,
-                'title': req.title,
-                'description': req.description,
-                'category': req.category,
-                'duration': req.duration,
-                'type': 'request',
-                'created_at': req.created_at,
-                'is_online': req.is_online,
-                'image_url': req.image.url if req.image else None,
-                'address': req.address or '',
-                'user_username': req.user.username,
-            })
-        active_listings.sort(key=lambda x: x['created_at'], reverse=True)
-        
-        # Tamamlanan hizmetler (sadece bu kullanıcının ilanlarının completed interaction'ları)
-        # Kullanıcının oluşturduğu ilanların completed interaction'larını göster
-        completed_interactions = InteractionRequest.objects.filter(
-            Q(sender=user) | Q(receiver=user),
-            status='completed'
-        ).select_related('offer', 'service_request', 'sender', 'receiver').order_by('-created_at')
-        
-        completed_services = []
-        seen_listings = set()  # Duplicate'leri önlemek için
-        
-        for interaction in completed_interactions:
-            # Sadece bu kullanıcının oluşturduğu ilanları göster
-            if interaction.offer and interaction.offer.user == user:
-                listing = interaction.offer
-                other_user = interaction.receiver if interaction.sender == user else interaction.sender
-                listing_key = f"offer_{listing.id}"
-                if listing_key not in seen_listings:
-                    seen_listings.add(listing_key)
-                    completed_services.append({
-                        'id': listing.id,
-                        'title': listing.title,
-                        'description': listing.description,
-                        'category': listing.category,
-                        'duration': listing.duration,
-                        'type': 'offer',
-                        'created_at': listing.created_at,
-                        'completed_at': interaction.created_at,
-                        'is_online': listing.is_online,
-                        'image_url': listing.image.url if listing.image else None,
-                        'other_user': other_user.username,
-                        'other_user_id': other_user.id,
-                    })
-            elif interaction.service_request and interaction.service_request.user == user:
-                listing = interaction.service_request
-                other_user = interaction.receiver if interaction.sender == user else interaction.sender
-                listing_key = f"request_{listing.id}"
-                if listing_key not in seen_listings:
-                    seen_listings.add(listing_key)
-                    completed_services.append({
-                        'id': listing.id,
-                        'title': listing.title,
-                        'description': listing.description,
-                        'category': listing.category,
-                        'duration': listing.duration,
-                        'type': 'request',
-                        'created_at': listing.created_at,
-                        'completed_at': interaction.created_at,
-                        'is_online': listing.is_online,
-                        'image_url': listing.image.url if listing.image else None,
-                        'other_user': other_user.username,
-                        'other_user_id': other_user.id,
-                    })
-        completed_services.sort(key=lambda x: x['completed_at'], reverse=True)
-        
-        # Kullanıcının aldığı yorumları getir (başkalarından aldığı)
-        reviews_received = Review.objects.filter(target_user=user).select_related('reviewer', 'offer', 'service_request').order_by('-created_at')
-        
-        # Provider ve Consumer reviewlarını ayır
-        reviews_as_provider = []
-        reviews_as_consumer = []
-        
-        for review in reviews_received:
-            is_provider = False
-            if review.offer:
-                is_provider = (review.offer.user == user)
-            elif review.service_request:
-                is_provider = (review.service_request.user != user)
-            
-            if is_provider:
-                reviews_as_provider.append(review)
-            else:
-                reviews_as_consumer.append(review)
-        
-        # İstatistikler
-        provider_count = len(reviews_as_provider)
-        consumer_count = len(reviews_as_consumer)
-        provider_avg = sum(r.rating for r in reviews_as_provider) / provider_count if provider_count > 0 else 0
-        consumer_avg = sum(r.rating for r in reviews_as_consumer) / consumer_count if consumer_count > 0 else 0
-        
-        # Kullanıcının verdiği yorumları getir (başkalarına verdiği)
-        reviews_given = Review.objects.filter(reviewer=user).select_related('target_user', 'offer', 'service_request').order_by('-created_at')
-        
-        # Toplam reviews sayısı - sadece alınan reviewlar (provider + consumer)
-        total_reviews_count = provider_count + consumer_count
+        active_listings = profile_cache.cached_section(profile, 'listings', lambda: _active_listings(user))
+        completed = profile_cache.cached_section(profile, 'completed', lambda: _completed_services(user))
+        completed_services = completed['items']
+        received = profile_cache.cached_section(profile, 'reviews', lambda: _received_reviews(user))
+        reviews_as_provider = received['provider']
+        reviews_as_consumer = received['consumer']
         
-        # Ortalama puan hesapla
-        average_rating = profile.average_rating
-        active_count = len(active_listings)
-        completed_count = len(completed_services)
+        # İstatistikler - Profile üzerinde tutulan toplamlardan, ek sorgu yok
+        provider_count = profile.provider_rating_count
+        consumer_count = profile.consumer_rating_count
         
         context = {
             'profile_user': user,
             'profile': profile,
             'active_listings': active_listings,
             'completed_services': completed_services,
-            'reviews_received': reviews_received,
             'reviews_as_provider': reviews_as_provider,
             'reviews_as_consumer': reviews_as_consumer,
             'provider_count': provider_count,
             'consumer_count': consumer_count,
-            'provider_avg': round(provider_avg, 1),
-            'consumer_avg': round(consumer_avg, 1),
-            'reviews_given': reviews_given,
-            'total_reviews_count': total_reviews_count,
-            'average_rating': average_rating,
-            'active_count': active_count,
-            'completed_count': completed_count,
+            'provider_avg': round(profile.provider_average_rating, 1),
+            'consumer_avg': round(profile.consumer_average_rating, 1),
+            'total_reviews_count': profile.review_count,
+            'average_rating': profile.average_rating,
+            'active_count': len(active_listings),
+            'completed_count': completed['count'],
+            'reputation': reputation_summary(user),
             'is_own_profile': request.user.is_authenticated and request.user == user,
         }
         return render(request, 'market/profile.html', context)
@@ -1269,7 +1278,7 @@ def profile_page(request, username):
 def edit_profile_api(request):
     """Kullanıcının profilini güncelle (avatar, bio, location)"""
     try:
-        profile = request.user.profile
+        profile = Profile.objects.select_related('user__reputation').get(user=request.user)
         serializer = ProfileSerializer(profile, data=request.data, partial=True, context={'request': request})
         if serializer.is_valid():
             serializer.save()
@@ -1368,7 +1377,7 @@ def add_review_api(request, username):
 def profile_by_username_api(request, username):
     """Kullanıcı profilini username ile getir"""
     try:
-        user = User.objects.get(username=username)
+        user = User.objects.select_related('profile', 'reputation').get(username=username)
         profile = user.profile
         serializer = ProfileSerializer(profile, context={'request': request})
         return Response(serializer.data)
@@ -1376,6 +1385,51 @@ def profile_by_username_api(request, username):
         return Response({'status': 'error', 'message': 'User not found'}, 
                        status=status.HTTP_404_NOT_FOUND)
 
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def profile_cards_api(request):
+    """Birden fazla kullanıcının kısa profil kartları: ?usernames=a,b,c (sırası korunur)"""
+    usernames = list(dict.fromkeys(name.strip() for name in request.query_params.get('usernames', '').split(',') if name.strip()))
+    if not usernames:
+        return Response({'status': 'error', 'message': 'usernames is required'},
+                       status=status.HTTP_400_BAD_REQUEST)
+    if len(usernames) > MAX_PROFILE_CARDS:
+        return Response({'status': 'error', 'message': f'At most {MAX_PROFILE_CARDS} usernames per request'},
+                       status=status.HTTP_400_BAD_REQUEST)
+    
+    cards = profile_cache.profile_cards(usernames)
+    results = []
+    for username in usernames:
+        card = cards.get(username)
+        if card is None:
+            continue
+        card = dict(card)
+        if card['avatar_url']:
+            card['avatar_url'] = request.build_absolute_uri(card['avatar_url'])
+        results.append(card)
+    return Response({
+        'results': results,
+        'missing': [username for username in usernames if username not in cards],
+    })
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def recommended_offers_api(request):
+    """Kullanıcının ilgi alanlarına göre önerilen teklifler (?limit=, en fazla MAX_RECOMMENDATIONS)"""
+    try:
+        limit = min(int(request.query_params.get('limit', 10)), MAX_RECOMMENDATIONS)
+    except ValueError:
+        return Response({'status': 'error', 'message': 'limit must be a number'},
+                       status=status.HTTP_400_BAD_REQUEST)
+    
+    scores = dict(recommend_offers(request.user, limit=max(limit, 1)))
+    offers = ServiceOffer.objects.filter(id__in=scores).select_related('user')
+    offers = sorted(offers, key=lambda offer: (-scores[offer.id], -offer.id))
+    data = ServiceOfferSerializer(offers, many=True, context={'request': request}).data
+    for item in data:
+        item['score'] = round(scores[item['id']], 4)
+    return Response({'results': data})
+
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def user_listings_api(request, username):
@@ -1432,12 +1486,19 @@ def user_history_api(request, username):
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def user_reviews_api(request, username):
-    """Kullanıcının aldığı yorumları getir"""
+    """Kullanıcının aldığı yorumları getir (cursor pagination, ?summary=1 ile puan dağılımı)"""
     try:
         user = User.objects.get(username=username)
-        reviews = Review.objects.filter(target_user=user).order_by('-created_at')
-        serializer = ReviewSerializer(reviews, many=True, context={'request': request})
-        return Response(serializer.data)
+        reviews = Review.objects.filter(target_user=user)
+        paginator = ReviewCursorPagination()
+        page = paginator.paginate_queryset(
+            reviews.select_related('reviewer', 'target_user', 'offer', 'service_request'), request
+        )
+        serializer = ReviewSerializer(page, many=True, context={'request': request})
+        response = paginator.get_paginated_response(serializer.data)
+        if request.query_params.get('summary') in ('1', 'true'):
+            response.data['summary'] = review_summary(reviews)
+        return response
     except User.DoesNotExist:
         return Response({'status': 'error', 'message': 'User not found'}, 
                        status=status.HTTP_404_NOT_FOUND)
@@ -1535,9 +1596,10 @@ def delete_conversation_api(request, interaction_id):
         
         if request.user == interaction.sender:
             interaction.deleted_by_sender = True
+            interaction.save(update_fields=['deleted_by_sender'])
         else:
             interaction.deleted_by_receiver = True
-        interaction.save()
+            interaction.save(update_fields=['deleted_by_receiver'])
         
         return Response({'status': 'success', 'message': 'Conversation deleted'})
     except InteractionRequest.DoesNotExist:
@@ -1573,9 +1635,12 @@ def delete_message_api(request, message_id):
 @permission_classes([permissions.IsAuthenticated])
 def forum_topics_api(request):
     if request.method == 'GET':
-        topics = ForumTopic.objects.all().select_related('author').prefetch_related('comments')
-        serializer = ForumTopicSerializer(topics, many=True, context={'request': request})
-        return Response(serializer.data)
+        # Yorumlar gömülmez; sayaçlar konu satırında tutulur, her sıralama tek indeksli okumadır (yorumlar: forum_comments_api)
+        topics = ForumTopic.objects.select_related('author')
+        paginator = ForumTopicCursorPagination()
+        page = paginator.paginate_queryset(topics, request)
+        serializer = ForumTopicListSerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
     
     elif request.method == 'POST':
         serializer = ForumTopicSerializer(data=request.data, context={'request': request})
@@ -1588,9 +1653,10 @@ def forum_topics_api(request):
 @permission_classes([permissions.IsAuthenticated])
 def forum_topic_detail_api(request, topic_id):
     try:
-        topic = ForumTopic.objects.get(id=topic_id)
+        topic = ForumTopic.objects.select_related('author').get(id=topic_id)
         if request.method == 'GET':
-            serializer = ForumTopicSerializer(topic, context={'request': request})
+            # Yorumlar gömülmez; sayfalı olarak forum_comments_api'den okunur
+            serializer = ForumTopicListSerializer(topic, context={'request': request})
             return Response(serializer.data)
         elif request.method == 'DELETE':
             # Sadece kendi topic'ini silebilir veya superuser ise
@@ -1610,9 +1676,10 @@ def forum_comments_api(request, topic_id):
         return Response({'error': 'Topic not found'}, status=status.HTTP_404_NOT_FOUND)
     
     if request.method == 'GET':
-        comments = topic.comments.all().select_related('author')
-        serializer = ForumCommentSerializer(comments, many=True, context={'request': request})
-        return Response(serializer.data)
+        paginator = ForumCommentCursorPagination()
+        page = paginator.paginate_queryset(topic.comments.select_related('author'), request)
+        serializer = ForumCommentSerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
     
     elif request.method == 'POST':
         serializer = ForumCommentSerializer(data=request.data, context={'request': request})
@@ -1671,6 +1738,22 @@ def admin_dashboard_stats_api(request):
         'recent_activity': recent_activity
     })
 
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def tag_autocomplete_api(request):
+    """Üyelerin kullandığı etiketlerden ?prefix= ile başlayanlar, en çok kullanılan önce (bellekten)"""
+    prefix = normalize_tag(request.GET.get('prefix', ''))
+    if not prefix:
+        return Response({'tags': []}, status=status.HTTP_200_OK)
+    try:
+        limit = min(max(int(request.GET.get('limit', TAG_AUTOCOMPLETE_LIMIT)), 1), MAX_TAG_AUTOCOMPLETE)
+    except ValueError:
+        limit = TAG_AUTOCOMPLETE_LIMIT
+
+    tags = [{'name': name, 'usage_count': count} for name, count in tag_index.complete(prefix, limit)]
+    return Response({'tags': tags}, status=status.HTTP_200_OK)
+
+
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def wikidata_tags_api(request):
@@ -1686,3 +1769,12 @@ def wikidata_tags_api(request):
         return Response({'tags': tags}, status=status.HTTP_200_OK)
     except Exception as e:
         return Response({'error': str(e), 'tags': []}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def wikidata_status_api(request):
+    """Wikidata circuit breaker state and lookup counters of this worker process"""
+    from .wikidata_client import status as wikidata_status
+
+    return Response(wikidata_status(), status=status.HTTP_200_OK)
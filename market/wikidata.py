@@ -1,64 +1,71 @@
 """
 Wikidata integration for semantic tagging
+
+candidate_entities / fetch_related_tags talk to Wikidata through the pooled
+client (market.wikidata_client) and raise on errors; get_entity_ids /
+get_related_tags answer through wikidata_cache. get_wikidata_suggestions answers
+from the locally loaded taxonomy (market.taxonomy) when it knows the term, and
+otherwise (unless WIKIDATA_LIVE_FALLBACK is off) merges the neighbourhoods of the
+best few live candidates, fetched concurrently under one deadline.
 """
-import requests
 from django.conf import settings
 
-# Configuration
-SEARCH_API_URL = "https://www.wikidata.org/w/api.php"
-SPARQL_API_URL = "https://query.wikidata.org/sparql"
-USER_AGENT = "TimeBankApp/1.0 (community-timebank)"
+from .taxonomy import is_tag_label, local_suggestions
+from .wikidata_cache import cached_lookup, cached_lookup_many, normalize_term
+from .wikidata_client import get_client
 
+# Candidate entities whose neighbourhoods are merged into the suggestions
+MAX_CANDIDATES = 3
+MAX_SUGGESTIONS = 20
 
-def get_entity_id(search_term):
-    """Get Wikidata entity ID from search term"""
-    params = {
-        "action": "wbsearchentities",
-        "search": search_term,
-        "language": "en",
-        "format": "json",
-        "type": "item",
-        "limit": 5
-    }
-    headers = {"User-Agent": USER_AGENT}
-    try:
-        response = requests.get(SEARCH_API_URL, params=params, headers=headers, timeout=5)
-        response.raise_for_status()
-        data = response.json()
-        if data.get("search"):
-            skip_keywords = ['database', 'website', 'software', 'company', 'organization', 
-                           'web service', 'online', 'application', 'platform', 'record label',
-                           'brand', 'corporation', 'enterprise', 'firm', 'business']
-            for match in data["search"]:
-                description = match.get('description', '').lower()
-                label = match.get('label', '').lower()
-                search_lower = search_term.lower()
-                
-                skip_descriptions = skip_keywords + ['video game', 'film', 'movie', 'album', 'song', 
-                                                    'television', 'TV series', 'band', 'musical']
-                if any(keyword in description for keyword in skip_descriptions):
-                    continue
-                
-                if label == search_lower:
-                    return match["id"]
-                
-                label_words = label.split()
-                search_words = search_lower.split()
-                if len(search_words) == 1 and len(label_words) > 1:
-                    continue
-                
-                if search_lower in label:
-                    return match["id"]
-            
-            best_match = data["search"][0]
-            return best_match["id"]
-        return None
-    except Exception as e:
-        print(f"Error connecting to Search API: {e}")
-        return None
+SKIP_KEYWORDS = ['database', 'website', 'software', 'company', 'organization',
+                 'web service', 'online', 'application', 'platform', 'record label',
+                 'brand', 'corporation', 'enterprise', 'firm', 'business']
+SKIP_DESCRIPTIONS = SKIP_KEYWORDS + ['video game', 'film', 'movie', 'album', 'song',
+                                     'television', 'TV series', 'band', 'musical']
 
 
-def get_related_tags(entity_id):
+def rank_matches(search_term, matches):
+    """Entity ids of search matches, best first: exact label, then label containing the term, then the rest"""
+    search_lower = search_term.lower()
+    exact, partial, rest = [], [], []
+    for match in matches:
+        description = match.get('description', '').lower()
+        label = match.get('label', '').lower()
+        if any(keyword in description for keyword in SKIP_DESCRIPTIONS):
+            rest.append(match["id"])
+            continue
+
+        if label == search_lower:
+            exact.append(match["id"])
+            continue
+
+        label_words = label.split()
+        search_words = search_lower.split()
+        if len(search_words) == 1 and len(label_words) > 1:
+            rest.append(match["id"])
+            continue
+
+        if search_lower in label:
+            partial.append(match["id"])
+        else:
+            rest.append(match["id"])
+    return exact + partial + rest
+
+
+def candidate_entities(search_term, deadline=None):
+    """Wikidata entity ids matching search term, best first ([] if nothing matches)"""
+    matches = get_client().search(search_term, limit=5, deadline=deadline)
+    return rank_matches(search_term, matches)[:MAX_CANDIDATES]
+
+
+def search_entity(search_term, deadline=None):
+    """Get Wikidata entity ID from search term (None if nothing matches)"""
+    candidates = candidate_entities(search_term, deadline)
+    return candidates[0] if candidates else None
+
+
+def fetch_related_tags(entity_id, deadline=None):
     """Get related tags from Wikidata using SPARQL"""
     sparql_query = f"""
     SELECT DISTINCT ?itemLabel WHERE {{
@@ -75,33 +82,66 @@ def get_related_tags(entity_id):
     }}
     LIMIT 20
     """
-    params = {"query": sparql_query, "format": "json"}
-    headers = {"User-Agent": USER_AGENT}
-    try:
-        response = requests.get(SPARQL_API_URL, params=params, headers=headers, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        results = []
-        for result in data["results"]["bindings"]:
-            label = result["itemLabel"]["value"]
-            if label.startswith('Q') and label[1:].isdigit(): continue
-            if label.startswith('L') and '-' in label: continue
-            if label.isdigit(): continue
-            if len(label) <= 2: continue
+    results = []
+    for result in get_client().sparql(sparql_query, deadline=deadline):
+        label = result["itemLabel"]["value"]
+        if is_tag_label(label):
             results.append(label)
-        return results
-    except Exception as e:
-        print(f"Error: {e}")
-        return []
+    return results
+
+
+def get_entity_ids(search_term, deadline=None):
+    """Candidate entity ids for a search term (cached)"""
+    return cached_lookup(
+        'entity', normalize_term(search_term),
+        lambda term: candidate_entities(term, deadline), default=[],
+        refresh=candidate_entities,
+    )
+
+
+def get_entity_id(search_term):
+    """Get Wikidata entity ID from search term (cached)"""
+    ids = get_entity_ids(search_term)
+    return ids[0] if ids else None
+
+
+def get_related_tags(entity_id):
+    """Get related tags of an entity (cached)"""
+    return cached_lookup('related', entity_id, fetch_related_tags, default=[])
+
+
+def get_related_tags_many(entity_ids, deadline=None):
+    """{entity id: related tags}; cache misses are fetched concurrently within deadline"""
+    client = get_client()
+    deadline = deadline or client.deadline()
+    return cached_lookup_many(
+        'related', entity_ids,
+        lambda keys: client.map(fetch_related_tags, keys, deadline),
+        refresh=fetch_related_tags, default=[],
+    )
 
 
 def get_wikidata_suggestions(query):
     """Get Wikidata tag suggestions for a search query"""
     if not query or len(query.strip()) < 2:
         return []
-    
-    q_id = get_entity_id(query.strip())
-    if q_id:
-        return get_related_tags(q_id)
-    return []
 
+    local = local_suggestions(query, MAX_SUGGESTIONS)
+    if local is not None or not getattr(settings, 'WIKIDATA_LIVE_FALLBACK', True):
+        return local or []
+
+    # One budget for the whole lookup: the search and every SPARQL query share it
+    deadline = get_client().deadline()
+    entity_ids = get_entity_ids(query.strip(), deadline)
+    if not entity_ids:
+        return []
+    related = get_related_tags_many(entity_ids, deadline)
+
+    suggestions = []
+    seen = set()
+    for entity_id in entity_ids:
+        for label in related.get(entity_id) or ():
+            if label.lower() not in seen:
+                seen.add(label.lower())
+                suggestions.append(label)
+    return suggestions[:MAX_SUGGESTIONS]
@@ -0,0 +1,209 @@
+"""
+Two-tier cache for Wikidata lookups: an in-process LRU in front of the
+WikidataCacheEntry table.
+
+Entries are keyed by (kind, key), where kind is 'entity' (normalized search term
+-> candidate entity ids), 'related' (entity id -> related tag labels) or 'term'
+(listing key term -> entity id, see market.enrichment). "Nothing found"
+answers are cached too, with a shorter TTL. An entry past its TTL but still inside
+the stale window is returned immediately while one background thread refreshes
+it, so repeat lookups never wait for Wikidata. Upstream errors are never cached;
+a stale value is served instead when there is one. Failures are tallied in
+wikidata_client.counters ('lookup_failures', 'stale_served', 'empty_served',
+'refresh_failures') rather than logged one by one.
+"""
+import logging
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import WikidataCacheEntry
+from .wikidata_client import counters
+
+logger = logging.getLogger(__name__)
+
+POSITIVE_TTL = timedelta(days=7)
+NEGATIVE_TTL = timedelta(hours=6)
+# How long past the TTL an entry may still be served while it is refreshed
+STALE_WINDOW = timedelta(days=30)
+LRU_SIZE = 2048
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe bounded mapping of key -> (value, is_negative, fetched_at)"""
+
+    def __init__(self, maxsize=LRU_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._data[key] = entry
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+lru = LRUCache()
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+_refresh_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='wikidata-refresh')
+
+
+def normalize_term(term):
+    return re.sub(r'\s+', ' ', term.strip().lower())[:200]
+
+
+def _age_state(is_negative, fetched_at, now):
+    """'fresh', 'stale' or 'expired'"""
+    ttl = NEGATIVE_TTL if is_negative else POSITIVE_TTL
+    age = now - fetched_at
+    if age <= ttl:
+        return 'fresh'
+    if age <= ttl + STALE_WINDOW:
+        return 'stale'
+    return 'expired'
+
+
+def _store(kind, key, value, is_negative):
+    fetched_at = timezone.now()
+    lru.set((kind, key), (value, is_negative, fetched_at))
+    WikidataCacheEntry.objects.update_or_create(
+        kind=kind, key=key, defaults={'value': value, 'is_negative': is_negative, 'fetched_at': fetched_at},
+    )
+
+
+def _fetch_and_store(kind, key, fetch, is_empty):
+    value = fetch(key)
+    _store(kind, key, value, is_empty(value))
+    return value
+
+
+def _refresh(kind, key, fetch, is_empty):
+    try:
+        _fetch_and_store(kind, key, fetch, is_empty)
+    except Exception as e:
+        counters.incr('refresh_failures')
+        logger.debug("Wikidata refresh of %s:%s failed: %s", kind, key, e)
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard((kind, key))
+        close_old_connections()
+
+
+def schedule_refresh(kind, key, fetch, is_empty):
+    """Refresh one entry in the background, at most once at a time per entry"""
+    with _refreshing_lock:
+        if (kind, key) in _refreshing:
+            return
+        _refreshing.add((kind, key))
+    _refresh_pool.submit(_refresh, kind, key, fetch, is_empty)
+
+
+def _cached_entries(kind, keys):
+    """{key: entry} from the LRU, falling back to one table query for the rest"""
+    entries = {}
+    missing = []
+    for key in keys:
+        entry = lru.get((kind, key))
+        if entry is None:
+            missing.append(key)
+        else:
+            entries[key] = entry
+    if missing:
+        rows = WikidataCacheEntry.objects.filter(kind=kind, key__in=missing).values_list('key', 'value', 'is_negative', 'fetched_at')
+        for key, *entry in rows:
+            entries[key] = tuple(entry)
+            lru.set((kind, key), entries[key])
+    return entries
+
+
+def _split(kind, keys, refresh, is_empty):
+    """Answer keys from the cache: ({key: value}, {key: stale value or _MISSING} to fetch now)"""
+    now = timezone.now()
+    answers = {}
+    to_fetch = {}
+    entries = _cached_entries(kind, keys)
+    for key in keys:
+        entry = entries.get(key)
+        if entry is None:
+            to_fetch[key] = _MISSING
+            continue
+        value, is_negative, fetched_at = entry
+        state = _age_state(is_negative, fetched_at, now)
+        if state == 'stale':
+            schedule_refresh(kind, key, refresh, is_empty)
+        if state == 'expired':
+            to_fetch[key] = value
+        else:
+            answers[key] = value
+    return answers, to_fetch
+
+
+def _fallback(kind, key, stale_value, default, error):
+    """Answer for a key whose lookup failed: its stale value if there is one, otherwise default"""
+    counters.incr('lookup_failures')
+    logger.debug("Wikidata lookup of %s:%s failed: %s", kind, key, error)
+    if stale_value is _MISSING:
+        counters.incr('empty_served')
+        return default
+    counters.incr('stale_served')
+    return stale_value
+
+
+def cached_lookup(kind, key, fetch, default, is_empty=lambda value: not value, refresh=None):
+    """Return the cached answer for (kind, key), calling fetch(key) only on a miss.
+
+    fetch raises on upstream errors; then a stale value is returned if one exists,
+    otherwise default. Background refreshes call refresh(key) (default: fetch).
+    """
+    answers, to_fetch = _split(kind, [key], refresh or fetch, is_empty)
+    if key in answers:
+        return answers[key]
+
+    try:
+        return _fetch_and_store(kind, key, fetch, is_empty)
+    except Exception as e:
+        return _fallback(kind, key, to_fetch[key], default, e)
+
+
+def cached_lookup_many(kind, keys, fetch_many, refresh, default, is_empty=lambda value: not value):
+    """{key: answer} for several keys at once.
+
+    Misses are fetched together by fetch_many(keys) -> {key: value}; keys it leaves
+    out (failed or too slow) get their stale value if one exists, otherwise default.
+    Background refreshes call refresh(key).
+    """
+    answers, to_fetch = _split(kind, keys, refresh, is_empty)
+    if to_fetch:
+        error = "no answer in time"
+        try:
+            fetched = fetch_many(list(to_fetch))
+        except Exception as e:
+            fetched, error = {}, e
+        for key, stale_value in to_fetch.items():
+            if key in fetched:
+                _store(kind, key, fetched[key], is_empty(fetched[key]))
+                answers[key] = fetched[key]
+            else:
+                answers[key] = _fallback(kind, key, stale_value, default, error)
+    return answers
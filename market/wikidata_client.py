@@ -0,0 +1,285 @@
+"""
+Pooled HTTP client for the Wikidata search API and SPARQL endpoint.
+
+One requests.Session with a sized connection pool is shared by the process, so
+lookups reuse kept-alive TLS connections instead of paying a handshake each time.
+Independent calls (e.g. the SPARQL neighbourhoods of several candidate entities)
+run concurrently on a small thread pool, and every call made for one user
+request shares a single Deadline: each HTTP timeout is capped by the time left,
+and results that are not back when it expires are dropped.
+
+Identical requests already in flight are not sent again: later callers wait
+for the first one's answer (single-flight). A circuit breaker opens after
+WIKIDATA_BREAKER_THRESHOLD consecutive upstream errors or timeouts; while it is
+open calls fail immediately (callers serve cached or empty suggestions) and after
+WIKIDATA_BREAKER_RESET seconds one trial call decides whether it closes again.
+Outcomes are tallied in per-process counters (see status()).
+
+Base URLs, pool size and the overall budget come from settings
+(WIKIDATA_SEARCH_URL, WIKIDATA_SPARQL_URL, WIKIDATA_POOL_SIZE, WIKIDATA_DEADLINE),
+so tests can point the client at a local stub server.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import requests
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SEARCH_URL = "https://www.wikidata.org/w/api.php"
+DEFAULT_SPARQL_URL = "https://query.wikidata.org/sparql"
+USER_AGENT = "TimeBankApp/1.0 (community-timebank)"
+DEFAULT_POOL_SIZE = 8
+DEFAULT_DEADLINE = 4.0
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_BREAKER_RESET = 30.0
+# Never wait longer than this for a single upstream call, whatever the budget
+MAX_CALL_TIMEOUT = 10.0
+
+
+class WikidataError(Exception):
+    """Wikidata could not be reached or answered with an error"""
+
+
+class DeadlineExceeded(WikidataError):
+    """The time budget of the lookup ran out"""
+
+
+class CircuitOpen(WikidataError):
+    """Calls are short-circuited after repeated upstream failures"""
+
+
+class Deadline:
+    def __init__(self, seconds):
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self):
+        return self.expires - time.monotonic()
+
+    def timeout(self):
+        """HTTP timeout for the next call; raises if nothing is left"""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded("Wikidata time budget exhausted")
+        return min(remaining, MAX_CALL_TIMEOUT)
+
+
+class Counters:
+    """Thread-safe named counters"""
+
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def incr(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+
+
+# Process-wide; survive client rebuilds so the numbers keep adding up
+counters = Counters()
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, threshold=DEFAULT_BREAKER_THRESHOLD, reset_timeout=DEFAULT_BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may go upstream now; in half-open state only one trial call is let through"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                if self.state != self.OPEN:
+                    counters.incr('circuit_opened')
+                    logger.warning("Wikidata circuit opened after %d failures", self.failures)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time; concurrent callers share its result"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, deadline):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            counters.incr('deduplicated')
+            try:
+                return future.result(timeout=max(deadline.remaining(), 0))
+            except FutureTimeoutError:
+                raise DeadlineExceeded("Wikidata time budget exhausted") from None
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class WikidataClient:
+    def __init__(self, search_url=DEFAULT_SEARCH_URL, sparql_url=DEFAULT_SPARQL_URL,
+                 pool_size=DEFAULT_POOL_SIZE, deadline=DEFAULT_DEADLINE,
+                 breaker_threshold=DEFAULT_BREAKER_THRESHOLD, breaker_reset=DEFAULT_BREAKER_RESET):
+        self.search_url = search_url
+        self.sparql_url = sparql_url
+        self.default_deadline = deadline
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+        self.inflight = SingleFlight()
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='wikidata')
+
+    def deadline(self, seconds=None):
+        return Deadline(self.default_deadline if seconds is None else seconds)
+
+    def _get_json(self, url, params, deadline):
+        deadline = deadline or self.deadline()
+        key = (url, tuple(sorted(params.items())))
+        return self.inflight.do(key, lambda: self._call(url, params, deadline), deadline)
+
+    def _call(self, url, params, deadline):
+        timeout = deadline.timeout()
+        if not self.breaker.allow():
+            counters.incr('short_circuited')
+            raise CircuitOpen("Wikidata circuit is open")
+        counters.incr('requests')
+        try:
+            response = self.session.get(url, params=params, timeout=timeout)
+            response.raise_for_status()
+            data = response.json()
+        except requests.Timeout as e:
+            counters.incr('timeouts')
+            self.breaker.failure()
+            raise WikidataError(str(e)) from e
+        except requests.HTTPError as e:
+            counters.incr('errors')
+            # A malformed query is our problem, not an upstream outage
+            if e.response.status_code >= 500 or e.response.status_code == 429:
+                self.breaker.failure()
+            else:
+                self.breaker.success()
+            raise WikidataError(str(e)) from e
+        except (requests.RequestException, ValueError) as e:
+            counters.incr('errors')
+            self.breaker.failure()
+            raise WikidataError(f"Wikidata call to {url} failed: {e}") from e
+        self.breaker.success()
+        return data
+
+    def search(self, term, limit=5, deadline=None):
+        """wbsearchentities matches for term"""
+        params = {
+            "action": "wbsearchentities",
+            "search": term,
+            "language": "en",
+            "format": "json",
+            "type": "item",
+            "limit": limit,
+        }
+        return self._get_json(self.search_url, params, deadline).get("search", [])
+
+    def sparql(self, query, deadline=None):
+        """Result bindings of a SPARQL SELECT"""
+        data = self._get_json(self.sparql_url, {"query": query, "format": "json"}, deadline)
+        return data["results"]["bindings"]
+
+    def map(self, func, keys, deadline=None):
+        """Run func(key, deadline) for every key concurrently; {key: result} of the calls that
+        succeeded before the deadline. Failed or late keys are left out."""
+        deadline = deadline or self.deadline()
+        futures = {self.executor.submit(func, key, deadline): key for key in keys}
+        done, not_done = wait(futures, timeout=max(deadline.remaining(), 0))
+        for future in not_done:
+            future.cancel()
+        return {futures[future]: future.result() for future in done if future.exception() is None}
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Process-wide client built from settings"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = WikidataClient(
+                search_url=getattr(settings, 'WIKIDATA_SEARCH_URL', DEFAULT_SEARCH_URL),
+                sparql_url=getattr(settings, 'WIKIDATA_SPARQL_URL', DEFAULT_SPARQL_URL),
+                pool_size=getattr(settings, 'WIKIDATA_POOL_SIZE', DEFAULT_POOL_SIZE),
+                deadline=getattr(settings, 'WIKIDATA_DEADLINE', DEFAULT_DEADLINE),
+                breaker_threshold=getattr(settings, 'WIKIDATA_BREAKER_THRESHOLD', DEFAULT_BREAKER_THRESHOLD),
+                breaker_reset=getattr(settings, 'WIKIDATA_BREAKER_RESET', DEFAULT_BREAKER_RESET),
+            )
+        return _client
+
+
+def status():
+    """Circuit state and counters of this process, for monitoring"""
+    client = get_client()
+    return {
+        'circuit': client.breaker.state,
+        'consecutive_failures': client.breaker.failures,
+        'counters': counters.snapshot(),
+    }
+
+
+@receiver(setting_changed)
+def reset_client(setting, **kwargs):
+    global _client
+    if setting.startswith('WIKIDATA_'):
+        with _client_lock:
+            _client = None